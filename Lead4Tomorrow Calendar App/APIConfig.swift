@@ -11,4 +11,14 @@ import Foundation
 
 struct APIConfig {
     static let baseURL = "https://lead4tomorrow-mobile-app.onrender.com"
+
+    /// UserDefaults key for the session token returned by /login
+    static let sessionTokenKey = "L4TSessionToken"
+
+    /// Adds the stored session token (if any) as a Bearer Authorization header.
+    static func authorize(_ request: inout URLRequest) {
+        if let token = UserDefaults.standard.string(forKey: sessionTokenKey), !token.isEmpty {
+            request.setValue("Bearer \(token)", forHTTPHeaderField: "Authorization")
+        }
+    }
 }
@@ -25,6 +25,7 @@ func performDelete(email: String) async -> (ok: Bool, detail: String) {
         var r = URLRequest(url: url)
         r.httpMethod = method
         r.setValue("application/json", forHTTPHeaderField: "Content-Type")
+        APIConfig.authorize(&r)
         r.httpBody = try? JSONEncoder().encode(payload)
         return r
     }
@@ -32,6 +33,7 @@ func performDelete(email: String) async -> (ok: Bool, detail: String) {
         var r = URLRequest(url: url)
         r.httpMethod = method
         r.setValue("application/x-www-form-urlencoded", forHTTPHeaderField: "Content-Type")
+        APIConfig.authorize(&r)
         let body = fields.map { "\($0.key)=\($0.value.addingPercentEncoding(withAllowedCharacters: .urlQueryAllowed) ?? "")" }
                          .joined(separator: "&")
         r.httpBody = body.data(using: .utf8)
@@ -49,6 +51,7 @@ func performDelete(email: String) async -> (ok: Bool, detail: String) {
         if let qurl = comps.url {
             var r = URLRequest(url: qurl)
             r.httpMethod = "DELETE"
+            APIConfig.authorize(&r)
             result = await send(r)
             if result.ok { return result }
         }
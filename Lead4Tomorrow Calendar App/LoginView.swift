@@ -116,7 +116,7 @@ struct LoginView: View {
         req.setValue("application/json", forHTTPHeaderField: "Content-Type")
         req.httpBody = try? JSONEncoder().encode(payload)
 
-        URLSession.shared.dataTask(with: req) { _, resp, err in
+        URLSession.shared.dataTask(with: req) { data, resp, err in
             if let err = err {
                 DispatchQueue.main.async {
                     errorMessage = "Network error: \(err.localizedDescription)"
@@ -129,6 +129,12 @@ struct LoginView: View {
                 }
                 return
             }
+            // Keep the session token for authenticated profile requests
+            if let data = data,
+               let json = try? JSONSerialization.jsonObject(with: data) as? [String: Any],
+               let token = json["token"] as? String {
+                UserDefaults.standard.set(token, forKey: APIConfig.sessionTokenKey)
+            }
             DispatchQueue.main.async {
                 loggedInEmail = email
                 isLoggedIn = true
@@ -77,6 +77,7 @@ final class PushNotificationManager: NSObject, ObservableObject {
         var request = URLRequest(url: url)
         request.httpMethod = "POST"
         request.setValue("application/json", forHTTPHeaderField: "Content-Type")
+        APIConfig.authorize(&request)
 
         let body: [String: Any] = [
             "email": email,
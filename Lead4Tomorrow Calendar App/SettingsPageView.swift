@@ -196,6 +196,7 @@ struct SettingsPageView: View {
                 var del = URLRequest(url: endpoint)
                 del.httpMethod = "DELETE"
                 del.setValue("application/json", forHTTPHeaderField: "Content-Type")
+                APIConfig.authorize(&del)
                 del.httpBody = body
 
                 let (_, resp) = try await URLSession.shared.data(for: del)
@@ -209,6 +210,7 @@ struct SettingsPageView: View {
                 var post = URLRequest(url: endpoint)
                 post.httpMethod = "POST"
                 post.setValue("application/json", forHTTPHeaderField: "Content-Type")
+                APIConfig.authorize(&post)
                 post.httpBody = body
 
                 let (_, resp2) = try await URLSession.shared.data(for: post)
@@ -230,6 +232,7 @@ struct SettingsPageView: View {
         var request = URLRequest(url: url)
         request.httpMethod = "POST"
         request.setValue("application/json", forHTTPHeaderField: "Content-Type")
+        APIConfig.authorize(&request)
 
         let deviceToken = (UserDefaults.standard.string(forKey: "apnsDeviceToken") ?? "").trimmingCharacters(in: .whitespacesAndNewlines)
 
@@ -266,7 +269,10 @@ struct SettingsPageView: View {
         guard let encodedEmail = loggedInEmail.addingPercentEncoding(withAllowedCharacters: .urlQueryAllowed),
               let url = URL(string: "https://lead4tomorrow-mobile-app.onrender.com/get_profile?email=\(encodedEmail)") else { return }
 
-        URLSession.shared.dataTask(with: url) { data, _, _ in
+        var request = URLRequest(url: url)
+        APIConfig.authorize(&request)
+
+        URLSession.shared.dataTask(with: request) { data, _, _ in
             guard let data = data,
                   let profile = try? JSONSerialization.jsonObject(with: data) as? [String: Any] else {
                 print("Failed to load profile")
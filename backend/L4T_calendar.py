@@ -1,10 +1,12 @@
-import json
+import os
 import datetime
+import threading
 import utils
+import calendar_store
 import logging
+from rendering import RenderedMessage, render
 
 log = logging.getLogger(__name__)
-utils.config_log()
 
 
 class L4T_Calendar:
@@ -13,27 +15,44 @@ class L4T_Calendar:
     # ✅ Point to backend/storage/entries_shifted.json so it works on Render
     entries_filepath = utils.create_path("backend", "storage", "entries_shifted.json")
 
+    # Compiled, memory-mapped form of the entries (shared with the web app)
+    store_filepath = os.path.join(os.path.dirname(entries_filepath), "calendar.bin")
+
     def __init__(self):
-        # Load all calendar entries into a dictionary
-        with open(self.entries_filepath, "r", encoding="utf-8") as file:
-            self.entries = dict(json.load(file))
+        # Map the compiled store instead of parsing the JSON in every process;
+        # it is swapped for a new version when the content changes on disk
+        self.store = calendar_store.ReloadingStore(self.entries_filepath, self.store_filepath)
+        self.store.on_reload(self._drop_rendered)
+        self.writer = calendar_store.EntryWriter(self.store)
+
+        # (month, day, weekday) -> RenderedMessage
+        self._rendered = {}
+        self._rendered_lock = threading.Lock()
 
-    def get_curr_time(self, timezone: int = 0):
+    def _drop_rendered(self):
+        # Renders still running on the old store finish into the old dict
+        self._rendered = {}
+
+    def get_curr_time(self, timezone: float = 0, at: float | None = None):
         """Returns the current time as a `datetime` object.
 
-        `timezone`: hour difference from UTC. For example, Pacific Standard Time would be `-8`.
+        `timezone`: hour difference from UTC. For example, Pacific Standard Time would be `-8`
+        and India `5.5`.
+        `at`: optional POSIX timestamp to use instead of now.
         """
-        return datetime.datetime.now(
-            datetime.timezone(datetime.timedelta(hours=timezone))
-        )
+        tz = datetime.timezone(datetime.timedelta(hours=timezone))
+        if at is not None:
+            return datetime.datetime.fromtimestamp(at, tz)
+        return datetime.datetime.now(tz)
 
-    def get_today(self, timezone: int = 0, long_form: bool = False) -> dict[str, str]:
+    def get_today(self, timezone: float = 0, long_form: bool = False, at: float | None = None) -> dict[str, str]:
         """Returns the current month and day in a dictionary format.
 
         `timezone`: hour difference from UTC. For example, Pacific Standard Time would be `-8`.
         `long_form`: If `True`, returns the name of the month and day.
+        `at`: optional POSIX timestamp to use instead of now.
         """
-        today = self.get_curr_time(timezone)
+        today = self.get_curr_time(timezone, at)
 
         if not long_form:
             return {"month": today.strftime("%-m"), "day": today.strftime("%-d")}
@@ -47,24 +66,24 @@ class L4T_Calendar:
         No extra combining or shifting is done here.
         """
         try:
-            month = str(int(date["month"]))  # normalize month key
+            month = int(date["month"])
             raw_day = date.get("day")
-            day = str(int(raw_day)) if raw_day else None
+            day = int(raw_day) if raw_day else None
 
-            month_entries = self.entries.get(month)
-            if not month_entries:
+            store = self.store.current   # one version for the whole lookup
+            if not store.has_month(month):
                 return {"theme": "", "entry": ""}
 
+            theme = store.text(month, 0)
+
             # Only theme requested (no specific day)
             if day is None:
-                return {"theme": month_entries.get("theme", "")}
+                return {"theme": theme}
 
             # Direct lookup: shifted JSON is already preprocessed
-            entry_text = month_entries.get(day, "")
-
             return {
-                "theme": month_entries.get("theme", ""),
-                "entry": entry_text,
+                "theme": theme,
+                "entry": store.text(month, day),
             }
 
         except KeyError as err:
@@ -74,29 +93,40 @@ class L4T_Calendar:
             log.critical(f"`get_entry` unexpected error with date={date}: {err}")
             return {"theme": "", "entry": ""}
 
+    def render_message(self, today_short: dict, today_long: dict) -> RenderedMessage:
+        """Returns the notification for a date, rendering it only once per distinct date.
+
+        `today_short`/`today_long`: the two forms returned by `get_today`. The
+        result is cached by (month, day, weekday) until the content is reloaded.
+        """
+        key = (today_short["month"], today_short["day"], today_long["day"])
+        # Taken before rendering: a reload swaps the store first, then the
+        # cache, so a render from the old store never lands in the new cache
+        cache = self._rendered
+        rendered = cache.get(key)
+        if rendered is None:
+            rendered = self._render(today_short, today_long)
+            with self._rendered_lock:
+                cache[key] = rendered
+        return rendered
+
+    def _render(self, today_short: dict, today_long: dict) -> RenderedMessage:
+        entry = self.get_entry(today_short)
+        return render(entry["theme"], entry["entry"], today_short, today_long)
+
     def modify_entry(self, date: dict[str, str], new_entry: str) -> None:
         """Modifies an entry in the `entries_shifted.json` file.
 
         `date`: dictionary containing the specified date. Format: `{'month': '6', 'day': '24'}`.
         `new_entry`: str containing the new entry.
+
+        The edit is queued and written together with any others made within
+        `CALENDAR_WRITE_DELAY` seconds (see `calendar_store.EntryWriter`);
+        call `self.writer.flush()` to write right away.
         """
         month = str(int(date["month"]))
         day = str(int(date["day"])) if date["day"] else None
-
-        # Make sure the month exists
-        if month not in self.entries:
-            self.entries[month] = {"theme": ""}
-
-        if day is None:
-            # Update theme only
-            self.entries[month]["theme"] = new_entry
-        else:
-            # Update specific day
-            self.entries[month][day] = new_entry
-
-        # Write to JSON file
-        with open(self.entries_filepath, "w", encoding="utf-8") as file:
-            file.write(json.dumps(self.entries, indent=4))
+        self.writer.set(month, day, new_entry)
 
 
 if __name__ == "__main__":
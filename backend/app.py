@@ -1,41 +1,62 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
+import time
 import json
-import bcrypt
-import psycopg
+import base64
+import datetime
+from psycopg import sql
+
+# Connections are borrowed from a per-worker pool (see db.py) instead of
+# opening a new psycopg connection on every request.
+from db import get_connection, pool_stats
+from http_cache import send_cached
+from calendar_store import ReloadingStore
+from hashing import PasswordHasher, HashingBusy
+from auth import issue_token, require_session, require_admin, SESSION_TTL_SECONDS
+from profile_types import parse_preferences
+from profile_transfer import export_profiles, import_profiles, TransferError, IMPORT_CHUNK_ROWS
+from profile_cache import ProfileCache
+import metrics
 
 app = Flask(__name__)
 CORS(app)
 
-# PostgreSQL credentials from Render
-DB_HOST = "dpg-d1s18nje5dus73fm1qeg-a"
-DB_NAME = "lead4tomorrow"
-DB_USER = "lead4tomorrow_user"
-DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+# ----------------------------
+# Request metrics (served at /metrics)
+# ----------------------------
 
-def get_connection():
-    return psycopg.connect(
-        host=DB_HOST,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        autocommit=True
-    )
+HTTP_REQUESTS = metrics.Counter("http_requests_total", "Requests served", ["route", "method", "status"])
+HTTP_LATENCY = metrics.Histogram("http_request_duration_seconds", "Request latency", ["route", "method"])
 
 
-# ----------------------------
-# Calendar entries from shifted JSON
-# ----------------------------
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        # The rule, not the path, so query strings and bad URLs can't explode the label set
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        HTTP_REQUESTS.labels(route, request.method, response.status_code).inc()
+        HTTP_LATENCY.labels(route, request.method).observe(time.perf_counter() - start)
+    return response
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Point directly to the shifted entries file
-ENTRIES_PATH = os.path.join(BASE_DIR, "storage", "entries_shifted.json")
+# ----------------------------
+# Calendar entries from the compiled store
+# ----------------------------
 
-with open(ENTRIES_PATH, "r", encoding="utf-8") as f:
-    calendar_entries = json.load(f)
+# entries_shifted.json is compiled once into backend/storage/calendar.bin
+# (see calendar_store.py), which every worker mmaps. All response bodies,
+# their ETags and compressed variants are precomputed in that file. Edits
+# to either file are picked up within CALENDAR_RELOAD_SECONDS, no restart.
+calendar_store = ReloadingStore()
+CALENDAR_MAX_AGE = 86400
 
 
 @app.route("/", methods=["GET"])
@@ -46,7 +67,7 @@ def home():
 @app.route("/get_entry", methods=["GET"])
 def get_entry():
     """
-    Returns theme + entry for a given month/day directly from entries_shifted.json.
+    Returns theme + entry for a given month/day from the compiled calendar store.
 
     Query params:
       - month: "1".."12"
@@ -59,22 +80,57 @@ def get_entry():
         return jsonify({"error": "Missing month"}), 400
 
     try:
-        if month in calendar_entries:
-            theme = calendar_entries[month].get("theme", "")
-            entry = calendar_entries[month].get(day, "") if day else ""
-            return jsonify({"theme": theme, "entry": entry}), 200
-        else:
-            # Month not found, return empty but 200 (same behavior as before)
-            return jsonify({"theme": "", "entry": ""}), 200
+        return send_cached(calendar_store.entry_body(month, day), CALENDAR_MAX_AGE)
     except Exception as e:
         app.logger.exception(f"Error in /get_entry for month={month}, day={day}: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 
+@app.route("/get_month", methods=["GET"])
+def get_month():
+    """
+    Returns a whole month in one response: {"month", "theme", "entries": {day: text}}.
+
+    Query params:
+      - month: "1".."12"
+    Served pre-serialized and pre-compressed (br/gzip) with an ETag.
+    """
+    month = request.args.get("month")
+    if not month:
+        return jsonify({"error": "Missing month"}), 400
+
+    cached = calendar_store.month_body(month)
+    if cached is None:
+        return jsonify({"error": "Unknown month"}), 404
+    return send_cached(cached, CALENDAR_MAX_AGE)
+
+
+@app.route("/get_year", methods=["GET"])
+def get_year():
+    """Returns every month's theme and entries, keyed by month (same shape as entries_shifted.json)."""
+    return send_cached(calendar_store.year_body(), CALENDAR_MAX_AGE)
+
+
 # ----------------------------
 # Auth / Profiles
 # ----------------------------
 
+# bcrypt runs on a small bounded thread pool; when it is saturated requests
+# get a 429 right away instead of queueing behind a burst of logins.
+hasher = PasswordHasher()
+
+metrics.Callback("bcrypt_queue_depth", "Hash jobs waiting for a bcrypt thread", hasher.queue_depth)
+metrics.Callback("bcrypt_in_flight", "Hash jobs running or waiting", lambda: hasher.snapshot()["in_flight"])
+metrics.Callback("bcrypt_rejected_total", "Hash jobs rejected with 429 because the pool was full",
+                 lambda: hasher.snapshot()["rejected"], kind="counter")
+
+
+def busy_response():
+    response = jsonify({"error": "Server busy, please retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 429
+
+
 @app.route("/create_profile", methods=["POST"])
 def create_profile():
     data = request.json or {}
@@ -84,7 +140,10 @@ def create_profile():
     if not email or not password:
         return jsonify({"error": "email and password required"}), 400
 
-    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    try:
+        hashed = hasher.hash(password)
+    except HashingBusy:
+        return busy_response()
 
     with get_connection() as conn:
         cur = conn.cursor()
@@ -93,7 +152,7 @@ def create_profile():
             INSERT INTO profiles (email, password)
             VALUES (%s, %s)
             ON CONFLICT (email) DO NOTHING
-        """, (email, hashed.decode("utf-8")))
+        """, (email, hashed))
         cur.close()
 
     return jsonify({"message": "Account created"}), 200
@@ -114,12 +173,40 @@ def login():
         result = cur.fetchone()
         cur.close()
 
-    if result and bcrypt.checkpw(password.encode("utf-8"), result[0].encode("utf-8")):
-        return jsonify({"message": "Login successful"}), 200
-    return jsonify({"error": "Invalid credentials"}), 401
+    if not result:
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    try:
+        valid = hasher.verify(password, result[0])
+    except HashingBusy:
+        return busy_response()
+    if not valid:
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    if hasher.needs_rehash(result[0]):
+        # Work factor changed: store a hash at the new cost, off the request path
+        hasher.rehash_in_background(password, lambda new_hash: save_password_hash(email, result[0], new_hash))
+
+    # Signed session token for the profile routes (see auth.py)
+    return jsonify({
+        "message": "Login successful",
+        "token": issue_token(email),
+        "expires_in": SESSION_TTL_SECONDS,
+    }), 200
+
+
+def save_password_hash(email: str, old_hash: str, new_hash: str) -> None:
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Only replace the hash we verified, in case the password changed meanwhile
+        cur.execute("""
+            UPDATE profiles SET password = %s WHERE email = %s AND password = %s
+        """, (new_hash, email, old_hash))
+        cur.close()
 
 
 @app.route("/update_profile", methods=["POST"])
+@require_session
 def update_profile():
     """
     Upserts notification preferences and (optionally) device_token for a profile.
@@ -128,7 +215,7 @@ def update_profile():
     {
       "email": "...",
       "method": "email" | "push",
-      "timezone": "-5",        # string hours offset
+      "timezone": "-5",        # hours offset from UTC, or "+5:30"
       "time": "09:00",         # HH:MM
       "device_token": "..."    # optional
     }
@@ -136,6 +223,8 @@ def update_profile():
     Important behavior:
     - device_token is ONLY updated if provided and non-empty.
       This prevents wiping a valid token when the client posts settings without a token.
+    - method/timezone/time must parse when given (400 otherwise); they are
+      stored as sent and in typed columns (see profile_types.py).
     """
     data = request.json or {}
     email = data.get("email")
@@ -146,25 +235,42 @@ def update_profile():
 
     if not email:
         return jsonify({"error": "email required"}), 400
+    try:
+        typed = parse_preferences(method, timezone, time_val)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     with get_connection() as conn:
         cur = conn.cursor()
+        # send_minute_utc is set by a trigger from send_time + tz_offset_minutes
         cur.execute("""
-            INSERT INTO profiles (email, method, timezone, time, device_token)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO profiles (email, method, timezone, time, device_token,
+                                  notify_method, tz_offset_minutes, send_time)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             ON CONFLICT (email)
             DO UPDATE SET
                 method = EXCLUDED.method,
                 timezone = EXCLUDED.timezone,
                 time = EXCLUDED.time,
-                device_token = COALESCE(NULLIF(EXCLUDED.device_token, ''), profiles.device_token)
-        """, (email, method, timezone, time_val, device_token))
+                notify_method = EXCLUDED.notify_method,
+                tz_offset_minutes = EXCLUDED.tz_offset_minutes,
+                send_time = EXCLUDED.send_time,
+                device_token = COALESCE(NULLIF(EXCLUDED.device_token, ''), profiles.device_token),
+                -- A different token revives push delivery (see feedback.py)
+                device_token_status = CASE
+                    WHEN NULLIF(EXCLUDED.device_token, '') IS DISTINCT FROM profiles.device_token
+                         AND NULLIF(EXCLUDED.device_token, '') IS NOT NULL
+                    THEN 'active' ELSE profiles.device_token_status END,
+                updated_at = now()
+        """, (email, method, timezone, time_val, device_token, *typed))
         cur.close()
+    profile_cache.invalidate(email)
 
     return jsonify({"status": "success"}), 200
 
 
 @app.route("/register_device", methods=["POST"])
+@require_session
 def register_device():
     """
     Sets/updates device_token for an existing profile.
@@ -174,7 +280,8 @@ def register_device():
       "device_token": "64-char hex token"
     }
 
-    This is called by the app when APNs returns a token.
+    This is called by the app when APNs returns a token. It also clears a
+    token flagged dead by the notifier, so push delivery resumes.
     """
     data = request.json or {}
     email = data.get("email")
@@ -191,38 +298,114 @@ def register_device():
             INSERT INTO profiles (email, device_token)
             VALUES (%s, %s)
             ON CONFLICT (email)
-            DO UPDATE SET device_token = EXCLUDED.device_token
+            DO UPDATE SET
+                device_token = EXCLUDED.device_token,
+                device_token_status = 'active',
+                device_token_failure = NULL,
+                device_token_failed_at = NULL,
+                updated_at = now()
         """, (email, device_token))
         cur.close()
+    profile_cache.invalidate(email)
 
     return jsonify({"status": "success"}), 200
 
 
+def load_profile(email: str) -> dict | None:
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT method, timezone, time, device_token
+            FROM profiles
+            WHERE email = %s
+        """, (email,))
+        row = cur.fetchone()
+        cur.close()
+
+    if not row:
+        return None
+    return {
+        "method": row[0],
+        "timezone": row[1],
+        "time": row[2],
+        "device_token": row[3],
+    }
+
+
+# Read-through cache for /get_profile (see profile_cache.py); every route
+# that changes these fields invalidates the email after its write
+profile_cache = ProfileCache(load_profile)
+
+metrics.Callback("profile_cache_entries", "Profiles in this worker's in-process cache", profile_cache.size)
+
+
 @app.route("/get_profile", methods=["GET"])
+@require_session
 def get_profile():
     email = request.args.get("email")
     if not email:
         return jsonify({"error": "email required"}), 400
 
+    return jsonify(profile_cache.get(email) or {}), 200
+
+
+@app.route("/delivery_stats", methods=["GET"])
+@require_session
+def delivery_stats():
+    """Notification delivery history for one user, as written back by the notifier."""
+    email = request.args.get("email")
+    if not email:
+        return jsonify({"error": "email required"}), 400
+
     with get_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT method, timezone, time, device_token
-            FROM profiles
-            WHERE email = %s
+            SELECT p.device_token_status, p.device_token_failure, p.device_token_failed_at,
+                   s.sent, s.failed, s.consecutive_failures, s.last_failure, s.last_failed_at, s.last_sent_at
+            FROM profiles p
+            LEFT JOIN delivery_stats s ON s.email = p.email
+            WHERE p.email = %s
         """, (email,))
         row = cur.fetchone()
         cur.close()
 
-    if row:
-        return jsonify({
-            "method": row[0],
-            "timezone": row[1],
-            "time": row[2],
-            "device_token": row[3],
-        }), 200
+    if not row:
+        return jsonify({"error": "profile not found"}), 404
+
+    def iso(ts):
+        return ts.isoformat() if ts else None
+
+    return jsonify({
+        "device_token_status": row[0],
+        "device_token_failure": row[1],
+        "device_token_failed_at": iso(row[2]),
+        "sent": row[3] or 0,
+        "failed": row[4] or 0,
+        "consecutive_failures": row[5] or 0,
+        "last_failure": row[6],
+        "last_failed_at": iso(row[7]),
+        "last_sent_at": iso(row[8]),
+    }), 200
+
 
-    return jsonify({}), 200
+# Columns callers may request via ?fields= on the NDJSON feed
+PROFILE_FIELDS = ("email", "phone", "carrier", "method", "timezone", "time", "device_token",
+                  "device_token_status", "tz_offset_minutes", "send_minute_utc", "updated_at")
+PROFILE_PAGE_DEFAULT = 1000
+PROFILE_PAGE_MAX = 10000
+# Overlap applied to next_updated_since so rows committed late in the
+# previous poll are not missed (callers upsert, so duplicates are harmless).
+UPDATED_SINCE_OVERLAP = datetime.timedelta(seconds=5)
+
+
+def encode_cursor(updated_at: datetime.datetime, email: str) -> str:
+    raw = json.dumps([updated_at.isoformat(), email]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, str]:
+    updated_at, email = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return datetime.datetime.fromisoformat(updated_at), email
 
 
 @app.route("/show_profiles", methods=["GET"])
@@ -230,7 +413,22 @@ def show_profiles():
     """
     Returns all profiles as a dict keyed by email.
     Includes device_token for push.
+
+    With ?format=ndjson (or Accept: application/x-ndjson) returns one page of a
+    keyset-paginated feed instead, streamed as one JSON object per line:
+      - limit: page size (default 1000, max 10000)
+      - after: opaque cursor from the previous page's trailer
+      - fields: comma-separated columns to include (email is always included)
+      - updated_since: ISO-8601 timestamp; only rows changed at/after it
+    The last line is a trailer: {"_page": {"count", "next", "next_updated_since"}}.
     """
+    wants_ndjson = (
+        request.args.get("format") == "ndjson"
+        or request.accept_mimetypes.best == "application/x-ndjson"
+    )
+    if wants_ndjson:
+        return show_profiles_ndjson()
+
     with get_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
@@ -255,7 +453,144 @@ def show_profiles():
     return jsonify(profiles), 200
 
 
+def show_profiles_ndjson():
+    try:
+        limit = int(request.args.get("limit", PROFILE_PAGE_DEFAULT))
+        if not 1 <= limit <= PROFILE_PAGE_MAX:
+            raise ValueError(limit)
+    except ValueError:
+        return jsonify({"error": f"limit must be 1..{PROFILE_PAGE_MAX}"}), 400
+
+    fields = request.args.get("fields")
+    if fields:
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = sorted(set(fields) - set(PROFILE_FIELDS))
+        if unknown:
+            return jsonify({"error": f"unknown fields: {', '.join(unknown)}"}), 400
+    else:
+        fields = [f for f in PROFILE_FIELDS if f != "updated_at"]
+    if "email" not in fields:
+        fields.insert(0, "email")
+
+    conditions = []
+    params = []
+    updated_since = request.args.get("updated_since")
+    if updated_since:
+        try:
+            since = datetime.datetime.fromisoformat(updated_since)
+        except ValueError:
+            return jsonify({"error": "updated_since must be an ISO-8601 timestamp"}), 400
+        conditions.append(sql.SQL("updated_at >= %s"))
+        params.append(since)
+    after = request.args.get("after")
+    if after:
+        try:
+            after_ts, after_email = decode_cursor(after)
+        except Exception:
+            return jsonify({"error": "invalid cursor"}), 400
+        conditions.append(sql.SQL("(updated_at, email) > (%s, %s)"))
+        params.extend([after_ts, after_email])
+
+    # updated_at/email are always selected (last) to build the cursor
+    query = sql.SQL("SELECT {cols}, updated_at, email, now() FROM profiles {where} ORDER BY updated_at, email LIMIT %s").format(
+        cols=sql.SQL(", ").join(sql.Identifier(f) for f in fields),
+        where=sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+    )
+    params.append(limit)
+
+    def generate():
+        count = 0
+        last = None
+        db_now = None
+        with get_connection() as conn:
+            cur = conn.cursor()
+            for row in cur.stream(query, params):
+                *values, row_updated_at, row_email, db_now = row
+                last = (row_updated_at, row_email)
+                count += 1
+                item = {
+                    f: (v.isoformat() if isinstance(v, datetime.datetime) else v)
+                    for f, v in zip(fields, values)
+                }
+                yield json.dumps(item) + "\n"
+            cur.close()
+
+        if db_now is None:
+            db_now = datetime.datetime.now(datetime.timezone.utc)
+        trailer = {
+            "count": count,
+            "next": encode_cursor(*last) if last and count == limit else None,
+            "next_updated_since": (db_now - UPDATED_SINCE_OVERLAP).isoformat(),
+        }
+        yield json.dumps({"_page": trailer}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# ----------------------------
+# Bulk import/export (admin; see profile_transfer.py)
+# ----------------------------
+
+TRANSFER_MIMETYPES = {"csv": "text/csv", "binary": "application/octet-stream"}
+
+
+@app.route("/export_profiles", methods=["GET"])
+@require_admin
+def export_profiles_route():
+    """
+    Streams every profile with COPY.
+
+    Query params:
+      - format: "csv" (default, with a header line) or "binary"
+      - columns: comma-separated subset of profile_transfer.COLUMNS (default all)
+    """
+    fmt = request.args.get("format", "csv")
+    try:
+        blocks = export_profiles(fmt, request.args.get("columns"))
+    except TransferError as e:
+        return jsonify({"error": str(e)}), 400
+    response = Response(stream_with_context(blocks), mimetype=TRANSFER_MIMETYPES[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename=profiles.{'csv' if fmt == 'csv' else 'pgcopy'}"
+    return response
+
+
+@app.route("/import_profiles", methods=["POST"])
+@require_admin
+def import_profiles_route():
+    """
+    Upserts profiles from the request body (an /export_profiles file), chunk by chunk.
+
+    Query params: format ("csv" or "binary"), columns (binary only, as exported),
+    chunk (rows per transaction, default 50000).
+    Streams NDJSON progress, one line per merged chunk:
+    {"rows", "inserted", "updated", "skipped", "chunks"}; the last line adds
+    "done": true, or "error" if the import stopped (earlier chunks stay merged).
+    """
+    try:
+        chunk = int(request.args.get("chunk", IMPORT_CHUNK_ROWS))
+        progress = import_profiles(request.stream, request.args.get("format", "csv"),
+                                   request.args.get("columns"), chunk)
+    except ValueError as e:   # TransferError or a bad chunk
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        counts = {}
+        try:
+            for counts in progress:
+                yield json.dumps(counts) + "\n"
+            yield json.dumps({**counts, "done": True}) + "\n"
+        except Exception as e:
+            app.logger.exception(f"Profile import stopped: {e}")
+            yield json.dumps({**counts, "error": str(e)}) + "\n"
+        finally:
+            # Merged chunks may have changed any cached profile
+            profile_cache.clear()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route("/delete_profile", methods=["POST", "DELETE"])
+@require_session
 def delete_profile():
     """
     Deletes a profile by email.
@@ -281,6 +616,7 @@ def delete_profile():
             cur.execute("DELETE FROM profiles WHERE email = %s RETURNING email", (email,))
             deleted = cur.fetchone()
             cur.close()
+        profile_cache.invalidate(email)
         if deleted:
             return jsonify({"status": "deleted", "email": email}), 200
         else:
@@ -289,6 +625,18 @@ def delete_profile():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Connection pool (checkout waits, pool size) and bcrypt pool (queue depth, rejections) stats for this worker."""
+    return jsonify({"db": pool_stats(), "bcrypt": hasher.snapshot()}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text format; counters are per worker process."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route("/routes", methods=["GET"])
 def routes():
     return jsonify(sorted([str(r.rule) for r in app.url_map.iter_rules()])), 200
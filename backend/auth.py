@@ -0,0 +1,121 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+import secrets
+from functools import wraps
+
+from flask import g, jsonify, request
+
+log = logging.getLogger(__name__)
+
+# Shared by every worker so a token issued by one verifies on all of them.
+# Required: a per-process secret would make tokens fail on every other
+# worker and log everyone out on restart. Only a local debug run
+# (FLASK_DEBUG=1) falls back to one.
+SESSION_SECRET = os.environ.get("SESSION_SECRET")
+if not SESSION_SECRET:
+    if os.environ.get("FLASK_DEBUG", "").lower() not in ("1", "true"):
+        raise RuntimeError("SESSION_SECRET is not set; generate one with "
+                           "`python -c 'import secrets; print(secrets.token_hex(32))'` and set it on every process")
+    log.warning("SESSION_SECRET is not set; using a per-process secret (debug only)")
+    SESSION_SECRET = secrets.token_hex(32)
+_SECRET = SESSION_SECRET.encode("utf-8")
+
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", str(30 * 86400)))
+# Grace period for app builds that predate tokens: when true, requests
+# without a token are let through (a token that is sent is always checked).
+# Off by default; turn it on only while such builds are still in use.
+SESSION_GRACE_PERIOD = os.environ.get("SESSION_GRACE_PERIOD", "false").lower() == "true"
+if SESSION_GRACE_PERIOD:
+    log.warning("SESSION_GRACE_PERIOD is on: profile routes accept requests without a session token")
+
+# Static bearer token for the admin routes (bulk profile import/export);
+# they answer 404 while it is unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_SECRET, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(email: str, ttl: int = SESSION_TTL_SECONDS) -> str:
+    """Returns a signed `<payload>.<hmac>` session token for `email`."""
+    payload = _b64encode(json.dumps({"sub": email, "exp": int(time.time()) + ttl}, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str) -> str | None:
+    """Returns the email a token was issued for, or `None` if it is forged, malformed or expired."""
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+        if claims["exp"] < time.time():
+            return None
+        return claims["sub"]
+    except Exception:
+        return None
+
+
+def _request_email() -> str | None:
+    """The email a profile route is acting on, wherever the client put it."""
+    data = request.get_json(silent=True) or {}
+    return data.get("email") or request.args.get("email") or request.form.get("email")
+
+
+def require_session(view):
+    """Checks the `Authorization: Bearer <token>` header on a profile route.
+
+    The token must be valid and issued for the email the request acts on.
+    Sets `g.session_email`. No bcrypt or database work is involved.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get("Authorization", "")
+        token = header[7:].strip() if header.lower().startswith("bearer ") else None
+
+        if token is None:
+            if not SESSION_GRACE_PERIOD:
+                return jsonify({"error": "Authentication required"}), 401
+            log.info(f"Unauthenticated {request.method} {request.path} let through (SESSION_GRACE_PERIOD)")
+            g.session_email = None
+            return view(*args, **kwargs)
+
+        email = verify_token(token)
+        if email is None:
+            return jsonify({"error": "Invalid or expired session"}), 401
+        requested = _request_email()
+        if requested and requested != email:
+            return jsonify({"error": "Session does not match email"}), 403
+        g.session_email = email
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def require_admin(view):
+    """Checks `Authorization: Bearer <ADMIN_TOKEN>` on an admin route."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Not found"}), 404
+        header = request.headers.get("Authorization", "")
+        token = header[7:].strip() if header.lower().startswith("bearer ") else ""
+        if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+            return jsonify({"error": "Admin token required"}), 401
+        return view(*args, **kwargs)
+
+    return wrapper
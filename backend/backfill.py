@@ -0,0 +1,96 @@
+"""Fills the typed profile columns (migration 0006) for rows written before them.
+
+Run once after `python backend/schema.py`; it is safe to re-run and to run
+while the app is serving:
+
+    python backend/backfill.py [--batch 1000] [--pause 0.05]
+
+Rows are walked in email order, `--batch` at a time, each batch in its own
+short transaction, so only the rows of the batch being written are locked
+and only for milliseconds. A row the app changed after it was read is left
+alone (update_profile has already written its typed form). `updated_at` is
+not bumped: the typed values mean the same as the strings, so there is
+nothing for the notifier to re-read.
+"""
+import time
+import logging
+import argparse
+
+from db import get_connection
+from profile_types import parse_method, parse_tz_offset, parse_send_time
+
+log = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 1000
+# Seconds between batches, to leave I/O headroom for the app
+BACKFILL_PAUSE = 0.05
+
+
+def backfill_typed_columns(batch: int = BACKFILL_BATCH, pause: float = BACKFILL_PAUSE) -> dict:
+    """Converts `method`/`timezone`/`time` into the typed columns where those are unset.
+
+    Returns counts: `scanned` rows needing conversion, `updated` rows written,
+    `invalid` rows with at least one value that doesn't parse (left `NULL`).
+    """
+    counts = {"scanned": 0, "updated": 0, "invalid": 0}
+    last_email = ""
+    with get_connection() as conn:
+        while True:
+            with conn.transaction():
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT email, method, timezone, time
+                    FROM profiles
+                    WHERE email > %s
+                      AND ((method IS NOT NULL AND notify_method IS NULL)
+                        OR (timezone IS NOT NULL AND tz_offset_minutes IS NULL)
+                        OR (time IS NOT NULL AND send_time IS NULL))
+                    ORDER BY email
+                    LIMIT %s
+                """, (last_email, batch))
+                rows = cur.fetchall()
+                if not rows:
+                    cur.close()
+                    break
+                last_email = rows[-1][0]
+
+                typed = []
+                for email, method, timezone, time_raw in rows:
+                    values = (parse_method(method), parse_tz_offset(timezone), parse_send_time(time_raw))
+                    if any(raw is not None and value is None
+                           for raw, value in zip((method, timezone, time_raw), values)):
+                        counts["invalid"] += 1
+                    typed.append((email, method, timezone, time_raw, *values))
+
+                # Only rows whose strings are still the ones converted above
+                cur.execute("""
+                    UPDATE profiles AS p
+                    SET notify_method = COALESCE(p.notify_method, d.notify_method::notify_method),
+                        tz_offset_minutes = COALESCE(p.tz_offset_minutes, d.tz_offset_minutes),
+                        send_time = COALESCE(p.send_time, d.send_time)
+                    FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::smallint[], %s::time[])
+                        AS d(email, method, timezone, time, notify_method, tz_offset_minutes, send_time)
+                    WHERE p.email = d.email
+                      AND p.method IS NOT DISTINCT FROM d.method
+                      AND p.timezone IS NOT DISTINCT FROM d.timezone
+                      AND p.time IS NOT DISTINCT FROM d.time
+                """, [list(col) for col in zip(*typed)])
+                counts["scanned"] += len(rows)
+                counts["updated"] += cur.rowcount
+                cur.close()
+
+            log.info(f"Backfilled {counts['updated']} of {counts['scanned']} profile(s) so far (through {last_email})")
+            if pause:
+                time.sleep(pause)
+    return counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Fill the typed profile columns from the legacy strings.")
+    parser.add_argument("--batch", type=int, default=BACKFILL_BATCH, help="rows per transaction")
+    parser.add_argument("--pause", type=float, default=BACKFILL_PAUSE, help="seconds between batches")
+    args = parser.parse_args()
+    counts = backfill_typed_columns(args.batch, args.pause)
+    print(f"Scanned {counts['scanned']}, updated {counts['updated']}, "
+          f"{counts['invalid']} with values that don't parse (left unset)")
@@ -0,0 +1,519 @@
+"""Compiled, memory-mapped calendar store.
+
+`entries_shifted.json` is compiled into one immutable binary file:
+
+    header   magic (8s) | version (I) | slot count (I)
+    index    one (offset I, length I, hash 8s) record per slot
+    blob     UTF-8 text and pre-built response bodies
+
+Slots form a flat array addressed by `(kind, month, day)`: 32 slots per month
+(day 0 is the month theme), 13 "months" (month 0 holds whole-year bodies), and
+one block per kind. Every worker mmaps the same file, so the OS page cache
+holds a single shared copy, and responses are served from the stored bytes
+without any per-request JSON encoding.
+
+Build it with:
+
+    python backend/calendar_store.py [entries_shifted.json] [calendar.bin]
+
+Running processes pick up new content without a restart: `ReloadingStore`
+watches both files and swaps in the new mapping, and `EntryWriter` batches
+edits into one atomic rewrite of the JSON.
+
+Content is validated before it is compiled (see `validate_entries`): JSON
+that fails is never served, the last good store stays in service instead.
+"""
+import os
+import sys
+import gzip
+import time
+import json
+import mmap
+import fcntl
+import atexit
+import struct
+import hashlib
+import logging
+import calendar
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from http_cache import CachedBody, MIN_COMPRESS_BYTES, brotli, dump_json
+import metrics
+from rendering import DAY_THEMES, APNS_MAX_PAYLOAD_BYTES, render
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE_PATH = os.path.join(BASE_DIR, "storage", "entries_shifted.json")
+DEFAULT_STORE_PATH = os.path.join(BASE_DIR, "storage", "calendar.bin")
+
+MAGIC = b"L4TCAL\x00\x01"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+SLOT = struct.Struct("<II8s")
+
+# Slot kinds
+TEXT = 0            # raw theme (day 0) / entry text
+ENTRY_JSON = 1      # /get_entry body; day 0 is the theme-only body
+MONTH_JSON = 2      # /get_month body (day 0); month 0 day 0 is the /get_year body
+MONTH_GZIP = 3
+MONTH_BR = 4
+KINDS = 5
+
+DAYS_PER_MONTH = 32     # day 0 = theme, days 1..31
+MONTHS = 13             # month 0 = whole year
+SLOTS = KINDS * MONTHS * DAYS_PER_MONTH
+
+# Month 0 slot of ENTRY_JSON: body for an unknown month
+EMPTY_ENTRY = (ENTRY_JSON, 0, 0)
+
+_MISSING = 0xFFFFFFFF
+
+# Seconds between checks for changed content (0 disables reloading)
+CALENDAR_RELOAD_SECONDS = float(os.environ.get("CALENDAR_RELOAD_SECONDS", "5"))
+# Edits made within this many seconds of the first one are written together
+CALENDAR_WRITE_DELAY = float(os.environ.get("CALENDAR_WRITE_DELAY", "1"))
+
+RELOADS = metrics.Counter("calendar_reloads_total", "Calendar store swaps after the content changed")
+
+
+class ContentError(ValueError):
+    """The content failed validation; `problems` lists every issue found."""
+
+    def __init__(self, problems: list[str]):
+        super().__init__(f"{len(problems)} problem(s) in calendar content")
+        self.problems = problems
+
+
+def parse_key(key: str | None, limit: int) -> int:
+    """The number a month or day key stands for, or 0 if it isn't one of "1".."`limit`".
+
+    Keys are matched as stored, so "01", "+1" or " 1" are not accepted.
+    """
+    if key and key.isdigit() and str(int(key)) == key and int(key) <= limit:
+        return int(key)
+    return 0
+
+
+def max_payload_bytes(month: int, theme: str, day: int, text: str) -> int:
+    """Size of the day's APNs payload for its longest weekday variant."""
+    today_short = {"month": str(month), "day": str(day)}
+    return max(
+        len(render(theme, text, today_short, {"month": calendar.month_name[month], "day": weekday}).apns_payload_bytes)
+        for weekday in DAY_THEMES
+    )
+
+
+def validate_month(month_key: str, month_dict: dict) -> tuple[list[str], int]:
+    """Returns `(problems, largest payload in bytes)` for one month of `entries_shifted.json`.
+
+    - day keys are exactly 1..N for the month's length (28 or 29 for February)
+    - no empty theme or entry
+    - every day's push notification, rendered for each weekday, fits APNs' 4 KB
+    """
+    problems = []
+    month = parse_key(month_key, 12)
+    if not month:
+        return [f"month {month_key!r}: not a month number"], 0
+    if not isinstance(month_dict, dict):
+        return [f"month {month}: not an object"], 0
+
+    if not str(month_dict.get("theme", "")).strip():
+        problems.append(f"month {month}: empty theme")
+
+    lengths = {28, 29} if month == 2 else {calendar.monthrange(2023, month)[1]}
+    days = sorted(parse_key(k, 31) for k in month_dict if parse_key(k, 31))
+    others = sorted(k for k in month_dict if k != "theme" and not parse_key(k, 31))
+    if others:
+        problems.append(f"month {month}: unexpected keys {others}")
+    if days != list(range(1, len(days) + 1)) or len(days) not in lengths:
+        expected = " or ".join(str(n) for n in sorted(lengths))
+        problems.append(f"month {month}: has days {_ranges(days)}, expected 1..{expected}")
+
+    largest = 0
+    for day in days:
+        text = month_dict[str(day)]
+        if not isinstance(text, str) or not text.strip():
+            problems.append(f"{month}/{day}: empty entry")
+            continue
+        size = max_payload_bytes(month, month_dict.get("theme", ""), day, text)
+        largest = max(largest, size)
+        if size > APNS_MAX_PAYLOAD_BYTES:
+            problems.append(f"{month}/{day}: push payload is {size} bytes, over APNs' {APNS_MAX_PAYLOAD_BYTES}")
+    return problems, largest
+
+
+def validate_entries(entries: dict) -> dict[str, int]:
+    """Checks a whole `entries_shifted.json` dict: all 12 months, each passing `validate_month`.
+
+    Returns each month's largest payload in bytes. Raises `ContentError`
+    listing every problem.
+    """
+    problems, largest = [], {}
+    missing = sorted(set(range(1, 13)) - {parse_key(k, 12) for k in entries})
+    if missing:
+        problems.append(f"missing month(s) {_ranges(missing)}")
+    for month_key, month_dict in entries.items():
+        month_problems, largest[month_key] = validate_month(month_key, month_dict)
+        problems.extend(month_problems)
+    if problems:
+        raise ContentError(problems)
+    return largest
+
+
+def _ranges(days: list[int]) -> str:
+    """`[1, 2, 3, 5]` -> `"1-3, 5"`."""
+    parts = []
+    for day in days:
+        if parts and day == parts[-1][1] + 1:
+            parts[-1][1] = day
+        else:
+            parts.append([day, day])
+    return ", ".join(f"{a}-{b}" if a != b else str(a) for a, b in parts) or "none"
+
+
+def slot_index(kind: int, month: int, day: int) -> int:
+    return (kind * MONTHS + month) * DAYS_PER_MONTH + day
+
+
+def compile_entries(entries: dict) -> bytes:
+    """Compiles an `entries_shifted.json` dict into store bytes."""
+    blob = bytearray()
+    index = [(_MISSING, 0, b"\0" * 8)] * SLOTS
+
+    def put(kind, month, day, data: bytes):
+        index[slot_index(kind, month, day)] = (len(blob), len(data), hashlib.sha256(data).digest()[:8])
+        blob.extend(data)
+
+    def put_bulk(month, body: bytes):
+        put(MONTH_JSON, month, 0, body)
+        if len(body) >= MIN_COMPRESS_BYTES:
+            put(MONTH_GZIP, month, 0, gzip.compress(body, compresslevel=9, mtime=0))
+            if brotli:
+                put(MONTH_BR, month, 0, brotli.compress(body, quality=11))
+
+    put(*EMPTY_ENTRY, dump_json({"theme": "", "entry": ""}))
+    for month_key, month_entries in entries.items():
+        month = parse_key(month_key, 12)
+        if not month:
+            raise ValueError(f"Invalid month key {month_key!r}")
+        theme = month_entries.get("theme", "")
+        put(TEXT, month, 0, theme.encode("utf-8"))
+        put(ENTRY_JSON, month, 0, dump_json({"theme": theme, "entry": ""}))
+        for day in range(1, DAYS_PER_MONTH):
+            text = month_entries.get(str(day), "")
+            if text:
+                put(TEXT, month, day, text.encode("utf-8"))
+            put(ENTRY_JSON, month, day, dump_json({"theme": theme, "entry": text}))
+        days = {k: v for k, v in month_entries.items() if k != "theme"}
+        put_bulk(month, dump_json({"month": month_key, "theme": theme, "entries": days}))
+    put_bulk(0, dump_json(entries))
+
+    out = bytearray(HEADER.pack(MAGIC, VERSION, SLOTS))
+    for offset, length, digest in index:
+        out.extend(SLOT.pack(offset, length, digest))
+    out.extend(blob)
+    return bytes(out)
+
+
+def write_atomic(path: str, data: bytes, prefix: str) -> None:
+    """Writes `data` to a temp file next to `path`, then renames it over `path`."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=prefix, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock shared by every process on the host (on `path` + ".lock")."""
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build(source_path: str = DEFAULT_SOURCE_PATH, store_path: str = DEFAULT_STORE_PATH) -> str:
+    """Validates and compiles `source_path` into `store_path`, replacing it atomically.
+
+    Raises `ContentError` (leaving `store_path` untouched) if the content is invalid.
+    """
+    with open(source_path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    validate_entries(entries)
+    data = compile_entries(entries)
+    write_atomic(store_path, data, ".calendar-")
+    log.info(f"Built calendar store {store_path} ({len(data)} bytes)")
+    return store_path
+
+
+def _is_stale(source_path: str, store_path: str) -> bool:
+    try:
+        return os.path.getmtime(store_path) < os.path.getmtime(source_path)
+    except FileNotFoundError:
+        return True
+
+
+def _file_id(path: str):
+    """Changes whenever `path` is replaced or rewritten."""
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class CalendarStore:
+    """Read-only view over a compiled store file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version, slots = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION or slots != SLOTS:
+            raise ValueError(f"{path} is not a v{VERSION} calendar store; rebuild it")
+        self._blob_start = HEADER.size + SLOTS * SLOT.size
+
+    def _slot(self, kind, month, day):
+        return SLOT.unpack_from(self._mmap, HEADER.size + slot_index(kind, month, day) * SLOT.size)
+
+    def _bytes(self, kind, month, day) -> memoryview | None:
+        """Returns a zero-copy view of a slot's bytes, or `None` if it's empty."""
+        offset, length, _ = self._slot(kind, month, day)
+        if offset == _MISSING:
+            return None
+        start = self._blob_start + offset
+        return self._view[start:start + length]
+
+    def _cached(self, json_kind, month, day, compressed=False) -> CachedBody | None:
+        offset, _, digest = self._slot(json_kind, month, day)
+        if offset == _MISSING:
+            return None
+        return CachedBody(
+            self._bytes(json_kind, month, day),
+            digest.hex(),
+            self._bytes(MONTH_GZIP, month, day) if compressed else None,
+            self._bytes(MONTH_BR, month, day) if compressed else None,
+        )
+
+    def has_month(self, month: int) -> bool:
+        return 1 <= month <= 12 and self._slot(TEXT, month, 0)[0] != _MISSING
+
+    def text(self, month: int, day: int) -> str:
+        """Returns the entry text (or the theme for `day=0`); `""` if there is none."""
+        if not (self.has_month(month) and 0 <= day < DAYS_PER_MONTH):
+            return ""
+        data = self._bytes(TEXT, month, day)
+        return str(data, "utf-8") if data is not None else ""
+
+    def entry_body(self, month_key: str, day_key: str | None) -> CachedBody:
+        """Returns the `/get_entry` response for the raw `month`/`day` query values."""
+        month = parse_key(month_key, 12)
+        if not self.has_month(month):
+            return self._cached(*EMPTY_ENTRY)
+        return self._cached(ENTRY_JSON, month, parse_key(day_key, DAYS_PER_MONTH - 1))
+
+    def month_body(self, month_key: str) -> CachedBody | None:
+        """Returns the `/get_month` response, or `None` for an unknown month."""
+        month = parse_key(month_key, 12)
+        if not self.has_month(month):
+            return None
+        return self._cached(MONTH_JSON, month, 0, compressed=True)
+
+    def year_body(self) -> CachedBody:
+        """Returns the `/get_year` response."""
+        return self._cached(MONTH_JSON, 0, 0, compressed=True)
+
+    def close(self) -> None:
+        self._view.release()
+        self._mmap.close()
+
+
+def _log_rejected(source_path: str, error: ContentError) -> None:
+    log.error(f"Not serving {source_path}: {error}")
+    for problem in error.problems:
+        log.error(f"  {problem}")
+
+
+def load_or_build(source_path: str = DEFAULT_SOURCE_PATH, store_path: str = DEFAULT_STORE_PATH) -> CalendarStore:
+    """Opens the compiled store, (re)building it first if it is missing or older than the JSON.
+
+    If the JSON fails validation the existing store is served as is; with
+    no store to fall back on the `ContentError` is raised.
+    """
+    if _is_stale(source_path, store_path):
+        # Workers starting together build it once; the rest find it fresh
+        with file_lock(store_path):
+            if _is_stale(source_path, store_path):
+                try:
+                    build(source_path, store_path)
+                except ContentError as e:
+                    if not os.path.exists(store_path):
+                        raise
+                    _log_rejected(source_path, e)
+    try:
+        return CalendarStore(store_path)
+    except ValueError:
+        # Written by an older version of this module; rebuilt once, under the
+        # same lock, by whichever worker gets there first
+        with file_lock(store_path):
+            try:
+                return CalendarStore(store_path)
+            except ValueError:
+                build(source_path, store_path)
+        return CalendarStore(store_path)
+
+
+class ReloadingStore:
+    """The current `CalendarStore`, replaced whenever the content changes on disk.
+
+    A daemon thread checks the files every `interval` seconds: a JSON newer
+    than the compiled store is validated and recompiled (by one process,
+    under a file lock), and a replaced store file is mapped and swapped in
+    with a single reference assignment. A JSON that fails validation is
+    logged once and skipped until it changes again. Readers never wait for a reload; a request keeps
+    the store it started with, and an old mapping is unmapped once the last
+    response body referencing it is gone.
+
+    Exposes the `CalendarStore` read methods; use `current` to make several
+    reads from the same version.
+    """
+
+    def __init__(self, source_path: str = DEFAULT_SOURCE_PATH, store_path: str = DEFAULT_STORE_PATH,
+                 interval: float = CALENDAR_RELOAD_SECONDS):
+        self.source_path = source_path
+        self.store_path = store_path
+        self.current = load_or_build(source_path, store_path)
+        self._file_id = _file_id(store_path)
+        self._rejected = None   # file id of the last source that failed validation
+        self._listeners = []
+        self._lock = threading.Lock()
+        if interval > 0:
+            threading.Thread(target=self._watch, args=(interval,), name="calendar-reload", daemon=True).start()
+
+    def on_reload(self, callback) -> None:
+        """Calls `callback()` after each swap, e.g. to drop caches derived from the old content."""
+        self._listeners.append(callback)
+
+    def reload(self) -> bool:
+        """Rebuilds and swaps in the store if the files changed. Returns whether it swapped."""
+        with self._lock:
+            if _is_stale(self.source_path, self.store_path):
+                source_id = _file_id(self.source_path)
+                if source_id != self._rejected:
+                    with file_lock(self.store_path):
+                        if _is_stale(self.source_path, self.store_path):
+                            try:
+                                build(self.source_path, self.store_path)
+                            except ContentError as e:
+                                self._rejected = source_id
+                                _log_rejected(self.source_path, e)
+            file_id = _file_id(self.store_path)
+            if file_id == self._file_id:
+                return False
+            self.current = CalendarStore(self.store_path)
+            self._file_id = file_id
+        RELOADS.inc()
+        log.info(f"Reloaded calendar store {self.store_path}")
+        for callback in self._listeners:
+            callback()
+        return True
+
+    def _watch(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                # e.g. a half-edited JSON; the current store stays in service
+                log.error(f"Could not reload calendar store: {type(e).__name__}: {e}")
+
+    def has_month(self, month: int) -> bool:
+        return self.current.has_month(month)
+
+    def text(self, month: int, day: int) -> str:
+        return self.current.text(month, day)
+
+    def entry_body(self, month_key: str, day_key: str | None) -> CachedBody:
+        return self.current.entry_body(month_key, day_key)
+
+    def month_body(self, month_key: str) -> CachedBody | None:
+        return self.current.month_body(month_key)
+
+    def year_body(self) -> CachedBody:
+        return self.current.year_body()
+
+
+class EntryWriter:
+    """Batches edits to the JSON source into one atomic rewrite.
+
+    `set` only queues an edit; the first one starts a `delay`-second timer
+    after which every queued edit is applied in a single write. The write
+    holds a file lock while it reads, edits and replaces the JSON (temp file
+    + `os.replace`), so edits from other processes are never lost and
+    readers never see a partial file. The store is then recompiled and
+    reloaded; other processes pick the change up on their next check.
+
+    A batch that would leave the content invalid (see `validate_entries`) is
+    logged and dropped, and the JSON is left as it was.
+    """
+
+    def __init__(self, store: ReloadingStore, delay: float = CALENDAR_WRITE_DELAY):
+        self.store = store
+        self.delay = delay
+        self._pending = {}   # (month, day or "theme") -> text
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def set(self, month: str, day: str | None, text: str) -> None:
+        """Queues `text` as the entry for `month`/`day` (`day=None` sets the month's theme)."""
+        with self._lock:
+            self._pending[(month, day or "theme")] = text
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> int:
+        """Writes every queued edit now. Returns how many were written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        source_path = self.store.source_path
+        with file_lock(source_path):
+            with open(source_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for (month, key), text in pending.items():
+                entries.setdefault(month, {"theme": ""})[key] = text
+            try:
+                validate_entries(entries)
+            except ContentError as e:
+                log.error(f"Dropped {len(pending)} calendar edit(s): {e}")
+                for problem in e.problems:
+                    log.error(f"  {problem}")
+                return 0
+            write_atomic(source_path, json.dumps(entries, indent=4, ensure_ascii=False).encode("utf-8"),
+                          ".entries-")
+        log.info(f"Wrote {len(pending)} calendar edit(s) to {source_path}")
+        self.store.reload()
+        return len(pending)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    build(*sys.argv[1:3])
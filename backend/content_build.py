@@ -0,0 +1,207 @@
+"""Builds the served calendar content from `backend/storage/entries.json`.
+
+    python backend/content_build.py            # re-shift changed months, validate, publish
+    python backend/content_build.py --check    # validate only, write nothing
+    python backend/content_build.py --full     # re-shift every month
+    python backend/content_build.py --adopt    # first run: keep today's entries_shifted.json as is
+
+`entries.json` (one object per month: `"theme"` plus day keys) is the only
+source. Each month's text is hashed; only months whose hash differs from the
+manifest's are shifted again (see `shift_month`), the others keep their
+current output, including edits made through `L4T_Calendar.modify_entry`.
+A month marked `"shifted": true` holds text that was edited in its served
+form; it is published as is instead of being shifted. Every output month is
+then validated (see `calendar_store.validate_month`), and nothing is written
+unless every month passes.
+
+The build then publishes atomically: `entries_shifted.json`, the compiled
+`calendar.bin` that servers map directly (and hot-reload, see
+`calendar_store.ReloadingStore`), and `content_manifest.json`, recording the
+content version and the per-month hashes for the next incremental build.
+The manifest only depends on the content, so rebuilding unchanged content
+leaves it byte-for-byte the same.
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+
+import calendar_store
+from calendar_store import (DEFAULT_SOURCE_PATH, DEFAULT_STORE_PATH, ContentError, validate_entries,
+                            write_atomic, file_lock)
+from rendering import APNS_MAX_PAYLOAD_BYTES
+
+log = logging.getLogger(__name__)
+
+STORAGE_DIR = os.path.dirname(DEFAULT_SOURCE_PATH)
+ENTRIES_PATH = os.path.join(STORAGE_DIR, "entries.json")
+MANIFEST_PATH = os.path.join(STORAGE_DIR, "content_manifest.json")
+
+MANIFEST_FORMAT = 1
+
+
+def shift_month(month_dict: dict) -> dict:
+    """Shifts a month's entries back by one day.
+
+    New day 1 is old days 1 and 2 joined, day N becomes old day N+1, and
+    the last day keeps its text. The theme is kept as is.
+    """
+    # Keep theme as-is
+    theme = month_dict.get("theme", "")
+    # Collect numeric day keys only
+    day_keys = sorted(int(k) for k in month_dict if k != "theme")
+    if len(day_keys) < 2:
+        # Nothing to shift / merge
+        return dict(month_dict)
+
+    last_day = max(day_keys)
+    new_month = {"theme": theme}
+
+    # 1) New day 1 = old day1 + old day2
+    d1 = month_dict[str(day_keys[0])]
+    d2 = month_dict[str(day_keys[1])]
+    new_month["1"] = d1.rstrip() + " " + d2.lstrip()
+
+    # 2) For days 2..last-1, shift back by one (new d = old d+1)
+    for d in range(2, last_day):
+        new_month[str(d)] = month_dict[str(d + 1)]
+
+    # 3) For the last day, just duplicate the old last day
+    new_month[str(last_day)] = month_dict[str(last_day)]
+
+    return new_month
+
+
+def output_month(month_dict: dict) -> dict:
+    """The served form of a source month: shifted, unless marked `"shifted": true`."""
+    if month_dict.get("shifted") is True:
+        return {k: v for k, v in month_dict.items() if k != "shifted"}
+    return shift_month(month_dict)
+
+
+def month_hash(month_dict: dict) -> str:
+    return hashlib.sha256(json.dumps(month_dict, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def load_json(path: str, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def build_content(source: dict, manifest: dict | None, current: dict | None, mode: str = "incremental"):
+    """Computes the output months and the new manifest without writing anything.
+
+    `source`: `entries.json`. `manifest`/`current`: the previous manifest and
+    `entries_shifted.json`, if any. `mode`: `"incremental"`, `"full"` (shift
+    every month) or `"adopt"` (keep every current month as is).
+    Returns `(output, manifest, shifted_months)`. Raises `ContentError`.
+    """
+    previous = (manifest or {}).get("months", {})
+    output, sources, shifted = {}, {}, []
+
+    for month_key, month_dict in source.items():
+        sources[month_key] = month_hash(month_dict)
+        reuse = (
+            mode == "adopt"
+            or (mode == "incremental" and previous.get(month_key, {}).get("source_sha256") == sources[month_key])
+        ) and current and month_key in current
+        if reuse:
+            output[month_key] = current[month_key]
+        else:
+            output[month_key] = output_month(month_dict)
+            shifted.append(month_key)
+
+    largest = validate_entries(output)
+    months = {
+        month_key: {
+            "source_sha256": sources[month_key],
+            "sha256": month_hash(month_dict),
+            "days": sum(1 for k in month_dict if k != "theme"),
+            "max_payload_bytes": largest[month_key],
+        }
+        for month_key, month_dict in output.items()
+    }
+
+    content_hash = hashlib.sha256(
+        json.dumps(output, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    version = (manifest or {}).get("version", 0)
+    if (manifest or {}).get("content_sha256") != content_hash:
+        version += 1
+    new_manifest = {
+        "format": MANIFEST_FORMAT,
+        "version": version,
+        "content_sha256": content_hash,
+        "source": os.path.basename(ENTRIES_PATH),
+        "output": os.path.basename(DEFAULT_SOURCE_PATH),
+        "artifact": {
+            "path": os.path.basename(DEFAULT_STORE_PATH),
+            "store_version": calendar_store.VERSION,
+        },
+        "months": months,
+    }
+    return output, new_manifest, shifted
+
+
+def publish(output: dict, manifest: dict, output_path: str = DEFAULT_SOURCE_PATH,
+            store_path: str = DEFAULT_STORE_PATH, manifest_path: str = MANIFEST_PATH) -> None:
+    """Writes the output JSON (if its content changed), the compiled store and the manifest, each atomically.
+
+    `calendar_store.build` validates the JSON again, so the store and a
+    server's reload check the same rules as this build.
+    """
+    with file_lock(output_path):
+        if load_json(output_path) != output:
+            write_atomic(output_path, json.dumps(output, indent=4, ensure_ascii=False).encode("utf-8"), ".entries-")
+    calendar_store.build(output_path, store_path)
+    write_atomic(manifest_path, (json.dumps(manifest, indent=2) + "\n").encode("utf-8"), ".manifest-")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--check", action="store_true", help="validate only, write nothing")
+    mode.add_argument("--full", action="store_true", help="re-shift every month")
+    mode.add_argument("--adopt", action="store_true",
+                      help="keep the current entries_shifted.json for every month (first run)")
+    parser.add_argument("--source", default=ENTRIES_PATH, help="unshifted entries (default: %(default)s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    source = load_json(args.source)
+    if source is None:
+        sys.exit(f"{args.source} not found")
+    manifest = load_json(MANIFEST_PATH)
+    current = load_json(DEFAULT_SOURCE_PATH)
+    if manifest is None and current is not None and not (args.full or args.adopt or args.check):
+        # Without hashes every month would be re-shifted, losing edits made to the output
+        sys.exit(f"No {os.path.basename(MANIFEST_PATH)} yet: run with --adopt to keep the current "
+                 f"{os.path.basename(DEFAULT_SOURCE_PATH)}, or --full to rebuild it from {args.source}")
+
+    mode = "full" if args.full else "adopt" if args.adopt else "incremental"
+    try:
+        output, new_manifest, shifted = build_content(source, manifest, current, mode)
+    except ContentError as e:
+        for problem in e.problems:
+            print(f"  {problem}", file=sys.stderr)
+        sys.exit(f"{e}; nothing written")
+
+    largest = max(m["max_payload_bytes"] for m in new_manifest["months"].values())
+    print(f"{len(output)} month(s) valid; re-shifted: {', '.join(shifted) or 'none'}; "
+          f"largest push payload {largest}/{APNS_MAX_PAYLOAD_BYTES} bytes")
+    if args.check:
+        return
+    if manifest == new_manifest:
+        print(f"Content unchanged (version {manifest['version']})")
+        return
+    publish(output, new_manifest)
+    print(f"Published content version {new_manifest['version']}")
+
+
+if __name__ == "__main__":
+    main()
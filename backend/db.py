@@ -0,0 +1,131 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# PostgreSQL credentials from Render
+DB_HOST = os.getenv("DB_HOST", "dpg-d1s18nje5dus73fm1qeg-a")
+DB_NAME = os.getenv("DB_NAME", "lead4tomorrow")
+DB_USER = os.getenv("DB_USER", "lead4tomorrow_user")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+
+# Pool sizing is per process, i.e. per gunicorn worker. Keep
+# DB_POOL_MAX * WEB_CONCURRENCY (+ notifier) below Postgres's max_connections.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "4"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))        # max wait for a checkout (s)
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))     # close idle conns after (s)
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recycle conns after (s)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Checkout-wait metrics for this process
+_checkout_lock = threading.Lock()
+_checkout_stats = {"checkouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "timeouts": 0}
+
+CHECKOUT_SECONDS = metrics.Histogram("db_pool_checkout_seconds", "Time spent waiting for a pooled DB connection")
+CHECKOUT_TIMEOUTS = metrics.Counter("db_pool_timeouts_total", "DB connection checkouts that timed out")
+
+
+def _conninfo() -> str:
+    return f"host={DB_HOST} dbname={DB_NAME} user={DB_USER}"
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, opening it on first use.
+
+    The pool is created lazily so that it is opened *after* gunicorn forks its
+    workers; each worker ends up with its own pool of `DB_POOL_MIN`..`DB_POOL_MAX`
+    connections.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    _conninfo(),
+                    kwargs={"password": DB_PASSWORD, "autocommit": True},
+                    min_size=DB_POOL_MIN,
+                    max_size=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    check=ConnectionPool.check_connection,  # health check on checkout
+                    name="l4t",
+                    open=False,
+                )
+                pool.open()
+                log.info(f"Opened DB pool (min={DB_POOL_MIN}, max={DB_POOL_MAX}, pid={os.getpid()})")
+                _pool = pool
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """Borrows a connection from the pool for the duration of a `with` block.
+
+    Drop-in replacement for the old per-request `psycopg.connect()`; the
+    connection is returned to the pool (not closed) on exit.
+    """
+    pool = get_pool()
+    start = time.perf_counter()
+    try:
+        with pool.connection() as conn:
+            _record_checkout((time.perf_counter() - start) * 1000)
+            yield conn
+    except PoolTimeout:
+        with _checkout_lock:
+            _checkout_stats["timeouts"] += 1
+        CHECKOUT_TIMEOUTS.inc()
+        raise
+
+
+def _record_checkout(wait_ms: float) -> None:
+    CHECKOUT_SECONDS.observe(wait_ms / 1000)
+    with _checkout_lock:
+        _checkout_stats["checkouts"] += 1
+        _checkout_stats["wait_ms_total"] += wait_ms
+        if wait_ms > _checkout_stats["wait_ms_max"]:
+            _checkout_stats["wait_ms_max"] = wait_ms
+
+
+def pool_stats() -> dict:
+    """Returns checkout-wait metrics plus psycopg_pool's own counters for this process."""
+    with _checkout_lock:
+        stats = dict(_checkout_stats)
+    stats["wait_ms_avg"] = stats["wait_ms_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    stats["pid"] = os.getpid()
+    if _pool is not None:
+        stats["pool"] = _pool.get_stats()
+    return stats
+
+
+def _pool_connections():
+    if _pool is None:
+        return None
+    stats = _pool.get_stats()
+    return {
+        ("size",): stats.get("pool_size", 0),
+        ("available",): stats.get("pool_available", 0),
+        ("waiting",): stats.get("requests_waiting", 0),
+    }
+
+
+metrics.Callback("db_pool_connections", "Connections in this process's pool, by state", _pool_connections,
+                 labelnames=["state"])
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,246 @@
+import time
+import logging
+
+from utils import Sampler, log_event
+from scheduler import offset_minutes
+from push import PrecompiledPayload, device_token_error, SUCCESS, FAILURE_HINTS
+from feedback import TOKEN_DEAD
+from mailer import SUCCESS as EMAIL_SUCCESS
+from ledger import SENT, FAILED, RETRY
+import metrics
+
+log = logging.getLogger(__name__)
+
+SENDS = metrics.Counter("notifier_sends_total", "Notifications by method and outcome (Success or the failure reason)",
+                        ["method", "outcome"])
+SCHEDULE_LAG = metrics.Histogram("notifier_schedule_lag_seconds", "Delay between a user's due time and delivery",
+                                 buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+SKIPPED = metrics.Counter("notifier_skipped_total", "Due users not sent to, by reason", ["reason"])
+FEEDBACK_ERRORS = metrics.Counter("notifier_feedback_errors_total", "Ticks whose outcomes could not be written back")
+
+
+class DeliveryRunner:
+    """Claims, builds and sends one tick's notifications.
+
+    Holds no clients of its own: the notifier script wires in the real
+    calendar, ledger and dispatchers, and the benchmarks wire in stubs.
+    `email_dispatcher` / `push_dispatcher` may be `None` when not configured.
+    `feedback`: an optional `feedback.DeliveryFeedback` that flags dead push
+    tokens and keeps per-user delivery stats.
+    `retries`: an optional `retry.RetryQueue` deciding which failures are retried.
+    """
+
+    def __init__(self, calendar, ledger, email_dispatcher=None, push_dispatcher=None, feedback=None, retries=None):
+        self.calendar = calendar
+        self.ledger = ledger
+        self.email_dispatcher = email_dispatcher
+        self.push_dispatcher = push_dispatcher
+        self.feedback = feedback
+        self.retries = retries
+        self.sampled = Sampler()
+
+    def send_email_batch(self, email_jobs):
+        """Sends all emails collected during a tick in parallel over pooled SMTP sessions.
+
+        `email_jobs`: list of `(to_email, message)`, see `mailer.format_email`.
+        Returns `{to_email: result}`.
+        """
+        if not email_jobs:
+            return {}
+        if not self.email_dispatcher:
+            log.error(f"Cannot send {len(email_jobs)} email(s): missing Gmail credentials.")
+            return {to_email: "MissingCredentials" for to_email, _ in email_jobs}
+
+        return self.email_dispatcher.send_batch(email_jobs)
+
+    def send_push_batch(self, push_jobs):
+        """Sends all pushes collected during a tick concurrently.
+
+        `push_jobs`: list of `(email, device_token, payload)`.
+        Returns `{email: result}`.
+        """
+        if not push_jobs:
+            return {}
+        if not self.push_dispatcher:
+            log.error(f"APNs client not initialized; cannot send {len(push_jobs)} push(es).")
+            return {email: "NoAPNsClient" for email, _, _ in push_jobs}
+
+        token_results = self.push_dispatcher.send_batch([(token, payload) for _, token, payload in push_jobs])
+        return {email: token_results.get(token, "NoResult") for email, token, _ in push_jobs}
+
+    def local_date(self, profile, at) -> str:
+        """Returns the user's local date (ISO) at POSIX time `at`, for ledger keys."""
+        return self.calendar.get_curr_time(offset_minutes(profile) / 60, at).date().isoformat()
+
+    def notify_user(self, email, profile, at, push_jobs, email_jobs):
+        """Builds today's notification for one due user and queues it for delivery.
+
+        Nothing is sent here: pushes are appended to `push_jobs` as
+        `(email, device_token, payload)` and emails to `email_jobs` as
+        `(email, message)`; both are sent as batches at the end of the tick.
+        Nothing is logged either, beyond sampled debug lines: `record` logs
+        one `delivery` event per user.
+        `at`: the POSIX time the user was due (the start of their send minute),
+        which may be a little in the past when a late tick catches up.
+        Returns why nothing could be queued, or `None` if something was.
+        """
+        calendar = self.calendar
+        offset = offset_minutes(profile) / 60
+        today_short = calendar.get_today(offset, at=at)
+        today_long = calendar.get_today(offset, True, at=at)
+        method = (profile.method or "").lower()
+
+        # Rendered once per distinct date and shared by every recipient of it
+        rendered = calendar.render_message(today_short, today_long)
+        if log.isEnabledFor(logging.DEBUG) and self.sampled(email):
+            log.debug(f"{email}: due at {profile.time} (UTC{offset:+g}), {method}, "
+                      f"{today_long['day']} {today_long['month']} {today_short['day']}: {rendered.subject!r}")
+
+        if method == "email":
+            email_jobs.append((email, rendered.email_message))
+        elif method == "push":
+            device_token = profile.device_token
+            token_error = device_token_error(device_token)
+            if token_error:
+                # The user may need to re-enable push notifications in the app
+                return token_error
+            push_jobs.append((email, device_token, PrecompiledPayload(rendered.apns_payload, rendered.apns_payload_bytes)))
+        else:
+            return "UnknownMethod"
+        return None
+
+    def run_tick(self, due):
+        """Claims, builds and sends the notifications for one tick's due users.
+
+        `due`: list of `(email, profile, at)`, `at` being the user's due time.
+        Returns the outcomes recorded in the ledger, as
+        `(email, local_date, status, detail)`.
+        """
+        return self.deliver(self.claim(due))
+
+    def claim(self, due):
+        """Claims today's delivery in the ledger for each due user.
+
+        `due`: list of `(email, profile, at)`. Push users whose token is known
+        to be dead are skipped without a claim.
+        Returns the claimed ones as `deliver` items.
+        """
+        live = [d for d in due if not self.token_is_dead(d[1])]
+        if len(live) < len(due):
+            SKIPPED.labels("DeadDeviceToken").inc(len(due) - len(live))
+            log.debug(f"  → {len(due) - len(live)} user(s) with a dead device token, skipping")
+            due = live
+
+        keys = {email: self.local_date(profile, at) for email, profile, at in due}
+        try:
+            claimed = self.ledger.claim_many(list(keys.items()))
+        except Exception as e:
+            log.error(f"✗ Could not claim deliveries in ledger; skipping {len(keys)} user(s): {type(e).__name__}: {e}")
+            return []
+        if len(claimed) < len(keys):
+            log.debug(f"  → {len(keys) - len(claimed)} user(s) already sent today, skipping")
+
+        return [
+            (email, profile, at, keys[email], 0)
+            for email, profile, at in due
+            if (email, keys[email]) in claimed
+        ]
+
+    def deliver(self, items):
+        """Builds and sends claimed deliveries, then records how each one went.
+
+        `items`: list of `(email, profile, at, local_date, attempts)`, where
+        `attempts` counts earlier tries (0 on the user's regular tick).
+        Returns the outcomes recorded in the ledger, see `record`.
+        """
+        push_jobs, email_jobs, outcomes = self.build(items)
+        results = self.send_email_batch(email_jobs)
+        results.update(self.send_push_batch(push_jobs))
+        return self.record(items, results, outcomes)
+
+    def build(self, items):
+        """Builds the notifications for `deliver` items without sending them.
+
+        Returns `(push_jobs, email_jobs, outcomes)`: the jobs for
+        `send_push_batch` / `send_email_batch`, and `FAILED` outcomes for the
+        users nothing could be built for.
+        """
+        push_jobs = []
+        email_jobs = []
+        outcomes = []   # (email, local_date, status, detail)
+        for email, profile, at, date, _ in items:
+            try:
+                error = self.notify_user(email, profile, at, push_jobs, email_jobs)
+            except Exception as e:
+                log.exception(f"✗ Error building notification for {email}")
+                error = type(e).__name__
+            if error:
+                outcomes.append((email, date, FAILED, error))
+        return push_jobs, email_jobs, outcomes
+
+    def record(self, items, results, outcomes=()):
+        """Records the send `results` (`{email: result}`) of `deliver` items.
+
+        `outcomes`: outcomes already known, e.g. build failures from `build`.
+        With a retry queue, transient failures are parked as `RETRY` for a
+        later attempt instead of being recorded as `FAILED`.
+        Returns every outcome, as `(email, local_date, status, detail)`.
+        """
+        outcomes = list(outcomes)
+        by_email = {email: (profile, at, date, attempts) for email, profile, at, date, attempts in items}
+        failures = []
+        for email, result in results.items():
+            _, at, date, attempts = by_email[email]
+            if result in (SUCCESS, EMAIL_SUCCESS):
+                outcomes.append((email, date, SENT, None))
+            elif self.retries:
+                failures.append((email, date, result, attempts, at))
+            else:
+                outcomes.append((email, date, FAILED, str(result)))
+
+        retries = []
+        if failures:
+            retries, final = self.retries.plan(failures)
+            outcomes.extend(final)
+        try:
+            self.ledger.mark_many(outcomes)
+            self.ledger.schedule_retries(retries)
+        except Exception as e:
+            log.error(f"✗ Could not record {len(outcomes) + len(retries)} delivery outcome(s): {type(e).__name__}: {e}")
+        outcomes.extend((email, date, RETRY, detail) for email, date, detail, *_ in retries)
+
+        self.report_deliveries(outcomes, by_email)
+        final = [o for o in outcomes if o[2] != RETRY]
+        if self.feedback and final:
+            try:
+                self.feedback.record([
+                    (email, (by_email[email][0].method or "").lower(), by_email[email][0].device_token,
+                     status == SENT, detail)
+                    for email, _, status, detail in final
+                ])
+            except Exception as e:
+                FEEDBACK_ERRORS.inc()
+                log.error(f"✗ Could not write back {len(final)} delivery outcome(s): {type(e).__name__}: {e}")
+        return outcomes
+
+    @staticmethod
+    def token_is_dead(profile) -> bool:
+        return (profile.method or "").lower() == "push" and profile.device_token_status == TOKEN_DEAD
+
+    @staticmethod
+    def report_deliveries(outcomes, by_email):
+        """Logs one structured `delivery` event per outcome (WARNING for failures) and counts it."""
+        now = time.time()
+        for email, date, status, detail in outcomes:
+            profile, at, _, attempts = by_email[email]
+            method = (profile.method or "").lower()
+            lag = now - at
+            SENDS.labels(method, SUCCESS if status == SENT else detail).inc()
+            if status == SENT:
+                SCHEDULE_LAG.observe(lag)
+            log_event(
+                log, logging.INFO if status == SENT else logging.WARNING, "delivery", f"{status} {email}",
+                email=email, method=method, local_date=date, status=status,
+                detail=detail, hint=FAILURE_HINTS.get(detail) if detail else None,
+                attempt=attempts + 1, lag_s=round(lag, 3),
+            )
@@ -0,0 +1,106 @@
+import os
+import logging
+
+from push import PERMANENT_FAILURES
+
+log = logging.getLogger(__name__)
+
+# "postgres" writes delivery outcomes back to the profiles database (dead
+# device tokens, /delivery_stats); "off" disables it. Defaults to "postgres"
+# only for a notifier that already reads profiles from the DB
+# (NOTIFIER_PROFILE_SOURCE=postgres), since the default HTTP feed needs no
+# DB credentials.
+NOTIFIER_FEEDBACK = os.environ.get(
+    "NOTIFIER_FEEDBACK",
+    "postgres" if os.environ.get("NOTIFIER_PROFILE_SOURCE", "http") == "postgres" else "off",
+)
+
+# profiles.device_token_status values
+TOKEN_ACTIVE = "active"
+TOKEN_DEAD = "dead"
+
+
+class DeliveryFeedback:
+    """Writes a tick's delivery outcomes back to Postgres in two batched statements.
+
+    - Push tokens APNs rejected for good (`PERMANENT_FAILURES`) are flagged
+      `dead` in `profiles`, so the notifier skips them until the app
+      registers a new token. `updated_at` is bumped so every notifier worker
+      picks the change up on its next incremental refresh.
+    - Per-user counters in `delivery_stats` (sent, failed, consecutive
+      failures, last failure reason) back the `/delivery_stats` route.
+    """
+
+    def __init__(self):
+        from db import get_connection
+        self._get_connection = get_connection
+
+    def record(self, deliveries: list[tuple[str, str, str | None, bool, str | None]]) -> list[str]:
+        """Records `(email, method, device_token, succeeded, detail)` tuples.
+
+        Returns the emails whose token was flagged dead.
+        """
+        if not deliveries:
+            return []
+        dead = [(email, token, detail) for email, method, token, ok, detail in deliveries
+                if not ok and method == "push" and token and detail in PERMANENT_FAILURES]
+
+        with self._get_connection() as conn:
+            with conn.transaction():
+                cur = conn.cursor()
+                if dead:
+                    # Matching on the token too leaves a token registered meanwhile alone
+                    cur.execute("""
+                        UPDATE profiles AS p
+                        SET device_token_status = %s,
+                            device_token_failure = d.reason,
+                            device_token_failed_at = now(),
+                            updated_at = now()
+                        FROM unnest(%s::text[], %s::text[], %s::text[]) AS d(email, token, reason)
+                        WHERE p.email = d.email AND p.device_token = d.token
+                        RETURNING p.email
+                    """, (TOKEN_DEAD, *(list(col) for col in zip(*dead))))
+                    flagged = [row[0] for row in cur.fetchall()]
+                else:
+                    flagged = []
+
+                cur.execute("""
+                    INSERT INTO delivery_stats AS s
+                        (email, sent, failed, consecutive_failures, last_failure, last_failed_at, last_sent_at)
+                    SELECT email,
+                           ok::int,
+                           (NOT ok)::int,
+                           (NOT ok)::int,
+                           CASE WHEN ok THEN NULL ELSE detail END,
+                           CASE WHEN ok THEN NULL ELSE now() END,
+                           CASE WHEN ok THEN now() END
+                    FROM unnest(%s::text[], %s::bool[], %s::text[]) AS d(email, ok, detail)
+                    ON CONFLICT (email) DO UPDATE SET
+                        sent = s.sent + EXCLUDED.sent,
+                        failed = s.failed + EXCLUDED.failed,
+                        consecutive_failures = CASE WHEN EXCLUDED.sent > 0 THEN 0
+                                                    ELSE s.consecutive_failures + 1 END,
+                        last_failure = COALESCE(EXCLUDED.last_failure, s.last_failure),
+                        last_failed_at = COALESCE(EXCLUDED.last_failed_at, s.last_failed_at),
+                        last_sent_at = COALESCE(EXCLUDED.last_sent_at, s.last_sent_at)
+                """, (
+                    [d[0] for d in deliveries],
+                    [d[3] for d in deliveries],
+                    [d[4] for d in deliveries],
+                ))
+                cur.close()
+
+        if flagged:
+            log.info(f"Flagged {len(flagged)} dead device token(s)")
+        return flagged
+
+
+def open_feedback(spec: str = NOTIFIER_FEEDBACK):
+    """Returns the feedback writer named by `spec`, or `None` when it is `"off"`."""
+    if spec == "postgres":
+        return DeliveryFeedback()
+    if spec == "off":
+        log.info("Delivery feedback off: dead device tokens and delivery stats are not written back "
+                 "(set NOTIFIER_FEEDBACK=postgres to enable)")
+        return None
+    raise ValueError(f"Unknown NOTIFIER_FEEDBACK {spec!r}")
@@ -0,0 +1,117 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+log = logging.getLogger(__name__)
+
+# bcrypt work factor for new hashes. Existing hashes with a different cost
+# are transparently re-hashed on the next successful login.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+# Threads doing bcrypt work per process. bcrypt releases the GIL, so these
+# run in parallel with request threads and with each other.
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", "2"))
+# Hash requests allowed to wait for a thread before new ones are rejected
+BCRYPT_MAX_QUEUE = int(os.environ.get("BCRYPT_MAX_QUEUE", "8"))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should answer 429."""
+
+
+def hash_cost(hashed: str) -> int | None:
+    """Returns the cost parameter of a `$2b$12$...` bcrypt hash, or `None`."""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small bounded thread pool with backpressure.
+
+    At most `workers` hashes run at once and at most `max_queue` wait; past
+    that, `hash`/`verify` raise `HashingBusy` immediately instead of letting a
+    burst of logins tie up every request thread.
+    """
+
+    def __init__(self, workers: int = BCRYPT_WORKERS, max_queue: int = BCRYPT_MAX_QUEUE, rounds: int = BCRYPT_ROUNDS):
+        self.rounds = rounds
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, max_queue))
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.stats = {"submitted": 0, "rejected": 0, "rehashed": 0, "wait_ms_total": 0.0, "run_ms_total": 0.0}
+
+    def queue_depth(self) -> int:
+        """Hash jobs waiting for a thread (not counting the ones running)."""
+        with self._lock:
+            return max(0, self._pending - self.workers)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise HashingBusy()
+        submitted = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+            self.stats["submitted"] += 1
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.stats["wait_ms_total"] += (started - submitted) * 1000
+                    self.stats["run_ms_total"] += (time.perf_counter() - started) * 1000
+
+        try:
+            return self._executor.submit(job).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        """Returns a new bcrypt hash of `password` at the configured cost."""
+        return self._run(
+            lambda: bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(self.rounds)).decode("utf-8")
+        )
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(lambda: bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8")))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_cost(hashed) != self.rounds
+
+    def rehash_in_background(self, password: str, save) -> None:
+        """Hashes `password` at the current cost and calls `save(new_hash)`, off the request path.
+
+        Skipped silently when the pool is busy; it will be retried on a later login.
+        """
+        def task():
+            try:
+                save(self.hash(password))
+                with self._lock:
+                    self.stats["rehashed"] += 1
+            except HashingBusy:
+                pass
+            except Exception as e:
+                log.error(f"Password rehash failed: {type(e).__name__}: {e}")
+
+        threading.Thread(target=task, name="bcrypt-rehash", daemon=True).start()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = self._pending
+        stats["queue_depth"] = max(0, stats["in_flight"] - self.workers)
+        stats["workers"] = self.workers
+        stats["rounds"] = self.rounds
+        return stats
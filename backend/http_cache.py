@@ -0,0 +1,60 @@
+import json
+import logging
+from typing import NamedTuple
+
+from flask import Response, request
+
+log = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered without it
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+class CachedBody(NamedTuple):
+    """A response body serialized (and compressed) once, with its content-hash ETag.
+
+    Bodies may be `bytes` or zero-copy `memoryview`s into a `CalendarStore`.
+    """
+    identity: bytes | memoryview
+    etag: str
+    gzip: bytes | memoryview | None = None
+    br: bytes | memoryview | None = None
+
+
+def dump_json(obj) -> bytes:
+    """Serializes `obj` the way Flask's `jsonify` does in production (compact, sorted keys)."""
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def send_cached(cached: CachedBody, max_age: int, mimetype: str = "application/json") -> Response:
+    """Serves a `CachedBody`, answering conditional GETs with `304 Not Modified`.
+
+    Picks the best pre-compressed encoding the client accepts; each encoding
+    gets its own ETag so caches never mix them up.
+    """
+    body, encoding = cached.identity, None
+    accepted = request.accept_encodings
+    if cached.br is not None and accepted["br"]:
+        body, encoding = cached.br, "br"
+    elif cached.gzip is not None and accepted["gzip"]:
+        body, encoding = cached.gzip, "gzip"
+    etag = f"{cached.etag}-{encoding}" if encoding else cached.etag
+
+    headers = {
+        "Cache-Control": f"public, max-age={max_age}",
+        "Vary": "Accept-Encoding",
+    }
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        # WSGI needs real bytes: this is the only copy made per request
+        response = Response(bytes(body), status=200, mimetype=mimetype, headers=headers)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,289 @@
+import os
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+import utils
+
+log = logging.getLogger(__name__)
+
+# Where deliveries are recorded: "postgres" (shared by every notifier worker)
+# or "sqlite:<path>" (single host).
+NOTIFIER_LEDGER = os.environ.get(
+    "NOTIFIER_LEDGER",
+    "sqlite:" + utils.create_path("backend", "storage", "delivery_ledger.sqlite3"),
+)
+
+# Delivery states
+CLAIMED = "claimed"
+SENT = "sent"
+FAILED = "failed"
+RETRY = "retry"     # failed transiently; due again at next_attempt_at (see retry.py)
+
+# A claim not followed by an outcome this long after it was made is from a
+# worker that died mid-send; it is then recorded as failed (see expire_claims).
+# Must be longer than any tick's sends take.
+NOTIFIER_CLAIM_LEASE_SECONDS = float(os.environ.get("NOTIFIER_CLAIM_LEASE_SECONDS", "1800"))
+# Detail recorded for those claims: whether the message went out is unknown
+CLAIM_EXPIRED = "ClaimExpired"
+
+WORKER_ID = os.environ.get("NOTIFIER_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SQLiteLedger:
+    """Delivery ledger in a local SQLite file.
+
+    A row per (email, local_date) is inserted *before* sending; the unique key
+    makes a second claim for the same user and day fail, so restarts never
+    re-send. A claim whose worker crashed before recording the outcome is
+    marked failed by `expire_claims` once its lease is over.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS delivery_ledger (
+                email TEXT NOT NULL,
+                local_date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                detail TEXT,
+                worker TEXT,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (email, local_date)
+            )
+        """)
+        # Retry columns, added in place to ledgers created before them
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(delivery_ledger)")}
+        for name, decl in (("attempts", "INTEGER NOT NULL DEFAULT 0"), ("next_attempt_at", "REAL"), ("due_at", "REAL")):
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE delivery_ledger ADD COLUMN {name} {decl}")
+        if "claimed_at" not in columns:
+            self._conn.execute("ALTER TABLE delivery_ledger ADD COLUMN claimed_at REAL")
+            # updated_at is the claim time until an outcome is recorded (UTC, as strftime reads it)
+            self._conn.execute(
+                "UPDATE delivery_ledger SET claimed_at = CAST(strftime('%s', updated_at) AS REAL) WHERE status = ?",
+                (CLAIMED,),
+            )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS delivery_ledger_retry_idx ON delivery_ledger (next_attempt_at) "
+            f"WHERE status = '{RETRY}'"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS delivery_ledger_claimed_idx ON delivery_ledger (claimed_at) "
+            f"WHERE status = '{CLAIMED}'"
+        )
+
+    def claim_many(self, keys: list[tuple[str, str]]) -> set[tuple[str, str]]:
+        """Claims `(email, local_date)` keys; returns the ones this worker now owns."""
+        claimed = set()
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for email, local_date in keys:
+                    cur = self._conn.execute(
+                        "INSERT OR IGNORE INTO delivery_ledger (email, local_date, status, worker, claimed_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (email, local_date, CLAIMED, WORKER_ID, now),
+                    )
+                    if cur.rowcount == 1:
+                        claimed.add((email, local_date))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def mark_many(self, outcomes: list[tuple[str, str, str, str | None]]) -> None:
+        """Records `(email, local_date, status, detail)` outcomes of claimed deliveries."""
+        if not outcomes:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE delivery_ledger SET status = ?, detail = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE email = ? AND local_date = ?",
+                [(status, detail, email, local_date) for email, local_date, status, detail in outcomes],
+            )
+
+    def schedule_retries(self, retries: list[tuple[str, str, str, int, float, float]]) -> None:
+        """Parks `(email, local_date, detail, attempts, next_attempt_at, due_at)` deliveries for a retry.
+
+        Times are POSIX timestamps; `due_at` is when the user was first due.
+        """
+        if not retries:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE delivery_ledger SET status = ?, detail = ?, attempts = ?, next_attempt_at = ?, due_at = ?, "
+                "updated_at = CURRENT_TIMESTAMP WHERE email = ? AND local_date = ?",
+                [(RETRY, detail, attempts, next_at, due_at, email, local_date)
+                 for email, local_date, detail, attempts, next_at, due_at in retries],
+            )
+
+    def claim_retries(self, now: float, limit: int, lease_seconds: float) -> list[tuple[str, str, str, int, float]]:
+        """Takes up to `limit` retries due by `now`, as `(email, local_date, detail, attempts, due_at)`.
+
+        Their next attempt is pushed `lease_seconds` out, so a crash mid-retry
+        only delays them and nobody else picks them up meanwhile.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                rows = self._conn.execute(
+                    "SELECT email, local_date, detail, attempts, due_at FROM delivery_ledger "
+                    "WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (RETRY, now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE delivery_ledger SET next_attempt_at = ?, worker = ? WHERE email = ? AND local_date = ?",
+                    [(now + lease_seconds, WORKER_ID, email, local_date) for email, local_date, *_ in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def expire_claims(self, now: float, lease_seconds: float = NOTIFIER_CLAIM_LEASE_SECONDS) -> int:
+        """Marks claims older than `lease_seconds` with no outcome as failed. Returns the count.
+
+        Their worker died between claiming and recording, so the message may
+        or may not have gone out; like an indeterminate push, it isn't sent again.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE delivery_ledger SET status = ?, detail = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE status = ? AND claimed_at < ?",
+                (FAILED, CLAIM_EXPIRED, CLAIMED, now - lease_seconds),
+            ).rowcount
+
+    def retry_count(self) -> int:
+        """Deliveries currently waiting for a retry."""
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM delivery_ledger WHERE status = ?", (RETRY,)).fetchone()[0]
+
+    def prune(self, before_date: str) -> int:
+        """Deletes rows for local dates before `before_date` (ISO). Returns the count."""
+        with self._lock:
+            return self._conn.execute("DELETE FROM delivery_ledger WHERE local_date < ?", (before_date,)).rowcount
+
+
+class PostgresLedger:
+    """Delivery ledger in the `delivery_ledger` table (see schema.py).
+
+    Safe to share between several notifier workers: whichever worker inserts
+    the (email, local_date) row first owns that delivery.
+    """
+
+    def __init__(self):
+        from db import get_connection
+        self._get_connection = get_connection
+
+    def claim_many(self, keys: list[tuple[str, str]]) -> set[tuple[str, str]]:
+        if not keys:
+            return set()
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO delivery_ledger (email, local_date, status, worker, claimed_at)
+                SELECT email, local_date::date, %s, %s, %s
+                FROM unnest(%s::text[], %s::text[]) AS k(email, local_date)
+                ON CONFLICT (email, local_date) DO NOTHING
+                RETURNING email, local_date::text
+            """, (CLAIMED, WORKER_ID, time.time(), [k[0] for k in keys], [k[1] for k in keys]))
+            claimed = {(email, local_date) for email, local_date in cur.fetchall()}
+            cur.close()
+        return claimed
+
+    def mark_many(self, outcomes: list[tuple[str, str, str, str | None]]) -> None:
+        if not outcomes:
+            return
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE delivery_ledger AS l
+                SET status = o.status, detail = o.detail, updated_at = now()
+                FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[]) AS o(email, local_date, status, detail)
+                WHERE l.email = o.email AND l.local_date = o.local_date::date
+            """, tuple(list(col) for col in zip(*outcomes)))
+            cur.close()
+
+    def schedule_retries(self, retries: list[tuple[str, str, str, int, float, float]]) -> None:
+        if not retries:
+            return
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE delivery_ledger AS l
+                SET status = %s, detail = r.detail, attempts = r.attempts,
+                    next_attempt_at = r.next_attempt_at, due_at = r.due_at, updated_at = now()
+                FROM unnest(%s::text[], %s::text[], %s::text[], %s::int[], %s::float8[], %s::float8[])
+                    AS r(email, local_date, detail, attempts, next_attempt_at, due_at)
+                WHERE l.email = r.email AND l.local_date = r.local_date::date
+            """, (RETRY, *(list(col) for col in zip(*retries))))
+            cur.close()
+
+    def claim_retries(self, now: float, limit: int, lease_seconds: float) -> list[tuple[str, str, str, int, float]]:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            # SKIP LOCKED: concurrent workers each take a different set of rows
+            cur.execute("""
+                UPDATE delivery_ledger AS l
+                SET next_attempt_at = %s, worker = %s, updated_at = now()
+                FROM (
+                    SELECT email, local_date FROM delivery_ledger
+                    WHERE status = %s AND next_attempt_at <= %s
+                    ORDER BY next_attempt_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ) AS d
+                WHERE l.email = d.email AND l.local_date = d.local_date
+                RETURNING l.email, l.local_date::text, l.detail, l.attempts, l.due_at
+            """, (now + lease_seconds, WORKER_ID, RETRY, now, limit))
+            rows = cur.fetchall()
+            cur.close()
+        return rows
+
+    def expire_claims(self, now: float, lease_seconds: float = NOTIFIER_CLAIM_LEASE_SECONDS) -> int:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE delivery_ledger SET status = %s, detail = %s, updated_at = now()
+                WHERE status = %s AND claimed_at < %s
+            """, (FAILED, CLAIM_EXPIRED, CLAIMED, now - lease_seconds))
+            count = cur.rowcount
+            cur.close()
+        return count
+
+    def retry_count(self) -> int:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT count(*) FROM delivery_ledger WHERE status = %s", (RETRY,))
+            count = cur.fetchone()[0]
+            cur.close()
+        return count
+
+    def prune(self, before_date: str) -> int:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM delivery_ledger WHERE local_date < %s::date", (before_date,))
+            count = cur.rowcount
+            cur.close()
+        return count
+
+
+def open_ledger(spec: str = NOTIFIER_LEDGER):
+    """Opens the ledger described by `spec` (`"postgres"` or `"sqlite:<path>"`)."""
+    if spec == "postgres":
+        log.info("Using Postgres delivery ledger")
+        return PostgresLedger()
+    if spec.startswith("sqlite:"):
+        path = spec[len("sqlite:"):]
+        log.info(f"Using SQLite delivery ledger at {path}")
+        return SQLiteLedger(path)
+    raise ValueError(f"Unknown NOTIFIER_LEDGER {spec!r}")
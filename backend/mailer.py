@@ -0,0 +1,189 @@
+import os
+import time
+import queue
+import smtplib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "60"))
+# Max SMTP sessions kept open, which is also the max emails in flight
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "3"))
+# Sessions idle longer than this are probed with NOOP before reuse
+SMTP_IDLE_CHECK_SECONDS = 30
+
+# Result string for a delivered email
+SUCCESS = "Success"
+# Result for a 4xx SMTP reply: the server asks us to try again later
+TEMPORARY_FAILURE = "SMTPTemporaryFailure"
+
+# Errors rejecting one message; the session itself is still usable
+_MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+# Errors meaning the session died (e.g. server closed an idle connection)
+_BROKEN_SESSION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def format_email(sender: str, to_email: str, message: bytes) -> bytes:
+    """Returns the full RFC-822 message for one recipient.
+
+    `message`: the recipient-independent rest of the message (Subject and
+    MIME headers plus body), see `L4T_Calendar.render_message`.
+    """
+    return f"From: {sender}\r\nTo: {to_email}\r\n".encode("utf-8") + message
+
+
+class SMTPSessionPool:
+    """A small pool of authenticated SMTP sessions reused across recipients.
+
+    Sessions are opened lazily (connect + STARTTLS + login once), handed out
+    one caller at a time, and discarded and replaced if they fail.
+    """
+
+    def __init__(self, username, password, host=SMTP_HOST, port=SMTP_PORT,
+                 size=SMTP_POOL_SIZE, starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.timeout = timeout
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()           # (smtp, last_used) pairs
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self.stats = {"connects": 0, "reconnects": 0}
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._discard(smtp)
+            raise
+        with self._lock:
+            self.stats["connects"] += 1
+        log.debug(f"Opened SMTP session to {self.host}:{self.port}")
+        return smtp
+
+    @staticmethod
+    def _discard(smtp) -> None:
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                smtp, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < SMTP_IDLE_CHECK_SECONDS:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except Exception:
+                pass
+            self._discard(smtp)
+
+    def sendmail(self, sender: str, to_email: str, msg: bytes) -> None:
+        """Sends one message on a pooled session, reconnecting once if the session died."""
+        with self._slots:
+            smtp = self._checkout()
+            try:
+                smtp.sendmail(sender, [to_email], msg)
+            except _MESSAGE_ERRORS:
+                self._idle.put((smtp, time.monotonic()))
+                raise
+            except _BROKEN_SESSION_ERRORS:
+                self._discard(smtp)
+                with self._lock:
+                    self.stats["reconnects"] += 1
+                smtp = self._connect()
+                try:
+                    smtp.sendmail(sender, [to_email], msg)
+                except Exception:
+                    self._discard(smtp)
+                    raise
+            except Exception:
+                self._discard(smtp)
+                raise
+            self._idle.put((smtp, time.monotonic()))
+
+    def close(self) -> None:
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(smtp)
+
+
+class EmailDispatcher:
+    """Sends a tick's worth of emails in parallel over pooled SMTP sessions.
+
+    Shared by the tick (or the async pipeline's senders) and the retry
+    worker, so `stats` is updated under a lock.
+    """
+
+    def __init__(self, pool: SMTPSessionPool, sender: str, concurrency: int | None = None):
+        self.pool = pool
+        self.sender = sender
+        self.concurrency = max(1, min(concurrency or pool.size, pool.size))
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="smtp")
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "sent": 0, "succeeded": 0, "failed": 0,
+                      "last_batch_seconds": 0.0, "last_throughput": 0.0}
+
+    def _send_one(self, to_email, message) -> str:
+        try:
+            self.pool.sendmail(self.sender, to_email, format_email(self.sender, to_email, message))
+            return SUCCESS
+        except smtplib.SMTPResponseException as e:
+            log.debug(f"✗ Email error for {to_email}: {type(e).__name__}: {e}")
+            # 4xx replies (e.g. Gmail's 421/450/451 rate limits) are worth retrying; 5xx are not
+            return TEMPORARY_FAILURE if 400 <= e.smtp_code < 500 else type(e).__name__
+        except Exception as e:
+            # Reported in the caller's per-delivery log event
+            log.debug(f"✗ Email error for {to_email}: {type(e).__name__}: {e}")
+            return type(e).__name__
+
+    def send_batch(self, emails: list[tuple[str, bytes]]) -> dict[str, str]:
+        """Sends `(to_email, message)` pairs and returns `{to_email: result}`.
+
+        `message`: pre-encoded message without From/To, see `format_email`.
+        """
+        if not emails:
+            return {}
+        start = time.perf_counter()
+        futures = {to: self._executor.submit(self._send_one, to, message) for to, message in emails}
+        results = {to: f.result() for to, f in futures.items()}
+        elapsed = time.perf_counter() - start
+
+        succeeded = sum(1 for r in results.values() if r == SUCCESS)
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["sent"] += len(results)
+            self.stats["succeeded"] += succeeded
+            self.stats["failed"] += len(results) - succeeded
+            self.stats["last_batch_seconds"] = elapsed
+            self.stats["last_throughput"] = len(results) / elapsed if elapsed > 0 else 0.0
+
+        log.info(f"Email batch: {succeeded}/{len(results)} succeeded in {elapsed:.2f}s")
+        return results
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.pool.close()
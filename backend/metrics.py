@@ -0,0 +1,340 @@
+"""In-process metrics in the Prometheus text format.
+
+Counters and histograms are updated without locks: every thread writes to
+its own cell (a dict in a `threading.local`) and a scrape sums the cells of
+all threads. A lock is only taken the first time a thread touches a metric,
+the first time a label combination is seen, and when a thread exits (its
+cell is folded into a shared base, so short-lived threads don't pile up
+cells). Values are per process, so each gunicorn worker reports its own.
+
+    REQUESTS = Counter("http_requests_total", "Requests served", ["route", "status"])
+    REQUESTS.labels("/get_entry", "200").inc()
+
+Expose with `REGISTRY.render()` (the Flask app's `/metrics`) or
+`start_http_server(port)` (the notifier's side port).
+"""
+import time
+import bisect
+import logging
+import weakref
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; suits both request latencies and DB checkout waits
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                log.error(f"Could not collect metric {metric.name}: {type(e).__name__}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra="") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=(), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Returns the child for one combination of label values (cached)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._children_lock:
+                child = self._children.setdefault(values, self._child(tuple(str(v) for v in values)))
+        return child
+
+    def _child(self, key):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class _ThreadExit:
+    """Kept in a thread's `threading.local`; freed, and so finalized, when the thread exits."""
+
+
+class _PerThread:
+    """One cell per live thread; only the owning thread writes to it.
+
+    `merge(into, cell)` adds a cell's values to another cell. When a thread
+    exits, its cell is merged into `_base` and dropped.
+    """
+
+    def __init__(self, new_cell, merge):
+        self._new_cell = new_cell
+        self._merge = merge
+        self._local = threading.local()
+        self._base = new_cell()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = self._new_cell()
+            self._local.exit = _ThreadExit()
+            weakref.finalize(self._local.exit, self._retire, cell).atexit = False
+            with self._lock:
+                self._cells.append(cell)
+            return cell
+
+    def _retire(self, cell):
+        with self._lock:
+            self._merge(self._base, cell)
+            self._cells.remove(cell)
+
+    def total(self):
+        """A new cell holding the sum of every thread's cell, live or exited."""
+        total = self._new_cell()
+        with self._lock:   # a cell being retired is counted exactly once
+            self._merge(total, self._base)
+            for cell in self._cells:
+                self._merge(total, cell)
+        return total
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    class _Child:
+        __slots__ = ("_key", "_threads")
+
+        def __init__(self, key, threads):
+            self._key = key
+            self._threads = threads
+
+        def inc(self, amount: float = 1) -> None:
+            cell = self._threads.cell()
+            cell[self._key] = cell.get(self._key, 0) + amount
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self._threads = _PerThread(dict, Counter._merge)
+        super().__init__(name, help, labelnames, registry)
+
+    @staticmethod
+    def _merge(into, cell):
+        for key, value in cell.copy().items():
+            into[key] = into.get(key, 0) + value
+
+    def _child(self, key):
+        return Counter._Child(key, self._threads)
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def values(self) -> dict:
+        return self._threads.total()
+
+    def samples(self):
+        for key, value in sorted(self.values().items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative `le` buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    class _Child:
+        __slots__ = ("_key", "_threads", "_buckets")
+
+        def __init__(self, key, threads, buckets):
+            self._key = key
+            self._threads = threads
+            self._buckets = buckets
+
+        def observe(self, value: float) -> None:
+            cell = self._threads.cell()
+            counts = cell.get(self._key)
+            if counts is None:
+                # One slot per bucket, one for +Inf, then the sum
+                counts = cell[self._key] = [0] * (len(self._buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self._buckets, value)] += 1
+            counts[-1] += value
+
+        def time(self):
+            return _Timer(self)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        self._threads = _PerThread(dict, Histogram._merge)
+        super().__init__(name, help, labelnames, registry)
+
+    @staticmethod
+    def _merge(into, cell):
+        for key, counts in cell.copy().items():
+            counts = list(counts)
+            total = into.setdefault(key, [0] * len(counts))
+            for i, value in enumerate(counts):
+                total[i] += value
+
+    def _child(self, key):
+        return Histogram._Child(key, self._threads, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        for key, counts in sorted(self._threads.total().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(counts[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; the last `set` wins."""
+
+    kind = "gauge"
+
+    class _Child:
+        __slots__ = ("_key", "_values")
+
+        def __init__(self, key, values):
+            self._key = key
+            self._values = values
+
+        def set(self, value: float) -> None:
+            self._values[self._key] = value
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self._values = {}
+        super().__init__(name, help, labelnames, registry)
+
+    def _child(self, key):
+        return Gauge._Child(key, self._values)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def samples(self):
+        for key, value in sorted(self._values.copy().items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Callback(_Metric):
+    """A metric read from existing state at scrape time, e.g. a `stats` dict.
+
+    `fn` returns a number, or `{label_values_tuple: number}` for labelled metrics.
+    """
+
+    def __init__(self, name, help, fn, kind="gauge", labelnames=(), registry=REGISTRY):
+        self.fn = fn
+        self.kind = kind
+        super().__init__(name, help, labelnames, registry)
+
+    def samples(self):
+        value = self.fn()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for key, v in sorted(value.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(v)}"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would drown the logs
+
+
+def start_http_server(port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serves `/metrics` on a side port from a daemon thread (for processes without Flask)."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
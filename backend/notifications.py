@@ -1,58 +1,40 @@
+import sys
 import json
-import smtplib
 import time
+import atexit
+import asyncio
+import signal
+import datetime
+import utils
 from L4T_calendar import L4T_Calendar
+from scheduler import SendMinuteIndex, MinuteTicker, MINUTES_PER_DAY
 import logging
-import requests
 import os
 
-import collections
-import collections.abc
-
-# ------------------------------------------------------------------
-# Temporary compatibility patch for Python 3.13 + 'hyper' dependency
-# ------------------------------------------------------------------
-if not hasattr(collections, "Iterable"):
-    collections.Iterable = collections.abc.Iterable
-if not hasattr(collections, "Mapping"):
-    collections.Mapping = collections.abc.Mapping
-if not hasattr(collections, "MutableMapping"):
-    collections.MutableMapping = collections.abc.MutableMapping
-if not hasattr(collections, "MutableSet"):
-    collections.MutableSet = collections.abc.MutableSet
-if not hasattr(collections, "Callable"):
-    collections.Callable = collections.abc.Callable
-
-import ssl
-if not hasattr(ssl, 'verify_hostname'):
-    ssl.verify_hostname = lambda cert, hostname: None
-
-# APNS imports
-from apns2.client import APNsClient
-from apns2.credentials import TokenCredentials
-from apns2.payload import Payload
-from apns2.errors import (
-    BadDeviceToken,
-    Unregistered,
-    PayloadTooLarge,
-    TooManyRequests,
-    ServiceUnavailable,
-    InternalServerError,
-)
+from push import PushDispatcher, make_apns_client, PERMANENT_FAILURES
+from mailer import EmailDispatcher, SMTPSessionPool, SMTP_POOL_SIZE
+from ledger import open_ledger, NOTIFIER_LEDGER, NOTIFIER_CLAIM_LEASE_SECONDS, CLAIM_EXPIRED, WORKER_ID
+from delivery import DeliveryRunner
+from feedback import open_feedback, TOKEN_DEAD
+from retry import RetryQueue, RetryWorker
+from pipeline import DeliveryPipeline
+from shards import LeaseManager, NOTIFIER_SHARDS, shard_of
+from profile_source import open_profile_source
+import metrics
 
 
 # ----------------------------
 # Setup
 # ----------------------------
 
-calendar = L4T_Calendar()
-
-logging.basicConfig(
-    level=logging.DEBUG,  # Changed to DEBUG for more detailed logs
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+# One JSON object per line, written by a background thread. LOG_LEVEL,
+# LOG_FORMAT and LOG_SAMPLE_RATE tune it; `kill -USR1 <pid>` toggles debug.
+utils.config_log(default_format="json")
+utils.install_level_switch()
 log = logging.getLogger(__name__)
 
+calendar = L4T_Calendar()
+
 log.info("=== L4T NOTIFICATION SCRIPT (EMAIL + APNS PUSH) ===")
 
 # Gmail credentials (app password only)
@@ -80,22 +62,19 @@ log.info(f"APNS_TEAM_ID: {APNS_TEAM_ID}")
 log.info(f"APNS_TOPIC: {APNS_TOPIC}")
 log.info(f"APNS_USE_SANDBOX: {APNS_USE_SANDBOX}")
 
-apns_client = None
+# Optional override to target a local fake APNs server (tests/benchmarks)
+APNS_HOST = os.environ.get("APNS_HOST")
+APNS_PORT = os.environ.get("APNS_PORT")
+
+push_dispatcher = None
 if APNS_KEY_PATH and APNS_KEY_ID and APNS_TEAM_ID:
     try:
         log.info("Attempting to initialize APNs client...")
-        creds = TokenCredentials(
-            auth_key_path=APNS_KEY_PATH,
-            auth_key_id=APNS_KEY_ID,
-            team_id=APNS_TEAM_ID
-        )
-        log.debug("TokenCredentials created successfully")
-
-        apns_client = APNsClient(
-            credentials=creds,
-            use_sandbox=APNS_USE_SANDBOX,
-            use_alternative_port=False
+        apns_client = make_apns_client(
+            APNS_KEY_PATH, APNS_KEY_ID, APNS_TEAM_ID,
+            use_sandbox=APNS_USE_SANDBOX, host=APNS_HOST, port=APNS_PORT,
         )
+        push_dispatcher = PushDispatcher(apns_client, APNS_TOPIC)
 
         log.info(f"APNs client initialized successfully (sandbox={APNS_USE_SANDBOX})")
     except Exception as e:
@@ -107,341 +86,225 @@ else:
 # Backend: get profiles
 # ----------------------------
 
-def get_profiles():
+# NOTIFIER_PROFILE_SOURCE=postgres reads the DB directly (falling back to the
+# web app's HTTP feed); the default "http" only uses the feed.
+profile_source = open_profile_source()
+log.info(f"Profile source: {profile_source.name}")
+
+
+def get_profiles(updated_since=None):
+    """Fetches profiles from the configured source.
+
+    `updated_since`: only fetch profiles changed since this ISO timestamp.
+    Returns `(profiles, next_updated_since)`, where `profiles` is a dict of
+    `Profile` keyed by email, or `(None, None)` if the fetch failed.
+    """
     try:
-        log.debug("Fetching profiles from backend...")
-        response = requests.get(
-            "https://lead4tomorrow-mobile-app.onrender.com/show_profiles",
-            timeout=10
-        )
-        response.raise_for_status()
-        profiles = response.json()
-        log.info(f"Fetched {len(profiles)} profiles from backend")
-        log.debug(f"Profile emails: {list(profiles.keys())}")
-        return profiles
+        log.debug(f"Fetching profiles (updated_since={updated_since})...")
+        profiles, next_since = profile_source.fetch(updated_since)
+        log.info(f"Fetched {len(profiles)} profiles")
+        return profiles, next_since
     except Exception as e:
         log.error(f"Error fetching profiles: {type(e).__name__}: {e}")
-        return {}
+        return None, None
 
 # ----------------------------
 # Email sending
 # ----------------------------
 
-def send_email(to_email, subject, body):
-    if not username or not password:
-        log.error("Cannot send email: missing Gmail credentials.")
-        return
+EMAIL_CONCURRENCY = int(os.environ.get("EMAIL_CONCURRENCY", str(SMTP_POOL_SIZE)))
 
-    try:
-        log.info(f"Sending email to {to_email}...")
-        with smtplib.SMTP("smtp.gmail.com", 587, timeout=60) as smtp:
-            smtp.starttls()
-            smtp.login(username, password)
+email_dispatcher = None
+if username and password:
+    email_dispatcher = EmailDispatcher(SMTPSessionPool(username, password), username, EMAIL_CONCURRENCY)
 
-            msg = (
-                f"From: {username}\r\n"
-                f"To: {to_email}\r\n"
-                f"Subject: {subject}\r\n\r\n"
-                f"{body}"
-            )
+# ----------------------------
+# Per-user delivery
+# ----------------------------
 
-            smtp.sendmail(username, [to_email], msg)
+# Durable record of who was sent what day: a (email, local_date) row is
+# claimed before sending, so restarts and extra workers never double-send.
+ledger = open_ledger()
+LEDGER_RETENTION_DAYS = 7
 
-        log.info(f"✓ Email sent successfully to {to_email}")
+# With NOTIFIER_SHARDS > 0 several notifier processes split the users between
+# them by hash(email), each sending only for the shards it holds a lease on.
+lease_manager = None
+if NOTIFIER_SHARDS > 0:
+    if NOTIFIER_LEDGER != "postgres":
+        log.warning("Sharded notifier without NOTIFIER_LEDGER=postgres: workers can't see each other's deliveries")
+    lease_manager = LeaseManager(NOTIFIER_SHARDS, WORKER_ID)
+    # Hand shards back right away on a clean exit instead of waiting for expiry
+    atexit.register(lease_manager.release)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    log.info(f"Sharding enabled: {NOTIFIER_SHARDS} shards, worker {WORKER_ID}")
 
-    except Exception as e:
-        log.error(f"✗ Email error for {to_email}: {type(e).__name__}: {e}")
+# Flags dead push tokens and keeps per-user delivery stats in Postgres
+feedback = open_feedback()
 
-# ----------------------------
-# Push (APNs) sending
-# ----------------------------
+# Transient failures (APNs 429/503, SMTP 4xx, dropped connections) are parked
+# in the ledger and re-sent by a background thread with backoff
+retry_queue = RetryQueue(ledger)
 
-def send_push(device_token, subject, body):
-    if not apns_client:
-        log.error("APNs client not initialized; cannot send push.")
-        return
-
-    if not device_token:
-        log.error("No device_token provided; cannot send push.")
-        return
-    
-    # Validate device token format
-    if len(device_token) != 64:
-        log.error(f"=" * 60)
-        log.error(f"✗ INVALID DEVICE TOKEN LENGTH")
-        log.error(f"=" * 60)
-        log.error(f"Expected: 64 characters")
-        log.error(f"Received: {len(device_token)} characters")
-        log.error(f"Token: {device_token}")
-        log.error(f"=" * 60)
-        return
-    
-    # Check if token is hex
-    try:
-        int(device_token, 16)
-    except ValueError:
-        log.error(f"=" * 60)
-        log.error(f"✗ INVALID DEVICE TOKEN FORMAT")
-        log.error(f"=" * 60)
-        log.error(f"Token must be hexadecimal (0-9, a-f)")
-        log.error(f"Token: {device_token}")
-        log.error(f"=" * 60)
-        return
+runner = DeliveryRunner(calendar, ledger, email_dispatcher, push_dispatcher, feedback, retry_queue)
 
-    try:
-        log.info(f"=" * 60)
-        log.info(f"📱 PREPARING PUSH NOTIFICATION")
-        log.info(f"=" * 60)
-        log.info(f"Target device: {device_token[:8]}...{device_token[-8:]}")
-        log.info(f"Full device token: {device_token}")
-        log.info(f"Token length: {len(device_token)} (valid: 64)")
-        log.info(f"-" * 60)
-        log.info(f"NOTIFICATION TITLE:")
-        log.info(f"  {subject}")
-        log.info(f"-" * 60)
-        log.info(f"NOTIFICATION BODY ({len(body)} characters):")
-        log.info(f"{body}")
-        log.info(f"-" * 60)
-        log.info(f"APNs Topic: {APNS_TOPIC}")
-        log.info(f"Sandbox Mode: {APNS_USE_SANDBOX}")
-        log.info(f"Expiration: 24 hours from now ({int(time.time()) + 86400})")
-        log.info(f"=" * 60)
-        
-        # Create rich notification that's clickable and persistent
-        payload = Payload(
-            alert={
-                "title": subject,
-                "body": body,
-                "sound": "default"
-            },
-            badge=1,
-            sound="default",
-            content_available=True,  # Allows app to process in background
-            mutable_content=True,     # Allows notification to be modified
-            category="CALENDAR_NOTIFICATION"  # Custom category for handling
-        )
-        
-        log.info("📤 Payload created, sending to APNs...")
-
-        # Send with expiration time (notifications remain valid for 1 day)
-        apns_client.send_notification(
-            device_token,
-            payload,
-            topic=APNS_TOPIC,
-            expiration=int(time.time()) + 86400  # 24 hours from now
-        )
-
-        log.info(f"=" * 60)
-        log.info(f"✅ PUSH NOTIFICATION SENT SUCCESSFULLY!")
-        log.info(f"=" * 60)
-        log.info(f"Device: {device_token[:8]}...{device_token[-8:]}")
-        log.info(f"The notification should now:")
-        log.info(f"  ✓ Appear as a banner on the device")
-        log.info(f"  ✓ Play a sound")
-        log.info(f"  ✓ Show a badge on the app icon")
-        log.info(f"  ✓ Be stored in Notification Center history")
-        log.info(f"  ✓ Be clickable to open the app")
-        log.info(f"=" * 60)
-
-    except BadDeviceToken:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: BadDeviceToken")
-        log.error(f"=" * 60)
-        log.error(f"Device token {device_token[:8]}...{device_token[-8:]} is invalid")
-        log.error(f"This usually means:")
-        log.error(f"  - Token is from wrong environment (sandbox vs production)")
-        log.error(f"  - App was uninstalled and reinstalled")
-        log.error(f"  - Token format is incorrect")
-        log.error(f"Current environment: {'SANDBOX' if APNS_USE_SANDBOX else 'PRODUCTION'}")
-        log.error(f"=" * 60)
-    except Unregistered:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: Unregistered")
-        log.error(f"=" * 60)
-        log.error(f"Device {device_token[:8]}...{device_token[-8:]} is no longer registered")
-        log.error(f"This usually means the app was uninstalled")
-        log.error(f"=" * 60)
-    except PayloadTooLarge:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: PayloadTooLarge")
-        log.error(f"=" * 60)
-        log.error(f"The notification content is too large (max 4KB)")
-        log.error(f"Current body length: {len(body)} characters")
-        log.error(f"=" * 60)
-    except TooManyRequests:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: TooManyRequests")
-        log.error(f"=" * 60)
-        log.error(f"APNs rate limit exceeded - too many notifications sent too quickly")
-        log.error(f"=" * 60)
-    except ServiceUnavailable:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: ServiceUnavailable")
-        log.error(f"=" * 60)
-        log.error(f"Apple's APNs servers are temporarily down")
-        log.error(f"Will retry on next loop iteration")
-        log.error(f"=" * 60)
-    except InternalServerError:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: InternalServerError")
-        log.error(f"=" * 60)
-        log.error(f"APNs internal server error - this is on Apple's side")
-        log.error(f"=" * 60)
-    except ConnectionResetError as e:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: ConnectionResetError")
-        log.error(f"=" * 60)
-        log.error(f"APNs connection was reset - this usually means:")
-        log.error(f"  1. Device token is from WRONG ENVIRONMENT")
-        log.error(f"     - Current: {'SANDBOX' if APNS_USE_SANDBOX else 'PRODUCTION'}")
-        log.error(f"     - Token may be from: {'PRODUCTION' if APNS_USE_SANDBOX else 'SANDBOX'}")
-        log.error(f"  2. Device token is invalid or expired")
-        log.error(f"  3. App was uninstalled and token is stale")
-        log.error(f"")
-        log.error(f"TROUBLESHOOTING:")
-        log.error(f"  - Make sure app is installed via TestFlight (not Xcode)")
-        log.error(f"  - Reinstall app and re-register for notifications")
-        log.error(f"  - Verify device token is from current installation")
-        log.error(f"")
-        log.error(f"Full device token: {device_token}")
-        log.error(f"Error: {e}")
-        log.error(f"=" * 60)
-    except Exception as e:
-        log.error(f"=" * 60)
-        log.error(f"✗ PUSH NOTIFICATION FAILED: Unexpected Error")
-        log.error(f"=" * 60)
-        log.error(f"Error type: {type(e).__name__}")
-        log.error(f"Error message: {e}")
-        log.error(f"Full device token: {device_token}")
-        log.error(f"=" * 60)
-        import traceback
-        log.error(traceback.format_exc())
 
 # ----------------------------
 # Main loop
 # ----------------------------
 
-profiles_initial = get_profiles()
-sent_days = {email: None for email in profiles_initial.keys()}
+# How often the send-minute index is rebuilt from scratch. Only a rebuild
+# drops deleted profiles, so this bounds how long they keep being notified.
+# Between rebuilds each tick only pulls rows changed since the previous poll
+# and only touches the users due in the current minute.
+PROFILE_REFRESH_SECONDS = int(os.environ.get("PROFILE_REFRESH_SECONDS", "300"))
+
+index = SendMinuteIndex()
+profiles_since = None
+
+
+def refresh_index(full=False):
+    global profiles_since
+    profiles, next_since = get_profiles(None if full else profiles_since)
+    if profiles is None:
+        log.warning(f"Profile fetch failed; keeping existing index ({len(index)} users)")
+        return False
+    if full:
+        index.rebuild(profiles)
+        log.info(f"Indexed {len(index)} profiles by UTC send minute")
+    else:
+        for email, profile in profiles.items():
+            index.upsert(email, profile)
+        if profiles:
+            log.info(f"Applied {len(profiles)} profile change(s) to index")
+    profiles_since = next_since
+    return True
+
+
+# Minutes a restart may catch up on (the ledger prevents re-sends) and the
+# most a single late tick will try to catch up on.
+STARTUP_CATCHUP_MINUTES = int(os.environ.get("NOTIFIER_STARTUP_CATCHUP_MINUTES", "5"))
+MAX_CATCHUP_MINUTES = int(os.environ.get("NOTIFIER_MAX_CATCHUP_MINUTES", "60"))
+
+ticker = MinuteTicker(MAX_CATCHUP_MINUTES, STARTUP_CATCHUP_MINUTES)
+
+# ----------------------------
+# Metrics, scraped from a side port (0 disables it)
+# ----------------------------
+
+NOTIFIER_METRICS_PORT = int(os.environ.get("NOTIFIER_METRICS_PORT", "9108"))
+
+TICK_DURATION = metrics.Histogram("notifier_tick_duration_seconds", "Time to refresh, claim and send one tick",
+                                  buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 120))
+DUE_USERS = metrics.Histogram("notifier_due_users", "Users due per tick",
+                              buckets=(0, 1, 10, 100, 1000, 10000, 100000))
+metrics.Callback("notifier_tick_lag_seconds", "How late the last tick woke after its minute boundary",
+                 lambda: ticker.stats["last_lag_seconds"])
+metrics.Callback("notifier_overruns_total", "Ticks that ran past the next minute boundary",
+                 lambda: ticker.stats["overruns"], kind="counter")
+metrics.Callback("notifier_missed_minutes_total", "Minutes caught up on by late ticks",
+                 lambda: ticker.stats["missed_minutes"], kind="counter")
+metrics.Callback("notifier_dropped_minutes_total", "Minutes skipped for being older than the catch-up limit",
+                 lambda: ticker.stats["dropped_minutes"], kind="counter")
+metrics.Callback("notifier_indexed_users", "Profiles in the send-minute index", lambda: len(index))
+metrics.Callback("notifier_owned_shards", "Shards this worker holds a lease on",
+                 lambda: len(lease_manager.owned) if lease_manager else None)
+
+if NOTIFIER_METRICS_PORT:
+    try:
+        metrics.start_http_server(NOTIFIER_METRICS_PORT)
+    except OSError as e:
+        log.error(f"Could not serve metrics on port {NOTIFIER_METRICS_PORT}: {e}")
 
-log.info(f"Initialized sent_days for {len(sent_days)} users")
-log.debug(f"Initial sent_days: {sent_days}")
+# "threaded" runs each tick to completion before the next; "async" runs the
+# ticks and sends as an asyncio pipeline with bounded queues (see pipeline.py)
+NOTIFIER_MODE = os.environ.get("NOTIFIER_MODE", "threaded")
+if NOTIFIER_MODE not in ("threaded", "async"):
+    raise ValueError(f"Unknown NOTIFIER_MODE {NOTIFIER_MODE!r}")
 
+refresh_index(full=True)
+last_refresh = time.monotonic()
+
+retry_worker = RetryWorker(runner, lambda email: index.profiles.get(email)).start()
+atexit.register(retry_worker.stop, 5)
 loop_count = 0
 
-while True:
-    loop_count += 1
-    log.debug(f"--- Loop iteration {loop_count} ---")
-    
-    profiles = get_profiles()
+# Emails whose token APNs just rejected for good, flagged in the index at the
+# start of the next tick so they are skipped without waiting for a refresh
+newly_dead = []
 
-    for email, profile in profiles.items():
-        try:
-            # Timezone handling
-            tz_raw = profile.get("timezone")
-            try:
-                offset = int(tz_raw) if tz_raw else 0
-            except Exception:
-                offset = 0
-
-            current_time = calendar.get_curr_time(offset).strftime("%H:%M")
-            today_short = calendar.get_today(offset)
-            today_long = calendar.get_today(offset, True)
-            
-            user_time = profile.get("time")
-            method = (profile.get("method") or "").lower()
-            
-            log.debug(f"Checking {email}: method={method}, user_time={user_time}, current_time={current_time}, offset={offset}")
-            
-            # Check if already sent today
-            if email in sent_days and sent_days[email] == today_short:
-                log.debug(f"  → Already sent today for {email}, skipping")
-                continue
-            
-            # Check if it's time to send
-            if user_time != current_time:
-                log.debug(f"  → Time mismatch for {email}: {user_time} != {current_time}")
-                continue
-            
-            # Time matches and not sent today!
-            log.info(f"")
-            log.info(f"🎯" + "=" * 58 + "🎯")
-            log.info(f"⏰ TIME MATCH DETECTED!")
-            log.info(f"=" * 60)
-            log.info(f"User: {email}")
-            log.info(f"Method: {method.upper()}")
-            log.info(f"Current time: {current_time}")
-            log.info(f"User's scheduled time: {user_time}")
-            log.info(f"Date: {today_long['day']}, {today_long['month']} {today_short['day']}")
-            log.info(f"Timezone offset: {offset}")
-            log.info(f"=" * 60)
-            
-            entry = calendar.get_entry(today_short)
-            log.info(f"📖 Calendar Entry Retrieved:")
-            log.info(f"  Theme: {entry['theme']}")
-            log.info(f"  Entry length: {len(entry['entry'])} characters")
-            
-            # Determine day theme based on day of week
-            day_of_week = today_long.get('day', '')  # e.g., "Monday", "Tuesday"
-            day_themes = {
-                'Monday': 'Mindful Monday',
-                'Tuesday': 'Thoughtful Tuesday',
-                'Wednesday': "What's-Up Wednesday",
-                'Thursday': 'Thankful Thursday',
-                'Friday': 'Fast Fact Friday',
-                'Saturday': 'Self-Care Saturday',
-                'Sunday': 'Strong Family Sunday'
-            }
-            day_theme = day_themes.get(day_of_week, '')
-            log.info(f"  Day theme: {day_theme}")
-
-            subject = f"Lead4Tomorrow Calendar {today_short['month']}/{today_short['day']}"
-            message = f"""{today_long["month"]} is {entry["theme"]}.
-Today is {day_theme}, {today_long["month"]} {today_short["day"]}. {entry["entry"]}
-"""
-
-            log.info(f"")
-            log.info(f"📧 DELIVERY METHOD: {method.upper()}")
-            log.info(f"=" * 60)
-
-            if method == "email":
-                log.info(f"Sending EMAIL notification...")
-                send_email(email, subject, message)
-            elif method == "push":
-                device_token = profile.get("device_token")
-                if device_token:
-                    log.info(f"Sending PUSH notification...")
-                    log.debug(f"Device token (partial): {device_token[:16]}...{device_token[-16:]}")
-                    send_push(device_token, subject, message)
-                else:
-                    log.error(f"=" * 60)
-                    log.error(f"✗ CANNOT SEND PUSH: No device token found")
-                    log.error(f"=" * 60)
-                    log.error(f"User: {email}")
-                    log.error(f"Profile data: {profile}")
-                    log.error(f"The user may need to re-enable push notifications in the app")
-                    log.error(f"=" * 60)
-            else:
-                log.error(f"=" * 60)
-                log.error(f"✗ UNKNOWN NOTIFICATION METHOD")
-                log.error(f"=" * 60)
-                log.error(f"User: {email}")
-                log.error(f"Method received: '{method}'")
-                log.error(f"Valid methods are: 'email' or 'push'")
-                log.error(f"=" * 60)
-
-            # Mark as sent
-            sent_days[email] = today_short
-            log.info(f"")
-            log.info(f"✅ NOTIFICATION COMPLETE")
-            log.info(f"=" * 60)
-            log.info(f"User {email} marked as sent for {today_short['month']}/{today_short['day']}")
-            log.info(f"This user will not receive another notification until tomorrow")
-            log.info(f"=" * 60)
-            log.info(f"")
 
-        except Exception as e:
-            log.error(f"✗ Error in notification loop for {email}: {type(e).__name__}: {e}")
+def note_outcomes(outcomes):
+    newly_dead.extend(email for email, _, _, detail in outcomes if detail in PERMANENT_FAILURES)
+
 
-    log.debug(f"Sleeping for 60 seconds... (Loop {loop_count} complete)")
-    time.sleep(60)
+def select_due(minutes):
+    """Refreshes the index and returns the `(email, profile, at)` users due in `minutes` on our shards."""
+    global last_refresh
+    if profiles_since is None or time.monotonic() - last_refresh >= PROFILE_REFRESH_SECONDS:
+        if refresh_index(full=True):
+            last_refresh = time.monotonic()
+        try:
+            cutoff = (datetime.date.today() - datetime.timedelta(days=LEDGER_RETENTION_DAYS)).isoformat()
+            ledger.prune(cutoff)
+        except Exception as e:
+            log.error(f"Could not prune delivery ledger: {type(e).__name__}: {e}")
+        try:
+            expired = ledger.expire_claims(time.time())
+            if expired:
+                log.warning(f"Marked {expired} delivery claim(s) with no outcome after "
+                            f"{NOTIFIER_CLAIM_LEASE_SECONDS:.0f}s as failed ({CLAIM_EXPIRED})")
+        except Exception as e:
+            log.error(f"Could not expire delivery claims: {type(e).__name__}: {e}")
+    else:
+        refresh_index()
+
+    while newly_dead:
+        email = newly_dead.pop()
+        if email in index.profiles:
+            index.upsert(email, index.profiles[email]._replace(device_token_status=TOKEN_DEAD))
+
+    owned = lease_manager.heartbeat() if lease_manager else None
+    due = []
+    for minute in minutes:
+        for email, profile in index.due(minute):
+            if owned is None or shard_of(email, NOTIFIER_SHARDS) in owned:
+                due.append((email, profile, minute * 60))
+    return due
+
+
+def report_tick(minutes, due, duration):
+    global loop_count
+    loop_count += 1
+    TICK_DURATION.observe(duration)
+    DUE_USERS.observe(len(due))
+    utils.log_event(
+        log, logging.INFO if due else logging.DEBUG, "tick",
+        f"Tick {loop_count}: {len(due)} of {len(index)} users due, took {duration:.2f}s",
+        first_minute=minutes[0] % MINUTES_PER_DAY, last_minute=minutes[-1] % MINUTES_PER_DAY,
+        due=len(due), indexed=len(index), lag_s=round(ticker.stats["last_lag_seconds"], 3),
+        duration_s=round(duration, 3),
+    )
+
+
+if NOTIFIER_MODE == "async":
+    async def main():
+        pipeline = DeliveryPipeline(runner, on_outcomes=note_outcomes)
+        metrics.Callback("notifier_pipeline_queued", "Deliveries waiting in each pipeline stage's queue",
+                         pipeline.depths, labelnames=["stage"])
+        metrics.Callback("notifier_pipeline_in_flight", "Notifications being sent, per channel",
+                         lambda: {(k,): v for k, v in pipeline.in_flight.items()}, labelnames=["channel"])
+        # A tick's duration here is selecting and queueing its users, not sending them
+        await pipeline.run(ticker, select_due, report_tick)
+
+    log.info("Running the notifier as an asyncio pipeline")
+    asyncio.run(main())
+else:
+    while True:
+        # Wakes on the next minute boundary; after an overrun this returns every
+        # minute since the last tick so nobody whose time fell in between is skipped.
+        minutes = ticker.wait()
+        due = select_due(minutes)
+        if due:
+            note_outcomes(runner.run_tick(due))
+        report_tick(minutes, due, ticker.done())
@@ -0,0 +1,239 @@
+"""The notifier as an asyncio pipeline (`NOTIFIER_MODE=async`).
+
+    ticker → due-user selection → claim + render → email queue → email senders
+                                                 ↘ push queue  → push senders
+
+Each arrow is a bounded `asyncio.Queue`, so a slow stage makes the stages
+before it wait instead of piling up work in memory: a stalled SMTP server
+fills the email queue, which stalls rendering, which stalls the next tick's
+selection. Ticks no longer wait for the previous tick's sends, and each
+channel sends in batches as soon as work arrives, one batch in flight while
+the previous one is recorded.
+
+The clients underneath (apns2 over hyper, smtplib, psycopg, SQLite) are
+blocking, so each stage hands its batch to a worker thread; the event loop
+only moves work between queues and is never blocked by I/O.
+
+On SIGTERM (or SIGINT) no new tick is started and queued deliveries are sent
+for up to `NOTIFIER_DRAIN_SECONDS`. Whatever is still queued after that is
+parked in the ledger as a retry, so it is sent after the restart.
+"""
+import os
+import signal
+import asyncio
+import logging
+
+from push import PUSH_MAX_IN_FLIGHT
+
+log = logging.getLogger(__name__)
+
+# Deliveries each stage queue holds before the stage feeding it has to wait
+NOTIFIER_QUEUE_SIZE = int(os.environ.get("NOTIFIER_QUEUE_SIZE", "5000"))
+# Batches sent at once per channel
+NOTIFIER_SENDERS = int(os.environ.get("NOTIFIER_SENDERS", "2"))
+# How long SIGTERM waits for queued and in-flight sends; keep it under the
+# platform's kill timeout (30 s on Render)
+NOTIFIER_DRAIN_SECONDS = float(os.environ.get("NOTIFIER_DRAIN_SECONDS", "25"))
+
+# Most deliveries taken off a queue in one step
+CLAIM_BATCH = 500
+EMAIL_BATCH = 100
+PUSH_BATCH = PUSH_MAX_IN_FLIGHT
+
+# Result recorded for deliveries still queued when the drain timed out
+# (retried, see retry.RETRY_POLICIES)
+INTERRUPTED = "Interrupted"
+
+
+async def _take(queue: asyncio.Queue, limit: int) -> list:
+    """Waits for one item, then takes whatever else is already queued, up to `limit`."""
+    items = [await queue.get()]
+    while len(items) < limit:
+        try:
+            items.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return items
+
+
+def _done(queue: asyncio.Queue, count: int) -> None:
+    for _ in range(count):
+        queue.task_done()
+
+
+def _drain(queue: asyncio.Queue) -> list:
+    """Empties `queue` without waiting; returns what was in it."""
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+        queue.task_done()
+    return items
+
+
+class DeliveryPipeline:
+    """Claims, renders and sends due users through bounded per-stage queues.
+
+    `runner`: the notifier's `delivery.DeliveryRunner`, whose `claim`,
+    `build`, `send_*_batch` and `record` steps the stages run.
+    `on_outcomes(outcomes)`: optional, called on the event loop with every
+    batch of recorded outcomes.
+    """
+
+    def __init__(self, runner, queue_size: int = NOTIFIER_QUEUE_SIZE, senders: int = NOTIFIER_SENDERS,
+                 on_outcomes=None):
+        self.runner = runner
+        self.on_outcomes = on_outcomes
+        self.senders = max(1, senders)
+        self.due = asyncio.Queue(queue_size)   # (email, profile, at)
+        # channel -> (queue of (item, job), send function, batch size)
+        self.channels = {
+            "email": (asyncio.Queue(queue_size), runner.send_email_batch, EMAIL_BATCH),
+            "push": (asyncio.Queue(queue_size), runner.send_push_batch, PUSH_BATCH),
+        }
+        self.in_flight = {channel: 0 for channel in self.channels}
+        self._tasks = []
+        self._closing = False
+        self._parked = []   # claimed deliveries kept out of the channel queues while stopping
+
+    def depths(self) -> dict:
+        """Deliveries waiting in each stage's queue, keyed by `(stage,)`."""
+        depths = {("due",): self.due.qsize()}
+        depths.update({(channel,): queue.qsize() for channel, (queue, _, _) in self.channels.items()})
+        return depths
+
+    def start(self) -> "DeliveryPipeline":
+        """Starts the stage tasks on the running event loop."""
+        self._tasks = [asyncio.create_task(self._prepare_stage(), name="pipeline-prepare")]
+        for channel in self.channels:
+            for i in range(self.senders):
+                self._tasks.append(asyncio.create_task(self._send_stage(channel), name=f"pipeline-{channel}-{i}"))
+        return self
+
+    async def submit(self, due) -> None:
+        """Queues `(email, profile, at)` due users; waits while the pipeline is full."""
+        for entry in due:
+            await self.due.put(entry)
+
+    async def join(self) -> None:
+        """Waits until everything submitted so far has been sent and recorded."""
+        await self.due.join()
+        for queue, _, _ in self.channels.values():
+            await queue.join()
+
+    async def _prepare_stage(self):
+        """Claims due users in the ledger and renders their notifications into the channel queues."""
+        while True:
+            batch = await _take(self.due, CLAIM_BATCH)
+            try:
+                items, push_jobs, email_jobs, failed = await asyncio.to_thread(self._prepare, batch)
+                if failed:
+                    await self._record(items, {}, failed)
+                by_email = {item[0]: item for item in items}
+                for channel, jobs in (("email", email_jobs), ("push", push_jobs)):
+                    queue = self.channels[channel][0]
+                    for job in jobs:
+                        if self._closing:
+                            self._parked.append(by_email[job[0]])
+                        else:
+                            await queue.put((by_email[job[0]], job))
+            except Exception:
+                log.exception(f"✗ Could not prepare {len(batch)} due user(s)")
+            finally:
+                _done(self.due, len(batch))
+
+    def _prepare(self, due):
+        items = self.runner.claim(due)
+        push_jobs, email_jobs, failed = self.runner.build(items)
+        return items, push_jobs, email_jobs, failed
+
+    async def _send_stage(self, channel: str):
+        queue, send, limit = self.channels[channel]
+        while True:
+            batch = await _take(queue, limit)
+            self.in_flight[channel] += len(batch)
+            try:
+                results = await asyncio.to_thread(send, [job for _, job in batch])
+                await self._record([item for item, _ in batch], results)
+            except Exception:
+                log.exception(f"✗ Could not send {len(batch)} {channel} notification(s)")
+            finally:
+                self.in_flight[channel] -= len(batch)
+                _done(queue, len(batch))
+
+    async def _record(self, items, results, outcomes=()):
+        outcomes = await asyncio.to_thread(self.runner.record, items, results, outcomes)
+        if self.on_outcomes:
+            self.on_outcomes(outcomes)
+
+    async def stop(self, timeout: float = NOTIFIER_DRAIN_SECONDS) -> None:
+        """Sends what is queued for up to `timeout` seconds, then stops the stages.
+
+        Deliveries still queued for a channel after that were claimed but
+        never sent; they are recorded as `INTERRUPTED` (a retry, when the
+        runner has a retry queue). Due users not yet claimed are dropped: a
+        restart's catch-up (or the next worker) claims them. Batches already
+        handed to a client are always finished and recorded.
+        """
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Drain timed out after {timeout:.0f}s; {sum(self.in_flight.values())} send(s) in flight, "
+                        f"queued: {', '.join(f'{k[0]}={v}' for k, v in self.depths().items())}")
+
+        self._closing = True
+        _drain(self.due)
+        unsent = self._drain_channels()
+        await self.due.join()   # the batch being prepared parks its jobs instead of queueing them
+        unsent += self._drain_channels() + self._parked
+        self._parked = []
+        for queue, _, _ in self.channels.values():
+            await queue.join()
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if unsent:
+            await asyncio.to_thread(self.runner.record, unsent, {item[0]: INTERRUPTED for item in unsent})
+            log.warning(f"Parked {len(unsent)} unsent deliveries for after the restart")
+
+    def _drain_channels(self) -> list:
+        return [item for queue, _, _ in self.channels.values() for item, _ in _drain(queue)]
+
+    async def run(self, ticker, select_due, on_tick=None, drain_seconds: float = NOTIFIER_DRAIN_SECONDS) -> None:
+        """Runs the notifier until SIGTERM/SIGINT, then drains.
+
+        `ticker`: a `scheduler.MinuteTicker`. `select_due(minutes)`: returns the
+        `(email, profile, at)` users due in those minutes (run in a worker
+        thread). `on_tick(minutes, due, duration)`: optional, called after each
+        tick's due users were queued.
+        """
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopping.set)
+        self.start()
+        stop_wait = asyncio.create_task(stopping.wait())
+
+        while not stopping.is_set():
+            delay = ticker.seconds_until_next()
+            if delay > 0:
+                await asyncio.wait({stop_wait}, timeout=delay)
+                if stopping.is_set():
+                    break
+            minutes = ticker.wait()
+            due = await asyncio.to_thread(select_due, minutes)
+
+            # Under backpressure this waits for the senders; a SIGTERM meanwhile
+            # drops the rest of the tick (unclaimed, so a restart catches up on it)
+            submit = asyncio.create_task(self.submit(due))
+            await asyncio.wait({submit, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+            if not submit.done():
+                submit.cancel()
+                break
+            duration = ticker.done()
+            if on_tick:
+                on_tick(minutes, due, duration)
+
+        log.info(f"Stopping: draining queued deliveries (up to {drain_seconds:.0f}s)")
+        await self.stop(drain_seconds)
+        log.info("Notifier pipeline stopped")
@@ -0,0 +1,246 @@
+"""Read-through cache for `/get_profile`.
+
+Profiles are read every time the app's settings screen opens but rarely
+change, so reads go through a cache in front of Postgres:
+
+- in-process by default: an LRU of at most `PROFILE_CACHE_SIZE` profiles,
+  each kept for `PROFILE_CACHE_TTL` seconds;
+- shared, if `PROFILE_CACHE_URL` points at a Redis-compatible server
+  (needs the optional `redis` package), so that every gunicorn worker
+  sees the others' invalidations.
+
+The routes that write a profile call `invalidate(email)` after their write.
+An in-process cache can only be invalidated in the worker that made the
+write, so it is used only when gunicorn runs a single worker
+(`WEB_CONCURRENCY`); with more, caching needs `PROFILE_CACHE_URL` and is
+off without it. Concurrent misses for the same email share one query.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # optional: only the in-process cache is available without it
+    redis = None
+
+# Profiles kept per process (a few hundred bytes each); 0 disables the cache
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "10000"))
+# Seconds a cached profile is served before it is read again
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", "60"))
+# e.g. redis://localhost:6379/0; empty for the in-process cache
+PROFILE_CACHE_URL = os.environ.get("PROFILE_CACHE_URL", "")
+# gunicorn workers; the Procfile passes no --workers, so gunicorn uses this too
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+CACHE_REQUESTS = metrics.Counter("profile_cache_requests_total",
+                                 "Profile reads by result (hit, miss, or shared: waited for another request's miss)",
+                                 ["result"])
+
+
+class LocalBackend:
+    """An LRU of at most `max_entries` values, each expiring `ttl` seconds after it was stored."""
+
+    def __init__(self, max_entries: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Values as JSON under `prefix + key` on a Redis-compatible server, expiring after `ttl` seconds.
+
+    `delete` leaves a tombstone for `hold` seconds and `set` only stores
+    into an empty key, so a worker whose read started before another
+    worker's write can't put the old profile back. Server errors are logged
+    and treated as misses, so an unreachable cache only costs the database
+    reads it would have saved.
+    """
+
+    TOMBSTONE = b"-"
+
+    def __init__(self, url: str = PROFILE_CACHE_URL, ttl: float = PROFILE_CACHE_TTL, prefix: str = "l4t:profile:",
+                 hold: float = 5, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("PROFILE_CACHE_URL is set but the redis package is not installed")
+            client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self.client = client
+        self.ttl = max(1, round(ttl))
+        self.hold = max(1, round(hold))
+        self.prefix = prefix
+
+    def get(self, key: str):
+        try:
+            raw = self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            log.warning(f"Profile cache read failed: {e}")
+            return None
+        if raw is None or raw == self.TOMBSTONE:
+            return None
+        return json.loads(raw)
+
+    def set(self, key: str, value) -> None:
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl, nx=True)
+        except redis.RedisError as e:
+            log.warning(f"Profile cache write failed: {e}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.set(self.prefix + key, self.TOMBSTONE, ex=self.hold)
+        except redis.RedisError as e:
+            # The entry expires on its own; until then the old profile is served
+            log.error(f"Profile cache invalidation failed for {key}: {e}")
+
+    def clear(self) -> None:
+        try:
+            keys = []
+            for key in self.client.scan_iter(match=self.prefix + "*", count=1000):
+                keys.append(key)
+                if len(keys) == 1000:
+                    self.client.delete(*keys)
+                    keys = []
+            if keys:
+                self.client.delete(*keys)
+        except redis.RedisError as e:
+            log.error(f"Profile cache clear failed: {e}")
+
+    def __len__(self) -> int:
+        return 0   # not tracked per process
+
+
+def default_backend(url: str = PROFILE_CACHE_URL, workers: int = WEB_CONCURRENCY):
+    """The shared backend if `url` is set, else the in-process one for a single worker.
+
+    With several workers and no usable shared backend the cache is off
+    (an empty `LocalBackend`): a worker can't invalidate the others'
+    in-process copies, so they would serve profiles that were changed.
+    """
+    if url:
+        try:
+            return RedisBackend(url)
+        except Exception as e:
+            log.error(f"Shared profile cache unavailable: {e}")
+    if workers > 1:
+        log.warning(f"Profile cache off: {workers} workers need a shared cache (PROFILE_CACHE_URL)")
+        return LocalBackend(max_entries=0)
+    return LocalBackend()
+
+
+class _Flight:
+    """One in-progress load that concurrent misses for the same key wait on."""
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ProfileCache:
+    """Read-through cache of `load(email)`, which returns a JSON-serializable profile or `None`.
+
+    Missing profiles (`None`) are not cached, so a newly created profile is
+    seen right away.
+    """
+
+    def __init__(self, load, backend=None):
+        self.load = load
+        self.backend = backend if backend is not None else default_backend()
+        self._flights = {}       # email -> _Flight
+        self._generations = {}   # email -> invalidations while a load was in flight
+        self._lock = threading.Lock()
+
+    def get(self, email: str):
+        value = self.backend.get(email)
+        if value is not None:
+            CACHE_REQUESTS.labels("hit").inc()
+            return value
+
+        with self._lock:
+            flight = self._flights.get(email)
+            leader = flight is None
+            if leader:
+                flight = self._flights[email] = _Flight()
+                self._generations[email] = 0
+
+        if not leader:
+            CACHE_REQUESTS.labels("shared").inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        CACHE_REQUESTS.labels("miss").inc()
+        try:
+            flight.value = self.load(email)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[email]
+                # A write that landed during the load may not be in what was read
+                invalidated = self._generations.pop(email)
+            flight.done.set()
+
+        if flight.value is not None and not invalidated:
+            self.backend.set(email, flight.value)
+        return flight.value
+
+    def invalidate(self, email: str) -> None:
+        """Drops `email`'s cached profile; call after the write has committed."""
+        with self._lock:
+            if email in self._generations:
+                self._generations[email] += 1
+        self.backend.delete(email)
+
+    def clear(self) -> None:
+        """Drops every cached profile (after bulk writes)."""
+        with self._lock:
+            for email in self._generations:
+                self._generations[email] += 1
+        self.backend.clear()
+
+    def size(self) -> int:
+        return len(self.backend)
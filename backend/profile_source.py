@@ -0,0 +1,138 @@
+import os
+import json
+import logging
+import datetime
+from typing import NamedTuple
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# Where the notifier reads profiles from: "postgres" (direct, pooled) or
+# "http" (the web app's /show_profiles feed). Postgres falls back to HTTP.
+NOTIFIER_PROFILE_SOURCE = os.environ.get("NOTIFIER_PROFILE_SOURCE", "http")
+PROFILES_URL = os.environ.get("PROFILES_URL", "https://lead4tomorrow-mobile-app.onrender.com/show_profiles")
+
+# Overlap applied to the next updated_since so rows committed late in the
+# previous poll are not missed (the index upserts, so duplicates are harmless).
+UPDATED_SINCE_OVERLAP = datetime.timedelta(seconds=5)
+
+
+class Profile(NamedTuple):
+    """The profile columns the notifier needs."""
+    email: str
+    method: str | None = None
+    timezone: str | None = None
+    time: str | None = None
+    device_token: str | None = None
+    device_token_status: str | None = None   # "dead" once APNs rejected the token for good
+    tz_offset_minutes: int | None = None     # typed `timezone`, once set or backfilled
+    send_minute_utc: int | None = None       # computed from `time` + `tz_offset_minutes`
+
+
+PROFILE_COLUMNS = Profile._fields
+
+
+class HttpProfileSource:
+    """Reads profiles from the backend's paginated NDJSON feed (`/show_profiles?format=ndjson`)."""
+
+    name = "http"
+
+    def __init__(self, url: str = PROFILES_URL, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self, updated_since: str | None = None) -> tuple[dict[str, Profile], str]:
+        """Returns `({email: Profile}, next_updated_since)`. Raises on failure.
+
+        `updated_since`: only fetch profiles changed since this ISO timestamp.
+        """
+        params = {"format": "ndjson", "fields": ",".join(PROFILE_COLUMNS)}
+        if updated_since:
+            params["updated_since"] = updated_since
+
+        profiles = {}
+        next_since = None
+        while True:
+            page = None
+            with requests.get(self.url, params=params, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    item = json.loads(line)
+                    if "_page" in item:
+                        page = item["_page"]
+                    else:
+                        profiles[item["email"]] = Profile(**item)
+            if page is None:
+                raise ValueError("page ended without a trailer")
+            # The first page's timestamp is the safe lower bound for the next poll
+            next_since = next_since or page["next_updated_since"]
+            if not page["next"]:
+                break
+            params["after"] = page["next"]
+        return profiles, next_since
+
+
+class PostgresProfileSource:
+    """Reads profiles straight from Postgres through the pool in db.py.
+
+    Rows are streamed with a server-side (named) cursor so memory stays flat
+    regardless of the number of users, and arrive as typed `Profile` tuples.
+    """
+
+    name = "postgres"
+    itersize = 5000
+
+    def __init__(self):
+        from db import get_connection
+        self._get_connection = get_connection
+
+    def fetch(self, updated_since: str | None = None) -> tuple[dict[str, Profile], str]:
+        from psycopg.rows import class_row
+
+        where = "WHERE updated_at >= %s" if updated_since else ""
+        params = (datetime.datetime.fromisoformat(updated_since),) if updated_since else ()
+
+        profiles = {}
+        with self._get_connection() as conn:
+            with conn.transaction():
+                cur = conn.cursor()
+                cur.execute("SELECT now()")
+                db_now = cur.fetchone()[0]
+                cur.close()
+
+                cur = conn.cursor(name="notifier_profiles", row_factory=class_row(Profile))
+                cur.itersize = self.itersize
+                cur.execute(f"SELECT {', '.join(PROFILE_COLUMNS)} FROM profiles {where}", params)
+                for profile in cur:
+                    profiles[profile.email] = profile
+                cur.close()
+        return profiles, (db_now - UPDATED_SINCE_OVERLAP).isoformat()
+
+
+class FallbackProfileSource:
+    """Tries `primary` first and uses `fallback` when it fails."""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def fetch(self, updated_since: str | None = None) -> tuple[dict[str, Profile], str]:
+        try:
+            return self.primary.fetch(updated_since)
+        except Exception as e:
+            log.warning(f"{self.primary.name} profile source failed ({type(e).__name__}: {e}); "
+                        f"falling back to {self.fallback.name}")
+            return self.fallback.fetch(updated_since)
+
+
+def open_profile_source(spec: str = NOTIFIER_PROFILE_SOURCE):
+    """Returns the profile source named by `spec` (`"postgres"` or `"http"`)."""
+    if spec == "postgres":
+        return FallbackProfileSource(PostgresProfileSource(), HttpProfileSource())
+    if spec == "http":
+        return HttpProfileSource()
+    raise ValueError(f"Unknown NOTIFIER_PROFILE_SOURCE {spec!r}")
@@ -0,0 +1,327 @@
+"""Bulk export and import of profiles with PostgreSQL `COPY`.
+
+    python backend/profile_transfer.py export -o profiles.csv [--format binary]
+    python backend/profile_transfer.py import profiles.csv [--format binary] [--chunk 50000]
+
+`-` (the default) means stdout/stdin. The same is served to admins as
+`GET /export_profiles` and `POST /import_profiles` (see app.py).
+
+Export streams `COPY profiles TO STDOUT` as it comes. CSV has a header line
+naming the columns; binary (PostgreSQL's own format, faster to load, only
+between databases with the same schema) doesn't, so it is read back with
+the columns it was written with (`--columns`, default all of `COLUMNS`).
+
+Import splits the input into chunks of `--chunk` rows without parsing
+field values; each chunk is copied into a temporary staging table and
+merged into `profiles` in its own transaction (insert, or update the
+columns present in the file; the last row wins for a repeated email).
+Memory use doesn't depend on the input size, and a failed import keeps the
+chunks merged before the failure. Passwords are bcrypt hashes and are
+copied as is. Rows imported without the typed columns are converted by
+`backfill.py`; `send_minute_utc` and `updated_at` are always set here.
+"""
+import sys
+import struct
+import logging
+import argparse
+
+from psycopg import sql
+
+from db import get_connection, close_pool
+
+log = logging.getLogger(__name__)
+
+# Columns exported by default, and the only ones an import may set.
+# send_minute_utc is derived by a trigger; updated_at is set to the import time.
+COLUMNS = ("email", "password", "phone", "carrier", "method", "timezone", "time", "device_token",
+           "device_token_status", "device_token_failure", "device_token_failed_at",
+           "notify_method", "tz_offset_minutes", "send_time")
+FORMATS = ("csv", "binary")
+
+# Rows merged per transaction
+IMPORT_CHUNK_ROWS = 50_000
+# Bytes read from the input at a time
+READ_SIZE = 64 * 1024
+
+# Values for NOT NULL columns left empty in an import
+IMPORT_DEFAULTS = {"device_token_status": "active"}
+
+BINARY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+BINARY_HEADER = BINARY_SIGNATURE + struct.pack("!ii", 0, 0)
+BINARY_TRAILER = struct.pack("!h", -1)
+
+STAGING_TABLE = "profiles_import"
+
+
+class TransferError(ValueError):
+    """The request or the input can't be exported or imported (bad format, columns or header)."""
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise TransferError(f"format must be one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+def check_columns(columns) -> list[str]:
+    """Validates a column list (or comma-separated string); `None` means all of `COLUMNS`."""
+    if not columns:
+        return list(COLUMNS)
+    if isinstance(columns, str):
+        columns = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = sorted(set(columns) - set(COLUMNS))
+    if unknown:
+        raise TransferError(f"unknown columns: {', '.join(unknown)}")
+    if len(set(columns)) != len(columns):
+        raise TransferError("columns repeat")
+    if "email" not in columns:
+        raise TransferError("columns must include email")
+    return list(columns)
+
+
+def _copy_options(fmt: str, header: bool = False) -> sql.Composable:
+    if fmt == "binary":
+        return sql.SQL("(FORMAT binary)")
+    return sql.SQL("(FORMAT csv, HEADER true)" if header else "(FORMAT csv)")
+
+
+# ----------------------------
+# Export
+# ----------------------------
+
+def export_profiles(fmt: str = "csv", columns=None):
+    """Validates the arguments, then returns a generator of the `COPY` output in blocks.
+
+    Raises `TransferError`. Rows come in table order, not sorted.
+    """
+    fmt = check_format(fmt)
+    columns = check_columns(columns)
+    query = sql.SQL("COPY profiles ({cols}) TO STDOUT {options}").format(
+        cols=sql.SQL(", ").join(map(sql.Identifier, columns)),
+        options=_copy_options(fmt, header=True),
+    )
+
+    def generate():
+        with get_connection() as conn:
+            cur = conn.cursor()
+            with cur.copy(query) as copy:
+                for data in copy:
+                    yield bytes(data)
+            log.info(f"Exported {cur.rowcount} profile(s) as {fmt}")
+            cur.close()
+
+    return generate()
+
+
+# ----------------------------
+# Import
+# ----------------------------
+
+class _Reader:
+    """Exact-size reads over a stream that may return short reads."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b""
+        self.pos = 0
+
+    def read(self, size: int) -> bytes:
+        end = self.pos + size
+        while end > len(self.buffer):
+            block = self.stream.read(READ_SIZE)
+            if not block:
+                raise TransferError("input ends in the middle of a row")
+            self.buffer = self.buffer[self.pos:] + block
+            end -= self.pos
+            self.pos = 0
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+
+def _binary_rows(stream, columns: list[str]):
+    """Yields each tuple of a binary `COPY` stream as raw bytes (header and trailer dropped)."""
+    reader = _Reader(stream)
+    if reader.read(len(BINARY_SIGNATURE)) != BINARY_SIGNATURE:
+        raise TransferError("not a PostgreSQL binary COPY file")
+    _flags, extension = struct.unpack("!ii", reader.read(8))
+    reader.read(extension)
+
+    # Checked once here so a column mismatch is reported before anything is written
+    pending = reader.read(2)
+    while True:
+        (fields,) = struct.unpack("!h", pending)
+        if fields == -1:
+            return
+        if fields != len(columns):
+            raise TransferError(f"rows have {fields} fields, expected {len(columns)} ({', '.join(columns)})")
+        parts = [pending]
+        for _ in range(fields):
+            size = reader.read(4)
+            parts.append(size)
+            (length,) = struct.unpack("!i", size)
+            if length > 0:
+                parts.append(reader.read(length))
+        yield b"".join(parts)
+        pending = reader.read(2)
+
+
+def _csv_rows(stream):
+    """Yields each CSV record as raw bytes, newline included.
+
+    A newline ends a record only outside quotes, i.e. after an even number
+    of `"` (an escaped `""` counts twice), so quoted newlines stay intact.
+    """
+    record, quotes = [], 0
+    for line in iter(stream.readline, b""):
+        record.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2:
+            continue
+        data = b"".join(record)
+        record, quotes = [], 0
+        if data.strip():
+            yield data
+    if record:
+        yield b"".join(record)   # unterminated quote: COPY reports it
+
+
+def _csv_header(stream) -> list[str]:
+    line = stream.readline().decode("utf-8-sig").strip()
+    if not line:
+        raise TransferError("input is empty; expected a CSV header line")
+    return [name.strip().strip('"') for name in line.split(",")]
+
+
+def import_profiles(stream, fmt: str = "csv", columns=None, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    """Reads and checks the input's header, then returns a generator that imports it.
+
+    `stream`: a binary file-like object. For CSV the columns come from the
+    header line (`columns` is ignored); binary input must have been
+    exported with `columns`. The generator merges one chunk per step and
+    yields the running counts: `rows` read, `inserted`, `updated` and
+    `skipped` (no email, or repeated within a chunk), and `chunks`.
+    Raises `TransferError` for a bad format, header or column list.
+    """
+    fmt = check_format(fmt)
+    if fmt == "csv":
+        columns = check_columns(_csv_header(stream))
+        rows = _csv_rows(stream)
+    else:
+        columns = check_columns(columns)
+        rows = _binary_rows(stream, columns)
+    return _import(rows, fmt, columns, max(1, chunk_rows))
+
+
+def _import(rows, fmt: str, columns: list[str], chunk_rows: int):
+    cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+    staging = sql.Identifier(STAGING_TABLE)
+    copy_query = sql.SQL("COPY {staging} ({cols}) FROM STDIN {options}").format(
+        staging=staging, cols=cols, options=_copy_options(fmt))
+
+    def value(column):
+        if column in IMPORT_DEFAULTS:
+            return sql.SQL("COALESCE({col}, {default})").format(
+                col=sql.Identifier(column), default=sql.Literal(IMPORT_DEFAULTS[column]))
+        return sql.Identifier(column)
+
+    # The last row wins when an email repeats within a chunk; a later chunk overwrites an earlier one
+    merge_query = sql.SQL("""
+        WITH merged AS (
+            INSERT INTO profiles ({cols}, updated_at)
+            SELECT DISTINCT ON (email) {values}, now()
+            FROM {staging}
+            WHERE email IS NOT NULL
+            ORDER BY email, import_seq DESC
+            ON CONFLICT (email) DO UPDATE SET {updates}, updated_at = EXCLUDED.updated_at
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged
+    """).format(
+        cols=cols,
+        values=sql.SQL(", ").join(value(c) for c in columns),
+        staging=staging,
+        updates=sql.SQL(", ").join(
+            sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c)) for c in columns if c != "email"
+        ) if len(columns) > 1 else sql.SQL("email = EXCLUDED.email"),
+    )
+
+    counts = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0, "chunks": 0}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Column types without constraints, so empty NOT NULL values reach the merge;
+        # emptied at every commit, dropped with the session
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS pg_temp.{staging}").format(staging=staging))
+        cur.execute(sql.SQL(
+            "CREATE TEMP TABLE {staging} ON COMMIT DELETE ROWS AS SELECT {cols} FROM profiles WITH NO DATA"
+        ).format(staging=staging, cols=cols))
+        cur.execute(sql.SQL(
+            "ALTER TABLE {staging} ADD COLUMN import_seq bigint GENERATED ALWAYS AS IDENTITY"
+        ).format(staging=staging))
+        try:
+            done = False
+            while not done:
+                copied = 0
+                with conn.transaction():
+                    with cur.copy(copy_query) as copy:
+                        if fmt == "binary":
+                            copy.write(BINARY_HEADER)
+                        for row in rows:
+                            copy.write(row)
+                            copied += 1
+                            if copied == chunk_rows:
+                                break
+                        else:
+                            done = True
+                        if fmt == "binary":
+                            copy.write(BINARY_TRAILER)
+                    if not copied:
+                        break
+                    cur.execute(merge_query)
+                    inserted, merged = cur.fetchone()
+
+                counts["rows"] += copied
+                counts["inserted"] += inserted
+                counts["updated"] += merged - inserted
+                counts["skipped"] += copied - merged
+                counts["chunks"] += 1
+                log.info(f"Imported {counts['rows']} row(s): {counts['inserted']} new, "
+                         f"{counts['updated']} updated, {counts['skipped']} skipped")
+                yield dict(counts)
+        finally:
+            cur.execute(sql.SQL("DROP TABLE IF EXISTS pg_temp.{staging}").format(staging=staging))
+            cur.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", stream=sys.stderr)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_cmd = commands.add_parser("export", help="write every profile to a file")
+    export_cmd.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    import_cmd = commands.add_parser("import", help="upsert profiles from a file")
+    import_cmd.add_argument("input", nargs="?", default="-", help="input file (default: stdin)")
+    import_cmd.add_argument("--chunk", type=int, default=IMPORT_CHUNK_ROWS, help="rows per transaction")
+    for cmd in (export_cmd, import_cmd):
+        cmd.add_argument("--format", choices=FORMATS, default="csv")
+        cmd.add_argument("--columns", help=f"comma-separated subset of: {', '.join(COLUMNS)}")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+            with out:
+                for block in export_profiles(args.format, args.columns):
+                    out.write(block)
+        else:
+            src = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+            with src:
+                counts = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0}
+                for counts in import_profiles(src, args.format, args.columns, args.chunk):
+                    pass
+            print(f"Read {counts['rows']} row(s): {counts['inserted']} new, {counts['updated']} updated, "
+                  f"{counts['skipped']} skipped", file=sys.stderr)
+    except TransferError as e:
+        sys.exit(str(e))
+    finally:
+        close_pool()
@@ -0,0 +1,100 @@
+"""Parsing of the notification preferences clients send as free-form strings.
+
+`profiles.timezone`, `time` and `method` are stored as the client sent them
+("-5", "09:00", "Email"). Since migration 0006 each also has a typed column
+(`tz_offset_minutes`, `send_time`, `notify_method`), plus `send_minute_utc`,
+which a trigger derives from the two time columns. `update_profile` writes
+both forms; `backfill.py` converts rows written before that.
+"""
+import re
+import datetime
+from typing import NamedTuple
+
+MINUTES_PER_DAY = 24 * 60
+
+# Values of the `notify_method` enum
+METHODS = ("email", "push")
+
+# Real-world UTC offsets run from -12:00 to +14:00
+MIN_OFFSET_MINUTES = -12 * 60
+MAX_OFFSET_MINUTES = 14 * 60
+
+# Hours ("-5", "+5.5") or hours:minutes ("+05:30", "-3:30"), optionally after "UTC"/"GMT"
+_OFFSET = re.compile(r"(?:UTC|GMT)?\s*([+-]?)\s*(\d{1,2})(?::(\d{2})|(\.\d+))?", re.IGNORECASE)
+
+
+def parse_tz_offset(raw) -> int | None:
+    """Parses a UTC offset into minutes. Returns `None` if it is missing or malformed."""
+    if raw is None or isinstance(raw, bool):
+        return None
+    match = _OFFSET.fullmatch(str(raw).strip())
+    if not match:
+        return None
+    sign, hours, minutes, fraction = match.groups()
+    if minutes is not None:
+        minutes = int(minutes)
+        if minutes >= 60:
+            return None
+    else:
+        minutes = round(float(fraction) * 60) if fraction else 0
+    offset = int(hours) * 60 + minutes
+    if sign == "-":
+        offset = -offset
+    if not MIN_OFFSET_MINUTES <= offset <= MAX_OFFSET_MINUTES:
+        return None
+    return offset
+
+
+def parse_send_time(raw) -> datetime.time | None:
+    """Parses a local send time (`"HH:MM"`, seconds ignored). Returns `None` if missing or malformed."""
+    try:
+        hours, minutes, *rest = str(raw).strip().split(":")
+        hours, minutes = int(hours), int(minutes)
+        if len(rest) > 1 or (rest and not 0 <= int(rest[0]) < 60):
+            return None
+    except (TypeError, ValueError):
+        return None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        return None
+    return datetime.time(hours, minutes)
+
+
+def parse_method(raw) -> str | None:
+    """Normalizes a notification method to one of `METHODS`. Returns `None` if unknown."""
+    method = str(raw).strip().lower() if raw is not None else ""
+    return method if method in METHODS else None
+
+
+def utc_send_minute(send_time: datetime.time, offset_minutes: int) -> int:
+    """The UTC minute-of-day (0..1439) at which a local `send_time` falls. Mirrors the DB trigger."""
+    return (send_time.hour * 60 + send_time.minute - offset_minutes) % MINUTES_PER_DAY
+
+
+class Preferences(NamedTuple):
+    """The typed form of a profile's notification preferences; `None` where not set."""
+    method: str | None
+    tz_offset_minutes: int | None
+    send_time: datetime.time | None
+
+
+def parse_preferences(method, timezone, time) -> Preferences:
+    """Validates the preferences an `update_profile` request sent.
+
+    Missing or empty values are allowed and stay unset; anything else must
+    parse. Raises `ValueError` with a message for the client otherwise.
+    """
+    def blank(value):
+        return value is None or str(value).strip() == ""
+
+    typed = Preferences(
+        None if blank(method) else parse_method(method),
+        None if blank(timezone) else parse_tz_offset(timezone),
+        None if blank(time) else parse_send_time(time),
+    )
+    if not blank(method) and typed.method is None:
+        raise ValueError(f"method must be one of: {', '.join(METHODS)}")
+    if not blank(timezone) and typed.tz_offset_minutes is None:
+        raise ValueError('timezone must be a UTC offset in hours, e.g. "-5" or "+5:30"')
+    if not blank(time) and typed.send_time is None:
+        raise ValueError('time must be "HH:MM"')
+    return typed
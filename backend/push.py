@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import logging
+import threading
+import email.utils
+
+import collections
+import collections.abc
+
+# ------------------------------------------------------------------
+# Temporary compatibility patch for Python 3.13 + 'hyper' dependency
+# ------------------------------------------------------------------
+if not hasattr(collections, "Iterable"):
+    collections.Iterable = collections.abc.Iterable
+if not hasattr(collections, "Mapping"):
+    collections.Mapping = collections.abc.Mapping
+if not hasattr(collections, "MutableMapping"):
+    collections.MutableMapping = collections.abc.MutableMapping
+if not hasattr(collections, "MutableSet"):
+    collections.MutableSet = collections.abc.MutableSet
+if not hasattr(collections, "Callable"):
+    collections.Callable = collections.abc.Callable
+
+import ssl
+if not hasattr(ssl, 'verify_hostname'):
+    ssl.verify_hostname = lambda cert, hostname: None
+
+# APNS imports
+from apns2.client import APNsClient, Notification
+from apns2.credentials import TokenCredentials
+from apns2.payload import Payload
+
+log = logging.getLogger(__name__)
+
+# apns2 logs every token sent and every response at INFO
+logging.getLogger("apns2").setLevel(logging.WARNING)
+
+# Result string apns2 reports for a delivered notification
+SUCCESS = "Success"
+
+# Recorded for a push whose request went out but whose response never came
+# (the connection failed meanwhile): APNs may have delivered it, so it is not
+# retried (see retry.RETRY_POLICIES)
+INDETERMINATE = "Indeterminate"
+
+# APNs reasons meaning the token will never work again
+PERMANENT_FAILURES = {"BadDeviceToken", "Unregistered", "DeviceTokenNotForTopic"}
+
+# Short explanations logged next to APNs failure reasons
+FAILURE_HINTS = {
+    "BadDeviceToken": "token invalid or from the wrong environment (sandbox vs production)",
+    "Unregistered": "device no longer registered (app uninstalled)",
+    "DeviceTokenNotForTopic": "token belongs to a different bundle id",
+    "PayloadTooLarge": "notification content exceeds 4KB",
+    "TooManyRequests": "APNs rate limit exceeded",
+    "ServiceUnavailable": "APNs temporarily unavailable",
+    "InternalServerError": "APNs internal server error",
+    "ConnectionFailed": "could not (re)connect to APNs",
+    INDETERMINATE: "sent, but the connection failed before APNs answered; not retried",
+}
+
+# Max notifications handed to one send_notification_batch call. apns2 further
+# limits concurrent streams to what the server advertises (typically 500).
+PUSH_MAX_IN_FLIGHT = int(os.environ.get("PUSH_MAX_IN_FLIGHT", "500"))
+
+# Notifications remain valid on APNs for one day
+PUSH_EXPIRATION_SECONDS = 86400
+
+
+class _EncodedDict(dict):
+    """A payload dict that carries its own pre-encoded JSON text."""
+    __slots__ = ("encoded",)
+
+
+class PrecompiledPayload(Payload):
+    """An `apns2.payload.Payload` whose JSON was already encoded.
+
+    apns2 calls `payload.dict()` and JSON-encodes the result for every
+    notification; with `PrecompiledJSONEncoder` the cached text is used as is.
+    The `aps` fields are also set as attributes, since apns2 reads `alert`,
+    `badge` and `sound` to pick the `apns-push-type` header.
+    """
+
+    def __init__(self, payload: dict, payload_bytes: bytes):
+        aps = payload.get("aps", {})
+        super().__init__(
+            alert=aps.get("alert"),
+            badge=aps.get("badge"),
+            sound=aps.get("sound"),
+            category=aps.get("category"),
+            content_available=bool(aps.get("content-available")),
+            mutable_content=bool(aps.get("mutable-content")),
+        )
+        self._dict = _EncodedDict(payload)
+        self._dict.encoded = payload_bytes.decode("utf-8")
+
+    def dict(self):
+        return self._dict
+
+
+class PrecompiledJSONEncoder(json.JSONEncoder):
+    """JSON encoder that returns a `PrecompiledPayload`'s cached text without re-encoding."""
+
+    def encode(self, o):
+        if isinstance(o, _EncodedDict):
+            return o.encoded
+        return super().encode(o)
+
+
+class FailureReason(str):
+    """An APNs failure reason that also carries the response's `Retry-After` (seconds), if any."""
+
+    def __new__(cls, reason: str, retry_after: float | None = None):
+        self = super().__new__(cls, reason)
+        self.retry_after = retry_after
+        return self
+
+
+def _retry_after(headers) -> float | None:
+    """Parses a `Retry-After` header (delta-seconds or HTTP date) from a hyper header map."""
+    values = headers.get("retry-after")
+    if not values:
+        return None
+    value = values[0] if isinstance(values, list) else values
+    value = value.decode("ascii", "replace") if isinstance(value, bytes) else str(value)
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _APNsClient(APNsClient):
+    """apns2's client with failure results normalized to a `FailureReason`.
+
+    Upstream returns a bare reason, or a `(reason, timestamp)` tuple for 410
+    responses, and drops the response headers; here every failure is a plain
+    reason string that also knows the `Retry-After` delay.
+
+    It also tracks the progress of `send_notification_batch`, whose results
+    upstream loses when it raises: `responses` holds the `{token: result}`
+    that had arrived and `awaiting` the tokens sent without a response yet.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reset_progress()
+
+    def _reset_progress(self):
+        self.responses = {}
+        self.awaiting = set()
+        self._stream_tokens = {}   # stream id -> token
+
+    def send_notification_batch(self, notifications, *args, **kwargs):
+        self._reset_progress()
+        return super().send_notification_batch(notifications, *args, **kwargs)
+
+    def send_notification_async(self, token_hex: str, *args, **kwargs) -> int:
+        # Counted as sent before the request is written: a failure part way
+        # through may still have reached APNs
+        self.awaiting.add(token_hex)
+        stream_id = super().send_notification_async(token_hex, *args, **kwargs)
+        self._stream_tokens[stream_id] = token_hex
+        return stream_id
+
+    def get_notification_result(self, stream_id: int):
+        result = self._read_result(stream_id)
+        token = self._stream_tokens.pop(stream_id, None)
+        if token is not None:
+            self.awaiting.discard(token)
+            self.responses[token] = result
+        return result
+
+    def _read_result(self, stream_id: int):
+        with self._connection.get_response(stream_id) as response:
+            if response.status == 200:
+                return SUCCESS
+            raw = response.read().decode("utf-8")
+            try:
+                reason = json.loads(raw)["reason"]
+            except (ValueError, KeyError, TypeError):
+                reason = f"HTTP{response.status}"
+            return FailureReason(reason, _retry_after(response.headers))
+
+
+def make_apns_client(key_path, key_id, team_id, use_sandbox=False, host=None, port=None) -> APNsClient:
+    """Creates a token-authenticated APNs client.
+
+    `host`/`port` override Apple's servers, e.g. to point at a local fake APNs
+    HTTP/2 server in tests or benchmarks (`APNS_HOST`/`APNS_PORT`).
+    """
+    creds = TokenCredentials(auth_key_path=key_path, auth_key_id=key_id, team_id=team_id)
+    client_cls = _APNsClient
+    if host:
+        client_cls = type("LocalAPNsClient", (_APNsClient,), {
+            "SANDBOX_SERVER": host,
+            "LIVE_SERVER": host,
+            "DEFAULT_PORT": int(port or 443),
+        })
+    return client_cls(
+        credentials=creds,
+        use_sandbox=use_sandbox,
+        use_alternative_port=False,
+        json_encoder=PrecompiledJSONEncoder,
+    )
+
+
+def device_token_error(device_token) -> str | None:
+    """Returns why `device_token` can't be sent to, or `None` if it looks valid (64 hex chars)."""
+    if not device_token:
+        return "MissingDeviceToken"
+    if len(device_token) != 64:
+        return "InvalidTokenLength"
+    try:
+        int(device_token, 16)
+    except ValueError:
+        return "InvalidTokenFormat"
+    return None
+
+
+class PushDispatcher:
+    """Sends a tick's worth of pushes concurrently over one HTTP/2 connection.
+
+    Notifications are handed to apns2's `send_notification_batch`, which
+    multiplexes them as concurrent streams on the client's single connection,
+    in chunks of at most `max_in_flight`. Batches from different threads (the
+    tick and the retry worker) take turns on the connection.
+    """
+
+    def __init__(self, client: APNsClient, topic: str, max_in_flight: int = PUSH_MAX_IN_FLIGHT):
+        self.client = client
+        self.topic = topic
+        self.max_in_flight = max(1, max_in_flight)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self.stats = {
+            "batches": 0,
+            "sent": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "seconds_total": 0.0,
+            "last_batch_size": 0,
+            "last_batch_seconds": 0.0,
+            "last_throughput": 0.0,  # notifications/second
+        }
+
+    def send_batch(self, notifications: list[tuple[str, PrecompiledPayload]]) -> dict[str, str]:
+        """Sends `(device_token, payload)` pairs and returns `{device_token: result}`.
+
+        `result` is `"Success"` or the APNs failure reason (e.g. `"Unregistered"`),
+        a `FailureReason` when it came from APNs.
+        """
+        results = {}
+        if not notifications:
+            return results
+
+        start = time.perf_counter()
+        expiration = int(time.time()) + PUSH_EXPIRATION_SECONDS
+        for i in range(0, len(notifications), self.max_in_flight):
+            chunk = [Notification(token=t, payload=p) for t, p in notifications[i:i + self.max_in_flight]]
+            with self._send_lock:
+                try:
+                    results.update(self.client.send_notification_batch(
+                        chunk, topic=self.topic, expiration=expiration
+                    ))
+                except Exception as e:
+                    log.error(f"Push batch of {len(chunk)} failed: {type(e).__name__}: {e}")
+                    # Still under the lock: another thread's batch would reset the client's progress
+                    results.update(self._salvage(chunk, type(e).__name__))
+        elapsed = time.perf_counter() - start
+
+        succeeded = sum(1 for r in results.values() if r == SUCCESS)
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["sent"] += len(results)
+            self.stats["succeeded"] += succeeded
+            self.stats["failed"] += len(results) - succeeded
+            self.stats["seconds_total"] += elapsed
+            self.stats["last_batch_size"] = len(results)
+            self.stats["last_batch_seconds"] = elapsed
+            self.stats["last_throughput"] = len(results) / elapsed if elapsed > 0 else 0.0
+
+        log.info(
+            f"Push batch: {succeeded}/{len(results)} succeeded in {elapsed:.2f}s "
+            f"({self.stats['last_throughput']:.0f}/s)"
+        )
+        return results
+
+    def _salvage(self, chunk, reason: str) -> dict[str, str]:
+        """Results for a chunk whose batch send raised `reason`.
+
+        Responses that arrived before the failure are kept, tokens sent
+        without a response are `INDETERMINATE`, and only tokens never sent
+        get `reason` (and may be retried). With a client that doesn't track
+        its progress, every token is `INDETERMINATE`.
+        """
+        responses = getattr(self.client, "responses", None)
+        awaiting = getattr(self.client, "awaiting", None)
+        if responses is None or awaiting is None:
+            return {n.token: INDETERMINATE for n in chunk}
+        return {
+            n.token: responses[n.token] if n.token in responses else INDETERMINATE if n.token in awaiting else reason
+            for n in chunk
+        }
@@ -0,0 +1,63 @@
+"""The notification a calendar day is turned into, for email and for push."""
+import json
+from typing import NamedTuple
+
+# Theme of each day of the week, used in notification text
+DAY_THEMES = {
+    'Monday': 'Mindful Monday',
+    'Tuesday': 'Thoughtful Tuesday',
+    'Wednesday': "What's-Up Wednesday",
+    'Thursday': 'Thankful Thursday',
+    'Friday': 'Fast Fact Friday',
+    'Saturday': 'Self-Care Saturday',
+    'Sunday': 'Strong Family Sunday'
+}
+
+# Notification category handled by the iOS app
+APNS_CATEGORY = "CALENDAR_NOTIFICATION"
+# APNs rejects larger payloads with PayloadTooLarge
+APNS_MAX_PAYLOAD_BYTES = 4096
+
+
+class RenderedMessage(NamedTuple):
+    """A day's notification, rendered once and shared by every recipient of that date."""
+    subject: str
+    body: str
+    apns_payload: dict          # APNs payload dict (`{"aps": {...}}`)
+    apns_payload_bytes: bytes   # `apns_payload` as compact UTF-8 JSON, exactly as sent
+    email_message: bytes        # RFC-822 headers after From/To, plus the body
+
+
+def render(theme: str, entry: str, today_short: dict, today_long: dict) -> RenderedMessage:
+    """Renders a day's notification from its month `theme` and `entry` text.
+
+    `today_short`/`today_long`: the two forms returned by `L4T_Calendar.get_today`.
+    """
+    day_theme = DAY_THEMES.get(today_long.get("day", ""), "")
+
+    subject = f"Lead4Tomorrow Calendar {today_short['month']}/{today_short['day']}"
+    body = f"""{today_long["month"]} is {theme}.
+Today is {day_theme}, {today_long["month"]} {today_short["day"]}. {entry}
+"""
+
+    apns_payload = {
+        "aps": {
+            "alert": {"title": subject, "body": body, "sound": "default"},
+            "badge": 1,
+            "sound": "default",
+            "content-available": 1,   # Allows app to process in background
+            "mutable-content": 1,     # Allows notification to be modified
+            "category": APNS_CATEGORY,
+        }
+    }
+    apns_payload_bytes = json.dumps(apns_payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    email_message = (
+        f"Subject: {subject}\r\n"
+        f"MIME-Version: 1.0\r\n"
+        f"Content-Type: text/plain; charset=utf-8\r\n"
+        f"Content-Transfer-Encoding: 8bit\r\n\r\n"
+        f"{body}"
+    ).encode("utf-8")
+
+    return RenderedMessage(subject, body, apns_payload, apns_payload_bytes, email_message)
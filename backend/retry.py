@@ -0,0 +1,204 @@
+import os
+import time
+import random
+import logging
+import threading
+
+from ledger import FAILED
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Most deliveries allowed to wait for a retry at once; past that, new
+# transient failures are recorded as failed straight away.
+NOTIFIER_RETRY_MAX_QUEUE = int(os.environ.get("NOTIFIER_RETRY_MAX_QUEUE", "10000"))
+# A message not delivered this long after the user's time is dropped
+NOTIFIER_RETRY_MAX_AGE_SECONDS = int(os.environ.get("NOTIFIER_RETRY_MAX_AGE_SECONDS", str(6 * 3600)))
+NOTIFIER_RETRY_MAX_ATTEMPTS = int(os.environ.get("NOTIFIER_RETRY_MAX_ATTEMPTS", "8"))
+# Retry sends per second across push and email, so a recovering provider
+# isn't hit by every parked message at once
+NOTIFIER_RETRY_RATE = float(os.environ.get("NOTIFIER_RETRY_RATE", "20"))
+
+RETRY_POLL_SECONDS = 5
+RETRY_BATCH = 100
+# How long a taken retry stays hidden from other workers while it is being sent
+RETRY_LEASE_SECONDS = 120
+
+# Transient failure -> (first delay, max delay) in seconds. Anything not
+# listed (bad tokens, 5xx SMTP replies, missing config...) is not retried,
+# nor is push.INDETERMINATE: that push may already have been delivered.
+_NETWORK = (15, 600)
+RETRY_POLICIES = {
+    # APNs
+    "TooManyRequests": (60, 1800),
+    "ServiceUnavailable": (30, 900),
+    "InternalServerError": (30, 900),
+    "Shutdown": (10, 300),
+    "ConnectionFailed": _NETWORK,
+    "StreamResetError": _NETWORK,
+    # SMTP
+    "SMTPTemporaryFailure": (60, 1800),
+    "SMTPServerDisconnected": _NETWORK,
+    "SMTPConnectError": (30, 900),
+    # Either
+    "ConnectionError": _NETWORK,
+    "ConnectionResetError": _NETWORK,
+    "ConnectionRefusedError": _NETWORK,
+    "TimeoutError": _NETWORK,
+    "OSError": _NETWORK,
+    # Still queued when the async notifier shut down (see pipeline.py)
+    "Interrupted": (5, 60),
+}
+
+RETRIES_SCHEDULED = metrics.Counter("notifier_retries_scheduled_total", "Deliveries parked for a retry", ["reason"])
+RETRIES_DROPPED = metrics.Counter("notifier_retries_dropped_total", "Transient failures not retried",
+                                  ["cause"])
+
+
+def retry_delay(reason: str, attempt: int, retry_after: float | None = None) -> float:
+    """Seconds to wait before retry number `attempt` (1-based) after `reason`.
+
+    Exponential per-reason backoff with "equal jitter" (a random point in the
+    upper half of the window), and never sooner than the server's `Retry-After`.
+    """
+    base, cap = RETRY_POLICIES[reason]
+    window = min(cap, base * 2 ** (attempt - 1))
+    delay = random.uniform(window / 2, window)
+    if retry_after:
+        delay = max(delay, retry_after + random.uniform(0, base / 2))
+    return delay
+
+
+class RateLimiter:
+    """Token bucket shared by the retry sends: `rate` per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: float | None = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = max(rate, 0.001)
+        self.burst = burst or max(1.0, self.rate)
+        self._tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: float = 1) -> float:
+        """Blocks until `n` sends are allowed. Returns the seconds waited."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class RetryQueue:
+    """Decides which failed deliveries get another attempt, and when.
+
+    The queue itself is the ledger (`RETRY` rows with a `next_attempt_at`), so
+    it survives restarts and is shared by sharded workers.
+    """
+
+    def __init__(self, ledger, max_queue: int = NOTIFIER_RETRY_MAX_QUEUE,
+                 max_age: float = NOTIFIER_RETRY_MAX_AGE_SECONDS, max_attempts: int = NOTIFIER_RETRY_MAX_ATTEMPTS):
+        self.ledger = ledger
+        self.max_queue = max_queue
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+
+    def plan(self, failures):
+        """Splits `(email, local_date, result, attempts, due_at)` failures into retries and final outcomes.
+
+        Returns `(retries, outcomes)`: rows for `ledger.schedule_retries` and
+        `(email, local_date, FAILED, detail)` outcomes for the rest.
+        """
+        now = time.time()
+        retries, outcomes = [], []
+        queued = None
+        for email, date, result, attempts, due_at in failures:
+            reason = str(result)
+            cause = None
+            if reason not in RETRY_POLICIES:
+                outcomes.append((email, date, FAILED, reason))
+                continue
+            next_at = now + retry_delay(reason, attempts + 1, getattr(result, "retry_after", None))
+            if attempts + 1 >= self.max_attempts:
+                cause = "attempts"
+            elif next_at - due_at > self.max_age:
+                cause = "expired"
+            else:
+                if queued is None:
+                    queued = self.ledger.retry_count()
+                if queued + len(retries) >= self.max_queue:
+                    cause = "full"
+            if cause:
+                RETRIES_DROPPED.labels(cause).inc()
+                outcomes.append((email, date, FAILED, reason))
+            else:
+                RETRIES_SCHEDULED.labels(reason).inc()
+                retries.append((email, date, reason, attempts + 1, next_at, due_at))
+        return retries, outcomes
+
+
+class RetryWorker:
+    """Background thread sending due retries alongside the regular ticks.
+
+    `runner`: the notifier's `DeliveryRunner`. `lookup(email)` returns the
+    user's current `Profile` (or `None` if it was deleted), so a retry uses
+    the latest method and device token.
+    """
+
+    def __init__(self, runner, lookup, rate: float = NOTIFIER_RETRY_RATE,
+                 poll_seconds: float = RETRY_POLL_SECONDS, batch: int = RETRY_BATCH):
+        self.runner = runner
+        self.ledger = runner.ledger
+        self.lookup = lookup
+        self.limiter = RateLimiter(rate)
+        self.poll_seconds = poll_seconds
+        self.batch = batch
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "RetryWorker":
+        self._thread = threading.Thread(target=self._run, name="notifier-retries", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sent = self.run_once()
+            except Exception as e:
+                log.error(f"Retry pass failed: {type(e).__name__}: {e}")
+                sent = 0
+            if not sent:
+                self._stop.wait(self.poll_seconds)
+
+    def run_once(self) -> int:
+        """Sends one batch of due retries. Returns how many were attempted."""
+        rows = self.ledger.claim_retries(time.time(), self.batch, RETRY_LEASE_SECONDS)
+        if not rows:
+            return 0
+        items, gone = [], []
+        for email, date, _, attempts, due_at in rows:
+            profile = self.lookup(email)
+            if profile is None or self.runner.token_is_dead(profile):
+                gone.append((email, date, FAILED, "ProfileDeleted" if profile is None else "DeadDeviceToken"))
+            else:
+                items.append((email, profile, due_at, date, attempts))
+        if gone:
+            self.ledger.mark_many(gone)
+        for i in range(0, len(items), 10):
+            chunk = items[i:i + 10]
+            self.limiter.acquire(len(chunk))
+            if self._stop.is_set():
+                break   # unsent rows keep their lease and are retried after it expires
+            self.runner.deliver(chunk)
+        return len(rows)
@@ -0,0 +1,145 @@
+import time
+import datetime
+import logging
+
+from utils import Sampler
+from profile_types import MINUTES_PER_DAY, parse_tz_offset, parse_send_time, utc_send_minute
+
+log = logging.getLogger(__name__)
+
+
+def offset_minutes(profile) -> int:
+    """A profile's UTC offset in minutes: the typed column once set, else parsed from `timezone`. Defaults to `0`."""
+    if profile.tz_offset_minutes is not None:
+        return profile.tz_offset_minutes
+    return parse_tz_offset(profile.timezone) or 0
+
+
+def send_minute(profile) -> int | None:
+    """Returns the UTC minute-of-day (0..1439) at which a profile is due, or `None`.
+
+    Uses the `send_minute_utc` column computed by Postgres when it is set,
+    and parses the legacy `time`/`timezone` strings for rows not yet typed.
+    """
+    if profile.send_minute_utc is not None:
+        return profile.send_minute_utc
+    send_time = parse_send_time(profile.time)
+    if send_time is None:
+        return None
+    return utc_send_minute(send_time, offset_minutes(profile))
+
+
+def utc_minute(now: datetime.datetime) -> int:
+    """Returns the UTC minute-of-day for an aware `datetime`."""
+    now = now.astimezone(datetime.timezone.utc)
+    return now.hour * 60 + now.minute
+
+
+class SendMinuteIndex:
+    """Timing wheel of profiles bucketed by their UTC send minute.
+
+    Each of the 1440 slots holds the emails due in that UTC minute, so asking
+    "who is due in minute M" costs O(due users) instead of O(all users).
+    """
+
+    def __init__(self):
+        self.buckets = [set() for _ in range(MINUTES_PER_DAY)]
+        self.profiles = {}   # email -> Profile
+        self.minutes = {}    # email -> bucket index
+        self._sampled = Sampler()
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def upsert(self, email: str, profile) -> None:
+        """Adds or moves a profile to the bucket for its current `time` + `timezone`.
+
+        `profile`: a `profile_source.Profile`.
+        """
+        self.remove(email)
+        minute = send_minute(profile)
+        self.profiles[email] = profile
+        if minute is None:
+            if log.isEnabledFor(logging.DEBUG) and self._sampled(email):
+                log.debug(f"Profile {email} has no valid send time ({profile.time!r}); not scheduled")
+            return
+        self.buckets[minute].add(email)
+        self.minutes[email] = minute
+
+    def remove(self, email: str) -> None:
+        minute = self.minutes.pop(email, None)
+        if minute is not None:
+            self.buckets[minute].discard(email)
+        self.profiles.pop(email, None)
+
+    def rebuild(self, profiles: dict) -> None:
+        """Replaces the whole index with `profiles` (`Profile`s keyed by email)."""
+        self.__init__()
+        for email, profile in profiles.items():
+            self.upsert(email, profile)
+
+    def due(self, minute: int) -> list[tuple[str, object]]:
+        """Returns `(email, profile)` pairs due in UTC minute-of-day `minute`."""
+        return [(email, self.profiles[email]) for email in self.buckets[minute % MINUTES_PER_DAY]]
+
+
+class MinuteTicker:
+    """Wakes up on wall-clock minute boundaries and reports which minutes to process.
+
+    Unlike a fixed `sleep(60)` after the work, ticks don't drift. If a tick
+    overruns into later minutes, the next `wait()` returns every minute in
+    (last processed minute, current minute], so no send time is skipped.
+    Minutes are epoch minutes (`int(time.time() // 60)`).
+    """
+
+    def __init__(self, max_catchup_minutes: int = 60, startup_catchup_minutes: int = 0,
+                 clock=time.time, sleep=time.sleep):
+        self.max_catchup_minutes = max_catchup_minutes
+        self.clock = clock
+        self.sleep = sleep
+        self.last_minute = int(clock() // 60) - 1 - startup_catchup_minutes
+        self.tick_started = None
+        self.stats = {
+            "ticks": 0,
+            "overruns": 0,           # ticks that ran past the next boundary
+            "missed_minutes": 0,     # minutes caught up late because of overruns
+            "dropped_minutes": 0,    # minutes beyond max_catchup_minutes, never processed
+            "last_lag_seconds": 0.0,       # wake-up time minus the minute boundary
+            "last_duration_seconds": 0.0,  # time spent processing the previous tick
+        }
+
+    def wait(self) -> list[int]:
+        """Sleeps until a minute not yet processed has started; returns the minutes to process."""
+        now = self.clock()
+        while int(now // 60) <= self.last_minute:
+            self.sleep((self.last_minute + 1) * 60 - now)
+            now = self.clock()
+        current = int(now // 60)
+
+        minutes = list(range(self.last_minute + 1, current + 1))
+        if len(minutes) > 1:
+            self.stats["overruns"] += 1
+            self.stats["missed_minutes"] += len(minutes) - 1
+        if len(minutes) > self.max_catchup_minutes:
+            dropped = len(minutes) - self.max_catchup_minutes
+            self.stats["dropped_minutes"] += dropped
+            log.error(f"Notifier is {len(minutes)} minutes behind; skipping the oldest {dropped}")
+            minutes = minutes[dropped:]
+        elif len(minutes) > 1:
+            log.warning(f"Tick overran; catching up {len(minutes)} minutes")
+
+        self.last_minute = current
+        self.tick_started = now
+        self.stats["ticks"] += 1
+        self.stats["last_lag_seconds"] = now - current * 60
+        return minutes
+
+    def seconds_until_next(self) -> float:
+        """Seconds until `wait()` would return without sleeping (0 if a minute is already pending)."""
+        return max(0.0, (self.last_minute + 1) * 60 - self.clock())
+
+    def done(self) -> float:
+        """Marks the current tick as finished; returns how long it took (seconds)."""
+        duration = self.clock() - self.tick_started if self.tick_started is not None else 0.0
+        self.stats["last_duration_seconds"] = duration
+        return duration
@@ -0,0 +1,179 @@
+"""Schema migrations for the `profiles` database.
+
+Run once per deploy (it is idempotent):
+
+    python backend/schema.py
+"""
+import logging
+
+from db import get_connection
+
+log = logging.getLogger(__name__)
+
+# Ordered (name, sql) pairs. Never edit an applied migration; append a new one.
+MIGRATIONS = [
+    ("0001_profiles_updated_at", """
+        ALTER TABLE profiles
+            ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+        CREATE INDEX IF NOT EXISTS profiles_updated_at_email_idx
+            ON profiles (updated_at, email);
+    """),
+    ("0002_delivery_ledger", """
+        CREATE TABLE IF NOT EXISTS delivery_ledger (
+            email text NOT NULL,
+            local_date date NOT NULL,
+            status text NOT NULL,
+            detail text,
+            worker text,
+            updated_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (email, local_date)
+        );
+    """),
+    ("0003_notifier_leases", """
+        CREATE TABLE IF NOT EXISTS notifier_leases (
+            shard integer PRIMARY KEY,
+            owner text,
+            expires_at timestamptz NOT NULL DEFAULT '-infinity'
+        );
+        CREATE TABLE IF NOT EXISTS notifier_workers (
+            worker text PRIMARY KEY,
+            last_seen timestamptz NOT NULL DEFAULT now()
+        );
+    """),
+    ("0004_device_token_feedback", """
+        -- 'dead' once APNs reports the token permanently invalid; reset by /register_device
+        ALTER TABLE profiles
+            ADD COLUMN IF NOT EXISTS device_token_status text NOT NULL DEFAULT 'active',
+            ADD COLUMN IF NOT EXISTS device_token_failure text,
+            ADD COLUMN IF NOT EXISTS device_token_failed_at timestamptz;
+        CREATE TABLE IF NOT EXISTS delivery_stats (
+            email text PRIMARY KEY,
+            sent integer NOT NULL DEFAULT 0,
+            failed integer NOT NULL DEFAULT 0,
+            consecutive_failures integer NOT NULL DEFAULT 0,
+            last_failure text,
+            last_failed_at timestamptz,
+            last_sent_at timestamptz
+        );
+    """),
+    ("0005_delivery_retries", """
+        -- POSIX timestamps, as used by the notifier (see retry.py)
+        ALTER TABLE delivery_ledger
+            ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS next_attempt_at double precision,
+            ADD COLUMN IF NOT EXISTS due_at double precision;
+        CREATE INDEX IF NOT EXISTS delivery_ledger_retry_idx
+            ON delivery_ledger (next_attempt_at) WHERE status = 'retry';
+    """),
+    ("0006_typed_profile_columns", """
+        -- Typed forms of timezone/time/method (see profile_types.py), filled by
+        -- update_profile and, for older rows, backend/backfill.py. Nullable
+        -- columns without defaults are added without rewriting the table.
+        DO $$ BEGIN
+            CREATE TYPE notify_method AS ENUM ('email', 'push');
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$;
+        ALTER TABLE profiles
+            ADD COLUMN IF NOT EXISTS tz_offset_minutes smallint,
+            ADD COLUMN IF NOT EXISTS send_time time,
+            ADD COLUMN IF NOT EXISTS notify_method notify_method,
+            ADD COLUMN IF NOT EXISTS send_minute_utc smallint;
+        -- NOT VALID: checked for new writes without scanning existing rows
+        ALTER TABLE profiles
+            ADD CONSTRAINT profiles_tz_offset_minutes_range
+            CHECK (tz_offset_minutes BETWEEN -720 AND 840) NOT VALID;
+
+        -- send_minute_utc is kept by a trigger rather than being a generated
+        -- column, which would rewrite the whole table under an exclusive lock
+        CREATE OR REPLACE FUNCTION profiles_set_send_minute_utc() RETURNS trigger AS $fn$
+        BEGIN
+            NEW.send_minute_utc := CASE WHEN NEW.send_time IS NOT NULL THEN
+                ((extract(hour FROM NEW.send_time)::int * 60 + extract(minute FROM NEW.send_time)::int
+                  - COALESCE(NEW.tz_offset_minutes, 0)) % 1440 + 1440) % 1440
+            END;
+            RETURN NEW;
+        END
+        $fn$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS profiles_send_minute_utc ON profiles;
+        CREATE TRIGGER profiles_send_minute_utc
+            BEFORE INSERT OR UPDATE OF send_time, tz_offset_minutes ON profiles
+            FOR EACH ROW EXECUTE FUNCTION profiles_set_send_minute_utc();
+    """),
+    ("0007_profiles_send_minute_indexes", """
+        DROP INDEX CONCURRENTLY IF EXISTS profiles_send_minute_utc_idx;
+        CREATE INDEX CONCURRENTLY profiles_send_minute_utc_idx
+            ON profiles (send_minute_utc);
+        -- Who to push to in a given minute: push users with a usable token
+        DROP INDEX CONCURRENTLY IF EXISTS profiles_push_send_minute_idx;
+        CREATE INDEX CONCURRENTLY profiles_push_send_minute_idx
+            ON profiles (send_minute_utc)
+            WHERE notify_method = 'push'
+              AND device_token_status = 'active'
+              AND device_token ~ '^[0-9A-Fa-f]{64}$';
+    """),
+    ("0008_delivery_claim_lease", """
+        -- POSIX timestamp of the claim, so claims left behind by a crashed
+        -- worker can be expired (see ledger.py)
+        ALTER TABLE delivery_ledger
+            ADD COLUMN IF NOT EXISTS claimed_at double precision;
+        UPDATE delivery_ledger SET claimed_at = extract(epoch FROM updated_at)
+            WHERE status = 'claimed' AND claimed_at IS NULL;
+        CREATE INDEX IF NOT EXISTS delivery_ledger_claimed_idx
+            ON delivery_ledger (claimed_at) WHERE status = 'claimed';
+    """),
+]
+
+# Migrations run one statement at a time outside a transaction, which CREATE
+# INDEX CONCURRENTLY requires (it doesn't block writes). Each must be safe to
+# re-run after failing halfway; their SQL can't contain ";" inside statements.
+NON_TRANSACTIONAL = {"0007_profiles_send_minute_indexes"}
+
+# Arbitrary constant used with pg_advisory_lock so only one process migrates at a time
+MIGRATION_LOCK_ID = 4_041_001
+
+
+def applied_migrations(conn) -> set[str]:
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name text PRIMARY KEY,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("SELECT name FROM schema_migrations")
+    names = {row[0] for row in cur.fetchall()}
+    cur.close()
+    return names
+
+
+def migrate() -> list[str]:
+    """Applies every pending migration in order. Returns the names applied."""
+    applied = []
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            done = applied_migrations(conn)
+            for name, sql in MIGRATIONS:
+                if name in done:
+                    continue
+                log.info(f"Applying migration {name}")
+                if name in NON_TRANSACTIONAL:
+                    for statement in filter(None, (st.strip() for st in sql.split(";"))):
+                        cur.execute(statement)
+                    cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+                else:
+                    with conn.transaction():
+                        cur.execute(sql)
+                        cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+                applied.append(name)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            cur.close()
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    names = migrate()
+    print(f"Applied {len(names)} migration(s): {', '.join(names) or '-'}")
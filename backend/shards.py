@@ -0,0 +1,132 @@
+import os
+import math
+import time
+import zlib
+import logging
+
+log = logging.getLogger(__name__)
+
+# Number of shards the user space is split into. 0 disables sharding: a
+# single notifier handles every user.
+NOTIFIER_SHARDS = int(os.environ.get("NOTIFIER_SHARDS", "0"))
+# How long a shard lease (and a worker's liveness) lasts without renewal
+LEASE_SECONDS = int(os.environ.get("NOTIFIER_LEASE_SECONDS", "90"))
+
+
+def shard_of(email: str, n_shards: int) -> int:
+    """Returns the shard (0..n_shards-1) an email belongs to. Stable across processes."""
+    return zlib.crc32(email.strip().lower().encode("utf-8")) % n_shards
+
+
+class LeaseManager:
+    """Time-limited shard leases held in Postgres (`notifier_leases`, see schema.py).
+
+    Every tick each worker calls `heartbeat()`, which records that the worker
+    is alive, renews the leases it holds, gives back shards above its fair
+    share and claims expired shards (`FOR UPDATE SKIP LOCKED`) up to it. When a
+    worker dies its leases expire after `lease_seconds` and the survivors pick
+    them up; when a worker joins, the others shed shards on their next beat.
+    """
+
+    def __init__(self, n_shards: int, worker_id: str, lease_seconds: int = LEASE_SECONDS):
+        from db import get_connection
+        self._get_connection = get_connection
+        self.n_shards = n_shards
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.owned = set()
+        # Local deadline after which `owned` can't be trusted (DB unreachable)
+        self._valid_until = 0.0
+
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO notifier_leases (shard)
+                SELECT generate_series(0, %s - 1)
+                ON CONFLICT (shard) DO NOTHING
+            """, (n_shards,))
+            cur.close()
+
+    def heartbeat(self) -> set[int]:
+        """Renews/rebalances leases and returns the shards this worker owns now."""
+        started = time.monotonic()
+        try:
+            owned = self._heartbeat()
+        except Exception as e:
+            log.error(f"Lease heartbeat failed: {type(e).__name__}: {e}")
+            if time.monotonic() >= self._valid_until:
+                if self.owned:
+                    log.warning(f"Leases on {len(self.owned)} shard(s) may have expired; pausing sends")
+                self.owned = set()
+            return self.owned
+
+        if owned != self.owned:
+            log.info(f"Worker {self.worker_id} now owns {len(owned)}/{self.n_shards} shard(s): {sorted(owned)}")
+        self.owned = owned
+        # Leave a margin so we stop before another worker can take over
+        self._valid_until = started + self.lease_seconds * 0.8
+        return owned
+
+    def _heartbeat(self) -> set[int]:
+        ttl = f"{self.lease_seconds} seconds"
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            with conn.transaction():
+                cur.execute("""
+                    INSERT INTO notifier_workers (worker, last_seen) VALUES (%s, now())
+                    ON CONFLICT (worker) DO UPDATE SET last_seen = now()
+                """, (self.worker_id,))
+                cur.execute("""
+                    SELECT count(*) FROM notifier_workers
+                    WHERE last_seen > now() - %s::interval
+                """, (ttl,))
+                live_workers = max(1, cur.fetchone()[0])
+                fair_share = math.ceil(self.n_shards / live_workers)
+
+                cur.execute("""
+                    UPDATE notifier_leases SET expires_at = now() + %s::interval
+                    WHERE owner = %s AND expires_at > now() AND shard < %s
+                    RETURNING shard
+                """, (ttl, self.worker_id, self.n_shards))
+                owned = {row[0] for row in cur.fetchall()}
+
+                if len(owned) > fair_share:
+                    extra = sorted(owned)[fair_share:]
+                    cur.execute("""
+                        UPDATE notifier_leases SET owner = NULL, expires_at = now()
+                        WHERE owner = %s AND shard = ANY(%s)
+                    """, (self.worker_id, extra))
+                    owned -= set(extra)
+                elif len(owned) < fair_share:
+                    cur.execute("""
+                        WITH free AS (
+                            SELECT shard FROM notifier_leases
+                            WHERE expires_at <= now() AND shard < %s
+                            ORDER BY shard
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        UPDATE notifier_leases AS l
+                        SET owner = %s, expires_at = now() + %s::interval
+                        FROM free WHERE l.shard = free.shard
+                        RETURNING l.shard
+                    """, (self.n_shards, fair_share - len(owned), self.worker_id, ttl))
+                    owned |= {row[0] for row in cur.fetchall()}
+
+                # Forget workers that have been gone for a long time
+                cur.execute("""
+                    DELETE FROM notifier_workers WHERE last_seen < now() - %s::interval * 10
+                """, (ttl,))
+            cur.close()
+        return owned
+
+    def release(self) -> None:
+        """Gives up all leases immediately (on clean shutdown)."""
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE notifier_leases SET owner = NULL, expires_at = now() WHERE owner = %s
+            """, (self.worker_id,))
+            cur.execute("DELETE FROM notifier_workers WHERE worker = %s", (self.worker_id,))
+            cur.close()
+        self.owned = set()
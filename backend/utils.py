@@ -1,5 +1,21 @@
 import os
+import json
+import time
+import zlib
+import queue
+import atexit
+import signal
 import logging
+import logging.handlers
+
+# Root log level, e.g. "DEBUG"/"INFO"; can be flipped at run time, see `install_level_switch`
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" (human readable) or "json" (one object per line, for log pipelines)
+LOG_FORMAT = os.environ.get("LOG_FORMAT")
+# Share of users whose per-user debug lines are logged, see `Sampler`
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+_listener = None
 
 def create_path(*local_paths: str) -> str:
     """Creates a path relative to the current folder.
@@ -15,27 +31,113 @@ def create_log_path(log_file: str):
     """
     return create_path("logs", f"{os.path.basename(log_file)[:-3]}.log")
 
-def config_log():
-    """Configures the logging system."""
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object, including `log_event` fields."""
+
+    converter = time.gmtime
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            entry["event"] = event
+            entry.update(record.fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, with any `log_event` fields appended as key=value."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items() if v is not None)
+        return line
+
+def config_log(default_format: str = "text"):
+    """Configures the logging system.
+
+    Records are put on a queue by the calling thread and written to the
+    console and `logs/backend.log` by a background `QueueListener`, so slow
+    log I/O never stalls a tick or a request. Safe to call more than once.
+
+    `default_format`: `"text"` or `"json"`, used when `LOG_FORMAT` is not set.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
     log_dir = create_path("logs")  # Path to the logs directory
     os.makedirs(log_dir, exist_ok=True)  # Ensure the logs directory exists
 
-    log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    log_level = logging.DEBUG  # Set to DEBUG for detailed logs
+    if (LOG_FORMAT or default_format) == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
     # File Handler
     file_handler = logging.FileHandler(create_path("logs", "backend.log"))
-    file_handler.setLevel(log_level)
-    file_handler.setFormatter(logging.Formatter(log_format))
+    file_handler.setFormatter(formatter)
 
     # Console Handler
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(log_level)
-    console_handler.setFormatter(logging.Formatter(log_format))
+    console_handler.setFormatter(formatter)
 
-    # Configure the logger with both handlers
-    logging.basicConfig(
-        level=log_level,
-        handlers=[file_handler, console_handler],
+    _listener = logging.handlers.QueueListener(
+        queue.SimpleQueue(), file_handler, console_handler, respect_handler_level=True
     )
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(_listener.queue))
+    root.setLevel(LOG_LEVEL)
+
+def log_event(logger: logging.Logger, level: int, event: str, message: str = None, **fields):
+    """Logs one structured event, e.g. a delivery, as a single record.
+
+    `fields` become top-level keys in JSON output and key=value pairs in text.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message or event, extra={"event": event, "fields": fields})
+
+class Sampler:
+    """Decides which users get per-user debug lines.
+
+    Sampling is by hash of the key, so the same users are traced on every
+    tick and every worker, and a user's story can be followed end to end.
+    """
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        self.threshold = int(max(0.0, min(1.0, rate)) * 0xFFFFFFFF)
+
+    def __call__(self, key: str) -> bool:
+        return zlib.crc32(key.encode("utf-8")) <= self.threshold
+
+def install_level_switch(signum=signal.SIGUSR1):
+    """Toggles the root log level between DEBUG and `LOG_LEVEL` on `signum`.
+
+    `kill -USR1 <pid>` turns debug logging on in a running process without a
+    restart; the same signal turns it back off. Call from the main thread of
+    processes that don't use the signal otherwise (gunicorn workers do).
+    """
+    def toggle(*_):
+        root = logging.getLogger()
+        base = logging.getLevelName(LOG_LEVEL)
+        if root.level != logging.DEBUG:
+            level = logging.DEBUG
+        else:
+            level = base if base != logging.DEBUG else logging.INFO
+        root.setLevel(level)
+        root.warning(f"Log level switched to {logging.getLevelName(level)}")
 
+    signal.signal(signum, toggle)
@@ -0,0 +1,82 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(REPO_DIR, "backend")
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+
+# The backend modules import each other by bare name (gunicorn --pythonpath backend)
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Seeded users all share this password (see seed_profiles.py)
+BENCH_PASSWORD = "bench-password"
+BENCH_EMAIL_DOMAIN = "bench.l4t.invalid"
+
+
+def bench_email(i: int) -> str:
+    return f"user{i:07d}@{BENCH_EMAIL_DOMAIN}"
+
+
+def percentile(sorted_samples: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list (`p` in 0..100)."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, min(len(sorted_samples), round(p / 100 * len(sorted_samples) + 0.5)))
+    return sorted_samples[rank - 1]
+
+
+def latency_summary(samples: list[float]) -> dict:
+    """Summarizes latencies given in seconds, reported in milliseconds."""
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3) if samples else 0.0,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name: str, results: dict, out_path: str | None = None) -> str:
+    """Writes `results` plus run metadata as JSON and returns the file path.
+
+    Defaults to `bench/results/<name>-<commit>-<timestamp>.json`, so runs on
+    different commits sit side by side and can be diffed.
+    """
+    commit = git_commit()
+    document = {
+        "benchmark": name,
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if not out_path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        out_path = os.path.join(RESULTS_DIR, f"{name}-{commit or 'nogit'}-{stamp}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return out_path
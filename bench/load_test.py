@@ -0,0 +1,246 @@
+"""HTTP load test of the Flask API under gunicorn.
+
+    DB_HOST=localhost DB_NAME=l4t_bench DB_USER=... DB_PASSWORD=... \
+        python bench/load_test.py --sizes 10000,100000,1000000
+
+For each profile count: seeds the local Postgres (seed_profiles.py), starts
+gunicorn exactly as the Procfile does, then drives each route in turn with
+`--concurrency` closed-loop clients on keep-alive connections for
+`--duration` seconds. Reports requests/second, p50/p95/p99 latency and
+status counts per route, written as JSON to bench/results/.
+
+`--url` skips seeding and gunicorn and targets a server that is already up
+(its database must have been seeded with the same --sizes count).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, urlencode
+
+from common import REPO_DIR, BENCH_PASSWORD, bench_email, latency_summary, write_results
+
+# Both the server and this process must sign tokens with the same secret
+os.environ.setdefault("SESSION_SECRET", "bench-session-secret")
+
+from auth import issue_token
+
+ROUTES = ["get_entry", "login", "update_profile", "show_profiles"]
+SHOW_PROFILES_PAGE = 1000
+
+
+class Client:
+    """One closed-loop virtual user with its own keep-alive connection."""
+
+    def __init__(self, url: str, profiles: int, seed: int):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.profiles = profiles
+        self.rng = random.Random(seed)
+        self.conn = None
+        self.cursor = None      # show_profiles keyset cursor
+        self.tokens = {}
+
+    def request(self, method, path, body=None, headers=None) -> tuple[int, bytes]:
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except Exception:
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def _user(self) -> int:
+        return self.rng.randrange(self.profiles)
+
+    def _token(self, email):
+        token = self.tokens.get(email)
+        if token is None:
+            token = self.tokens[email] = issue_token(email)
+        return token
+
+    def get_entry(self):
+        query = urlencode({"month": self.rng.randint(1, 12), "day": self.rng.randint(1, 31)})
+        return self.request("GET", f"/get_entry?{query}")
+
+    def login(self):
+        body = json.dumps({"email": bench_email(self._user()), "password": BENCH_PASSWORD})
+        return self.request("POST", "/login", body, {"Content-Type": "application/json"})
+
+    def update_profile(self):
+        email = bench_email(self._user())
+        body = json.dumps({
+            "email": email,
+            "method": self.rng.choice(["email", "push"]),
+            "timezone": str(self.rng.randint(-11, 12)),
+            "time": f"{self.rng.randrange(24):02d}:{self.rng.randrange(60):02d}",
+        })
+        return self.request("POST", "/update_profile", body, {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self._token(email)}",
+        })
+
+    def show_profiles(self):
+        """Walks the NDJSON feed page by page, starting over at the end."""
+        params = {"format": "ndjson", "limit": SHOW_PROFILES_PAGE}
+        if self.cursor:
+            params["after"] = self.cursor
+        status, body = self.request("GET", f"/show_profiles?{urlencode(params)}")
+        if status == 200:
+            trailer = json.loads(body.rstrip(b"\n").rsplit(b"\n", 1)[-1])
+            self.cursor = trailer["_page"]["next"]
+        return status, body
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def run_route(url, route, profiles, concurrency, duration, warmup) -> dict:
+    """Drives one route with `concurrency` clients and summarizes the measured window."""
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+    latencies = [[] for _ in range(concurrency)]
+    statuses = [{} for _ in range(concurrency)]
+
+    def worker(i):
+        client = Client(url, profiles, seed=i)
+        call = getattr(client, route)
+        mine, counts = latencies[i], statuses[i]
+        while True:
+            began = time.monotonic()
+            if began >= stop_at:
+                break
+            try:
+                status, _ = call()
+            except Exception as e:
+                status = type(e).__name__
+            if began >= start_at:
+                mine.append(time.monotonic() - began)
+                counts[status] = counts.get(status, 0) + 1
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    samples = [s for per_client in latencies for s in per_client]
+    totals = {}
+    for counts in statuses:
+        for status, n in counts.items():
+            totals[str(status)] = totals.get(str(status), 0) + n
+    errors = sum(n for status, n in totals.items() if not status.startswith(("2", "3")))
+    result = {
+        "concurrency": concurrency,
+        "duration_seconds": duration,
+        "requests": len(samples),
+        "rps": round(len(samples) / duration, 1),
+        "errors": errors,
+        "statuses": totals,
+    }
+    result.update(latency_summary(samples))
+    return result
+
+
+def wait_until_up(url, timeout=30):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+def start_gunicorn(port, workers, threads) -> subprocess.Popen:
+    """Starts the app the way the Procfile does, bound to a local port."""
+    cmd = [
+        sys.executable, "-m", "gunicorn", "--pythonpath", "backend",
+        "--worker-class", "gthread", "--threads", str(threads), "--workers", str(workers),
+        "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "backend.app:app",
+    ]
+    return subprocess.Popen(cmd, cwd=REPO_DIR, env=dict(os.environ))
+
+
+def fetch_stats(url) -> dict | None:
+    parts = urlsplit(url)
+    try:
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+        conn.request("GET", "/stats")
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return json.loads(body) if response.status == 200 else None
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated profile counts")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="comma-separated routes to drive")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per route")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each route")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "2")))
+    parser.add_argument("--threads", type=int, default=4, help="gthread threads per worker (Procfile: 4)")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--out", help="results file (default: bench/results/...)")
+    args = parser.parse_args()
+
+    routes = [r for r in args.routes.split(",") if r]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        sys.exit(f"Unknown route(s): {', '.join(sorted(unknown))}")
+
+    runs = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        run = {"profiles": size, "workers": args.workers, "threads": args.threads, "routes": {}}
+        server = None
+        url = args.url
+        if not url:
+            from seed_profiles import seed
+            from db import close_pool
+            print(f"Seeding {size} profiles...", flush=True)
+            run["seed_seconds"] = round(seed(size), 2)
+            close_pool()
+            url = f"http://127.0.0.1:{args.port}"
+            server = start_gunicorn(args.port, args.workers, args.threads)
+        try:
+            wait_until_up(url)
+            for route in routes:
+                print(f"[{size} profiles] /{route}: {args.concurrency} clients for {args.duration:g}s...", flush=True)
+                result = run_route(url, route, size, args.concurrency, args.duration, args.warmup)
+                run["routes"][route] = result
+                print(f"  {result['rps']} req/s, p50 {result['p50_ms']}ms, p95 {result['p95_ms']}ms, "
+                      f"p99 {result['p99_ms']}ms, {result['errors']} errors", flush=True)
+            # Counters of whichever worker answers; enough to spot pool waits and 429s
+            run["server_stats"] = fetch_stats(url)
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=30)
+        runs.append(run)
+
+    path = write_results("load_test", {"runs": runs}, args.out)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Notifier tick benchmark: time to deliver to N users due in the same minute.
+
+    python bench/notifier_bench.py --users 1000,10000,50000
+
+Runs the notifier's real tick (`delivery.DeliveryRunner.run_tick`: ledger
+claim, rendering, batched email and push sends, ledger marks), or with
+`--mode async` the same users through `pipeline.DeliveryPipeline`, against a
+local stub SMTP server and a stub APNs client, with a fresh SQLite ledger per
+run. Each run is then repeated once to time the already-delivered path.
+Results are written as JSON to bench/results/.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+from common import REPO_DIR, bench_email, write_results
+
+# L4T_Calendar resolves its storage paths from the working directory
+os.chdir(REPO_DIR)
+
+import utils
+from L4T_calendar import L4T_Calendar
+from delivery import DeliveryRunner
+from pipeline import DeliveryPipeline
+from ledger import SQLiteLedger, SENT
+from mailer import EmailDispatcher, SMTPSessionPool
+from profile_source import Profile
+from push import PushDispatcher, PrecompiledJSONEncoder, PUSH_MAX_IN_FLIGHT
+from stubs import StubSMTPServer, StubAPNsClient
+
+
+def make_due(count: int, push_ratio: float, at: float, seed: int = 4041) -> list:
+    """`count` users all due at `at`, spread over every timezone."""
+    rng = random.Random(seed)
+    due = []
+    for i in range(count):
+        push = rng.random() < push_ratio
+        profile = Profile(
+            email=bench_email(i),
+            method="push" if push else "email",
+            timezone=str(rng.randint(-11, 12)),
+            time="00:00",   # informational only; `at` decides who is due
+            device_token=f"{rng.getrandbits(256):064x}" if push else None,
+        )
+        due.append((profile.email, profile, at))
+    return due
+
+
+async def deliver_async(runner, due) -> list:
+    """Sends `due` through the asyncio pipeline; returns the outcomes."""
+    outcomes = []
+    pipeline = DeliveryPipeline(runner, on_outcomes=outcomes.extend).start()
+    await pipeline.submit(due)
+    await pipeline.join()
+    await pipeline.stop()
+    return outcomes
+
+
+def run_once(count, args) -> dict:
+    smtp_server = StubSMTPServer(latency=args.smtp_latency).start()
+    apns_client = StubAPNsClient(
+        latency=args.apns_latency, unregistered_rate=args.unregistered_rate,
+        json_encoder=PrecompiledJSONEncoder,
+    )
+    email_dispatcher = EmailDispatcher(
+        SMTPSessionPool(None, None, host="127.0.0.1", port=smtp_server.port,
+                        size=args.smtp_sessions, starttls=False),
+        "bench@bench.l4t.invalid", args.smtp_sessions,
+    )
+    push_dispatcher = PushDispatcher(apns_client, "org.lead4tomorrow.bench", args.max_in_flight)
+
+    with tempfile.TemporaryDirectory(prefix="l4t-bench-") as tmp:
+        ledger = SQLiteLedger(os.path.join(tmp, "ledger.sqlite3"))
+        calendar = L4T_Calendar()
+        runner = DeliveryRunner(calendar, ledger, email_dispatcher, push_dispatcher)
+
+        at = (int(time.time()) // 60) * 60
+        due = make_due(count, args.push_ratio, at)
+
+        tick = runner.run_tick if args.mode == "threaded" else lambda d: asyncio.run(deliver_async(runner, d))
+
+        start = time.perf_counter()
+        outcomes = tick(due)
+        seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        repeat = tick(due)
+        repeat_seconds = time.perf_counter() - start
+
+    email_dispatcher.close()
+    smtp_server.stop()
+
+    sent = sum(1 for _, _, status, _ in outcomes if status == SENT)
+    return {
+        "users": count,
+        "seconds": round(seconds, 4),
+        "deliveries_per_second": round(count / seconds, 1) if seconds else None,
+        "sent": sent,
+        "failed": len(outcomes) - sent,
+        "repeat_tick_seconds": round(repeat_seconds, 4),
+        "repeat_tick_outcomes": len(repeat),
+        "smtp_messages": smtp_server.messages,
+        "apns_notifications": apns_client.notifications,
+        "email": dict(email_dispatcher.stats),
+        "push": dict(push_dispatcher.stats),
+        "smtp_sessions": dict(email_dispatcher.pool.stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1000,10000,50000", help="comma-separated due-user counts")
+    parser.add_argument("--push-ratio", type=float, default=0.5, help="share of users on push")
+    parser.add_argument("--smtp-latency", type=float, default=0.05, help="seconds per SMTP message ack")
+    parser.add_argument("--smtp-sessions", type=int, default=3, help="SMTP pool size (SMTP_POOL_SIZE)")
+    parser.add_argument("--apns-latency", type=float, default=0.05, help="seconds per wave of APNs streams")
+    parser.add_argument("--unregistered-rate", type=float, default=0.0, help="share of tokens APNs rejects")
+    parser.add_argument("--max-in-flight", type=int, default=PUSH_MAX_IN_FLIGHT)
+    parser.add_argument("--mode", choices=("threaded", "async"), default="threaded", help="NOTIFIER_MODE")
+    parser.add_argument("--log-level", default="WARNING", help="notifier log level during the run")
+    parser.add_argument("--out", help="results file (default: bench/results/...)")
+    args = parser.parse_args()
+
+    # The notifier's own logging pipeline, so its cost is part of the measurement
+    utils.config_log(default_format="json")
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    runs = []
+    for count in (int(n) for n in args.users.split(",")):
+        print(f"Tick with {count} due users...", flush=True)
+        run = run_once(count, args)
+        print(f"  {run['seconds']}s ({run['deliveries_per_second']}/s), {run['sent']} sent, "
+              f"{run['failed']} failed; repeat tick {run['repeat_tick_seconds']}s", flush=True)
+        runs.append(run)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("users", "out")}
+    path = write_results("notifier_tick", {"config": config, "runs": runs}, args.out)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
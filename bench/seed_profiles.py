@@ -0,0 +1,94 @@
+"""Seeds a (local!) Postgres with synthetic profiles for the load tests.
+
+    DB_HOST=localhost DB_NAME=l4t_bench DB_USER=... DB_PASSWORD=... \
+        python bench/seed_profiles.py 100000
+
+Replaces every previously seeded user (emails under BENCH_EMAIL_DOMAIN) with
+`count` new ones, streamed in with COPY so 1M rows take seconds and constant
+memory. Half the users get email, half push; times and timezones are spread
+so every UTC send minute has someone due. All users share BENCH_PASSWORD.
+"""
+import sys
+import time
+import random
+import argparse
+
+from common import BENCH_PASSWORD, BENCH_EMAIL_DOMAIN, bench_email
+
+import bcrypt
+from db import DB_HOST, get_connection, close_pool
+from schema import migrate
+from hashing import BCRYPT_ROUNDS
+
+# Mirrors the production `profiles` table, which predates schema.py
+PROFILES_TABLE = """
+    CREATE TABLE IF NOT EXISTS profiles (
+        email text PRIMARY KEY,
+        password text,
+        phone text,
+        carrier text,
+        method text,
+        timezone text,
+        time text,
+        device_token text
+    )
+"""
+
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+
+def profile_rows(count: int, password_hash: str, rng_seed: int):
+    rng = random.Random(rng_seed)
+    for i in range(count):
+        method = "push" if i % 2 else "email"
+        yield (
+            bench_email(i),
+            password_hash,
+            method,
+            str(rng.randint(-11, 12)),
+            f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+            f"{rng.getrandbits(256):064x}" if method == "push" else None,
+        )
+
+
+def seed(count: int, rounds: int = BCRYPT_ROUNDS, rng_seed: int = 4041) -> float:
+    """Replaces the seeded users with `count` new ones. Returns the seconds taken."""
+    start = time.perf_counter()
+    # One hash shared by every user: hashing 1M passwords would take days
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(PROFILES_TABLE)
+        cur.close()
+    migrate()
+
+    with get_connection() as conn:
+        with conn.transaction():
+            cur = conn.cursor()
+            cur.execute("DELETE FROM profiles WHERE email LIKE %s", (f"%@{BENCH_EMAIL_DOMAIN}",))
+            with cur.copy(
+                "COPY profiles (email, password, method, timezone, time, device_token) FROM STDIN"
+            ) as copy:
+                for row in profile_rows(count, password_hash, rng_seed):
+                    copy.write_row(row)
+            cur.close()
+        cur = conn.cursor()
+        cur.execute("ANALYZE profiles")
+        cur.close()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("count", type=int, help="number of profiles to seed")
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS, help="bcrypt cost of the shared password hash")
+    parser.add_argument("--allow-remote", action="store_true", help="seed even if DB_HOST is not local")
+    args = parser.parse_args()
+
+    if DB_HOST not in LOCAL_HOSTS and not args.allow_remote:
+        sys.exit(f"Refusing to seed non-local DB_HOST={DB_HOST!r} (use --allow-remote)")
+
+    seconds = seed(args.count, args.rounds)
+    close_pool()
+    print(f"Seeded {args.count} profiles in {seconds:.1f}s")
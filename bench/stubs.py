@@ -0,0 +1,120 @@
+"""Stand-ins for the mail and push providers used by the notifier benchmark."""
+import json
+import time
+import random
+import threading
+import socketserver
+
+from push import SUCCESS
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def reply(self, line: str):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        self.reply("220 stub-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line[:4].upper()
+            if verb in (b"EHLO", b"HELO"):
+                self.reply("250 stub-smtp")
+            elif verb in (b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                self.reply("250 OK")
+            elif verb == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b".\r\n":
+                        break
+                    size += len(data)
+                if server.latency:
+                    time.sleep(server.latency)
+                with server.lock:
+                    server.messages += 1
+                    server.bytes += size
+                self.reply("250 OK queued")
+            elif verb == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    """A local SMTP server that accepts and counts every message.
+
+    `latency`: seconds to wait before acknowledging each message, to stand in
+    for a real provider's round trip. No STARTTLS and no AUTH: point an
+    `SMTPSessionPool` at it with `starttls=False` and no username.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), _SMTPHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "StubSMTPServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class StubAPNsClient:
+    """Mimics `apns2.client.APNsClient.send_notification_batch`.
+
+    Streams are answered in waves of `max_concurrent_streams` (what APNs
+    advertises per connection, typically 500), each wave taking `latency`
+    seconds, so a batch of n costs about `ceil(n / max_concurrent_streams) *
+    latency`. A fraction
+    `unregistered_rate` of tokens answer `Unregistered`. Payloads are
+    serialized with the client's JSON encoder just like the real client.
+    """
+
+    def __init__(self, latency: float = 0.05, max_concurrent_streams: int = 500,
+                 unregistered_rate: float = 0.0, json_encoder=None, seed: int = 0):
+        self.latency = latency
+        self.max_concurrent_streams = max_concurrent_streams
+        self.unregistered_rate = unregistered_rate
+        self.json_encoder = json_encoder
+        self._rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.notifications = 0
+        self.bytes = 0
+
+    def send_notification_batch(self, notifications, topic=None, priority=None, expiration=None, collapse_id=None):
+        results = {}
+        size = 0
+        for i, notification in enumerate(notifications):
+            if i and i % self.max_concurrent_streams == 0 and self.latency:
+                time.sleep(self.latency)
+            size += len(json.dumps(notification.payload.dict(), ensure_ascii=False,
+                                   separators=(",", ":"), cls=self.json_encoder).encode("utf-8"))
+            failed = self.unregistered_rate and self._rng.random() < self.unregistered_rate
+            results[notification.token] = "Unregistered" if failed else SUCCESS
+        if notifications and self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.notifications += len(notifications)
+            self.bytes += size
+        return results
@@ -0,0 +1,11 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(REPO_DIR, "backend")
+
+# The backend modules import each other by bare name (gunicorn --pythonpath backend)
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("SESSION_SECRET", "test-session-secret")
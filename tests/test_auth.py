@@ -0,0 +1,40 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from conftest import BACKEND_DIR
+
+
+@pytest.fixture
+def client():
+    import app
+    app.app.config["TESTING"] = True
+    return app.app.test_client()
+
+
+def test_delete_profile_without_token_is_rejected(client, monkeypatch):
+    import app
+
+    def no_db():
+        raise AssertionError("the database must not be reached")
+
+    monkeypatch.setattr(app, "get_connection", no_db)
+    response = client.post("/delete_profile", json={"email": "someone@example.com"})
+    assert response.status_code == 401
+
+
+def test_token_for_another_email_is_rejected(client):
+    from auth import issue_token
+    response = client.get("/get_profile", query_string={"email": "victim@example.com"},
+                          headers={"Authorization": f"Bearer {issue_token('attacker@example.com')}"})
+    assert response.status_code == 403
+
+
+def test_missing_session_secret_fails_at_import():
+    env = {k: v for k, v in os.environ.items() if k not in ("SESSION_SECRET", "FLASK_DEBUG")}
+    result = subprocess.run([sys.executable, "-c", "import auth"], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "SESSION_SECRET is not set" in result.stderr
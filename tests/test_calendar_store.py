@@ -0,0 +1,91 @@
+import os
+import json
+import shutil
+
+import pytest
+
+import calendar_store
+import content_build
+from calendar_store import ContentError, ReloadingStore, EntryWriter, load_or_build
+
+
+def copy_content(tmp_path):
+    source = str(tmp_path / "entries_shifted.json")
+    shutil.copy(calendar_store.DEFAULT_SOURCE_PATH, source)
+    return source, str(tmp_path / "calendar.bin")
+
+
+def rewrite(path, edit):
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    edit(entries)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f)
+    # Newer than the compiled store even on coarse-mtime filesystems
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_full_build_from_entries_json_reproduces_served_content():
+    source = content_build.load_json(content_build.ENTRIES_PATH)
+    served = content_build.load_json(calendar_store.DEFAULT_SOURCE_PATH)
+    output, manifest, _ = content_build.build_content(source, None, None, "full")
+    assert output == served
+    assert manifest == content_build.load_json(content_build.MANIFEST_PATH)
+
+
+def test_invalid_content_is_not_served(tmp_path):
+    source, store_path = copy_content(tmp_path)
+    store = ReloadingStore(source, store_path, interval=0)
+    original = store.text(7, 31)
+
+    rewrite(source, lambda entries: entries["7"].pop("31"))
+    assert store.reload() is False
+    assert store.text(7, 31) == original
+    # A new process serves the last good store too
+    assert load_or_build(source, store_path).text(7, 31) == original
+
+    rewrite(source, lambda entries: entries["7"].update({"31": "Fixed."}))
+    assert store.reload() is True
+    assert store.text(7, 31) == "Fixed."
+
+
+def test_invalid_content_without_a_store_raises(tmp_path):
+    source, store_path = copy_content(tmp_path)
+    rewrite(source, lambda entries: entries["2"].update({"30": "No such day."}))
+    with pytest.raises(ContentError) as e:
+        load_or_build(source, store_path)
+    assert e.value.problems == ["month 2: has days 1-28, 30, expected 1..28 or 29"]
+
+
+def test_invalid_edits_are_dropped(tmp_path):
+    source, store_path = copy_content(tmp_path)
+    store = ReloadingStore(source, store_path, interval=0)
+    writer = EntryWriter(store, delay=60)
+
+    writer.set("3", "5", "")
+    assert writer.flush() == 0
+    assert store.text(3, 5)
+
+    writer.set("3", "5", "New entry.")
+    assert writer.flush() == 1
+    assert store.text(3, 5) == "New entry."
+
+
+def test_month_and_day_keys_parse_the_same_everywhere(tmp_path):
+    store = load_or_build(*copy_content(tmp_path))
+    unknown = bytes(store.entry_body("13", None).identity)
+    for key in ("01", "+1", " 1", "1.0", "١"):
+        assert bytes(store.entry_body(key, "1").identity) == unknown
+        assert store.month_body(key) is None
+    assert json.loads(bytes(store.month_body("1").identity))["month"] == "1"
+    assert json.loads(bytes(store.entry_body("1", "01").identity))["entry"] == ""
+    assert json.loads(bytes(store.entry_body("1", "1").identity))["entry"] == store.text(1, 1)
+
+
+def test_store_from_an_older_version_is_rebuilt(tmp_path):
+    source, store_path = copy_content(tmp_path)
+    load_or_build(source, store_path).close()
+    with open(store_path, "r+b") as f:
+        f.write(b"OLDMAGIC")
+    assert load_or_build(source, store_path).text(1, 1)
@@ -0,0 +1,23 @@
+import importlib
+
+import feedback
+
+
+def default_feedback(monkeypatch, **env):
+    monkeypatch.delenv("NOTIFIER_FEEDBACK", raising=False)
+    monkeypatch.delenv("NOTIFIER_PROFILE_SOURCE", raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    try:
+        return importlib.reload(feedback).NOTIFIER_FEEDBACK
+    finally:
+        monkeypatch.undo()
+        importlib.reload(feedback)
+
+
+def test_feedback_is_off_unless_the_notifier_already_uses_the_database(monkeypatch):
+    assert default_feedback(monkeypatch) == "off"
+    assert default_feedback(monkeypatch, NOTIFIER_PROFILE_SOURCE="http") == "off"
+    assert default_feedback(monkeypatch, NOTIFIER_PROFILE_SOURCE="postgres") == "postgres"
+    assert default_feedback(monkeypatch, NOTIFIER_FEEDBACK="postgres") == "postgres"
+    assert feedback.open_feedback("off") is None
@@ -0,0 +1,48 @@
+import sqlite3
+
+from ledger import SQLiteLedger, CLAIMED, FAILED, SENT, CLAIM_EXPIRED
+
+
+def rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {(email, date): (status, detail) for email, date, status, detail in
+                conn.execute("SELECT email, local_date, status, detail FROM delivery_ledger")}
+    finally:
+        conn.close()
+
+
+def test_claims_left_by_a_crash_expire_as_failed(tmp_path, monkeypatch):
+    path = str(tmp_path / "ledger.sqlite3")
+    ledger = SQLiteLedger(path)
+    monkeypatch.setattr("time.time", lambda: 1_000_000.0)
+    ledger.claim_many([("a@example.com", "2026-10-17"), ("b@example.com", "2026-10-17")])
+    ledger.mark_many([("b@example.com", "2026-10-17", SENT, None)])
+
+    # A worker claiming later doesn't get the orphaned row back
+    assert ledger.claim_many([("a@example.com", "2026-10-17")]) == set()
+    assert ledger.expire_claims(1_000_000.0 + 60, lease_seconds=600) == 0
+    assert ledger.expire_claims(1_000_000.0 + 601, lease_seconds=600) == 1
+    assert rows(path) == {
+        ("a@example.com", "2026-10-17"): (FAILED, CLAIM_EXPIRED),
+        ("b@example.com", "2026-10-17"): (SENT, None),
+    }
+
+
+def test_claims_in_an_older_ledger_get_a_claim_time(tmp_path):
+    path = str(tmp_path / "ledger.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE delivery_ledger (
+            email TEXT NOT NULL, local_date TEXT NOT NULL, status TEXT NOT NULL, detail TEXT, worker TEXT,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (email, local_date)
+        )
+    """)
+    conn.execute("INSERT INTO delivery_ledger (email, local_date, status, updated_at) "
+                 "VALUES ('a@example.com', '2020-01-01', ?, '2020-01-01 09:00:00')", (CLAIMED,))
+    conn.commit()
+    conn.close()
+
+    ledger = SQLiteLedger(path)
+    assert ledger.expire_claims(1_577_869_200.0 + 59, lease_seconds=60) == 0   # 2020-01-01 09:00:00 UTC
+    assert ledger.expire_claims(1_577_869_200.0 + 61, lease_seconds=60) == 1
@@ -0,0 +1,39 @@
+import threading
+
+import metrics
+
+
+def run_threads(count, fn):
+    threads = [threading.Thread(target=fn) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_exited_threads_cells_are_folded_into_the_total():
+    registry = metrics.Registry()
+    counter = metrics.Counter("test_total", "test", ["kind"], registry=registry)
+    histogram = metrics.Histogram("test_seconds", "test", buckets=(1, 2), registry=registry)
+
+    def work():
+        counter.labels("a").inc()
+        counter.labels("b").inc(2)
+        histogram.observe(1.5)
+
+    for _ in range(5):
+        run_threads(50, work)
+
+    assert len(counter._threads) == 0
+    assert len(histogram._threads) == 0
+    assert counter.values() == {("a",): 250, ("b",): 500}
+    assert 'test_seconds_bucket{le="2"} 250' in registry.render()
+    assert "test_seconds_count 250" in registry.render()
+
+
+def test_live_thread_keeps_its_cell():
+    counter = metrics.Counter("test_live_total", "test", registry=metrics.Registry())
+    counter.inc(3)
+    run_threads(3, counter.inc)
+    assert len(counter._threads) == 1
+    assert counter.values() == {(): 6}
@@ -0,0 +1,107 @@
+import threading
+
+import profile_cache
+from profile_cache import ProfileCache, LocalBackend, RedisBackend, default_backend
+
+
+class FakeRedis:
+    """The commands RedisBackend uses, over one dict shared like a real server (expiry not modelled)."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value.encode("utf-8") if isinstance(value, str) else value
+            return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match, count=None):
+        return [k for k in list(self.data) if k.startswith(match.rstrip("*"))]
+
+
+class Database:
+    def __init__(self):
+        self.rows = {"a@example.com": {"time": "09:00"}}
+        self.reads = 0
+
+    def load(self, email):
+        self.reads += 1
+        row = self.rows.get(email)
+        return dict(row) if row else None
+
+
+def test_invalidation_reaches_every_worker_sharing_the_backend():
+    db, server = Database(), FakeRedis()
+    worker_a = ProfileCache(db.load, RedisBackend(client=server))
+    worker_b = ProfileCache(db.load, RedisBackend(client=server))
+
+    assert worker_a.get("a@example.com") == {"time": "09:00"}
+    assert worker_b.get("a@example.com") == {"time": "09:00"}
+    assert db.reads == 1   # b was served what a cached
+
+    # Worker b handles an update_profile
+    db.rows["a@example.com"] = {"time": "07:30"}
+    worker_b.invalidate("a@example.com")
+
+    assert worker_a.get("a@example.com") == {"time": "07:30"}
+
+
+def test_read_started_before_another_workers_write_is_not_cached():
+    db, server = Database(), FakeRedis()
+    reading = threading.Event()
+    written = threading.Event()
+
+    def slow_load(email):
+        row = db.load(email)
+        reading.set()
+        written.wait(5)
+        return row
+
+    worker_a = ProfileCache(slow_load, RedisBackend(client=server))
+    worker_b = ProfileCache(db.load, RedisBackend(client=server))
+    reader = threading.Thread(target=worker_a.get, args=("a@example.com",))
+    reader.start()
+    reading.wait(5)
+    db.rows["a@example.com"] = {"time": "07:30"}
+    worker_b.invalidate("a@example.com")
+    written.set()
+    reader.join(5)
+
+    assert worker_b.get("a@example.com") == {"time": "07:30"}
+
+
+def test_concurrent_misses_share_one_load():
+    db = Database()
+    release = threading.Event()
+
+    def slow_load(email):
+        release.wait(5)
+        return db.load(email)
+
+    cache = ProfileCache(slow_load, LocalBackend())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("a@example.com"))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert db.reads == 1
+    assert results == [{"time": "09:00"}] * 10
+
+
+def test_several_workers_without_shared_backend_disable_caching():
+    backend = default_backend(url="", workers=4)
+    backend.set("a@example.com", {"time": "09:00"})
+    assert backend.get("a@example.com") is None
+    assert default_backend(url="", workers=1).max_entries == profile_cache.PROFILE_CACHE_SIZE
@@ -0,0 +1,147 @@
+import threading
+import contextlib
+
+import push   # first: patches collections for apns2's hyper dependency
+from push import PushDispatcher, SUCCESS, INDETERMINATE
+from rendering import render
+from retry import RetryQueue
+
+
+class FakeResponse:
+    status = 200
+    headers = {}
+
+
+class FakeConnection:
+    """Records requests and answers the first `answered` streams, then fails like a dropped connection.
+
+    Streams in `lost` fail too.
+    """
+
+    def __init__(self, answered, lost=()):
+        self.answered = answered
+        self.lost = set(lost)
+        self.requests = []   # (url, body, headers)
+
+    def request(self, method, url, body, headers):
+        self.requests.append((url, body, headers))
+        return len(self.requests)
+
+    @contextlib.contextmanager
+    def get_response(self, stream_id):
+        if stream_id > self.answered or stream_id in self.lost:
+            raise ConnectionResetError("connection lost")
+        yield FakeResponse()
+
+
+class FakeCredentials:
+    def get_authorization_header(self, topic):
+        return None
+
+
+class FakeAPNsClient(push._APNsClient):
+    """The real client's send path over a fake connection allowing 2 concurrent streams."""
+
+    def __init__(self, answered=float("inf"), lost=()):
+        self._reset_progress()
+        self._connection = FakeConnection(answered, lost)
+        self._APNsClient__credentials = FakeCredentials()
+        self._APNsClient__json_encoder = push.PrecompiledJSONEncoder
+
+    def connect(self):
+        pass
+
+    def update_max_concurrent_streams(self):
+        self._APNsClient__max_concurrent_streams = 2
+
+
+def rendered_payload():
+    rendered = render("Theme", "Entry.", {"month": "1", "day": "2"}, {"month": "January", "day": "Monday"})
+    return push.PrecompiledPayload(rendered.apns_payload, rendered.apns_payload_bytes)
+
+
+def test_precompiled_payload_goes_through_the_real_send_path():
+    client = FakeAPNsClient()
+    payload = rendered_payload()
+    tokens = [f"{i:064x}" for i in range(3)]
+
+    results = PushDispatcher(client, "org.example.app").send_batch([(t, payload) for t in tokens])
+
+    assert results == {t: SUCCESS for t in tokens}
+    assert [url for url, _, _ in client._connection.requests] == [f"/3/device/{t}" for t in tokens]
+    for _, body, headers in client._connection.requests:
+        assert body == payload.dict().encoded.encode("utf-8")
+        assert headers["apns-topic"] == "org.example.app"
+        assert headers["apns-push-type"] == "alert"
+
+
+def test_mid_chunk_failure_keeps_delivered_tokens_out_of_the_retry_queue():
+    tokens = [f"{i:064x}" for i in range(4)]
+    payload = rendered_payload()
+
+    # Streams 1-2 open, stream 1 answers, stream 3 opens, then stream 2's response fails
+    results = PushDispatcher(FakeAPNsClient(answered=1), "topic").send_batch([(t, payload) for t in tokens])
+
+    assert results == {
+        tokens[0]: SUCCESS,            # delivered
+        tokens[1]: INDETERMINATE,      # sent, no answer
+        tokens[2]: INDETERMINATE,
+        tokens[3]: "ConnectionResetError",   # never sent
+    }
+
+    class Ledger:
+        def retry_count(self):
+            return 0
+
+    failures = [(t, "2026-01-01", r, 0, 0.0) for t, r in results.items() if r != SUCCESS]
+    retries, final = RetryQueue(Ledger(), max_age=float("inf")).plan(failures)
+    assert [r[0] for r in retries] == [tokens[3]]
+    assert sorted(o[0] for o in final) == sorted(tokens[1:3])
+
+
+def test_concurrent_batch_does_not_disturb_a_failed_batchs_results():
+    main_started, started = threading.Event(), threading.Event()
+
+    class Client(FakeAPNsClient):
+        def send_notification_batch(self, *args, **kwargs):
+            (main_started if threading.current_thread() is threading.main_thread() else started).set()
+            return super().send_notification_batch(*args, **kwargs)
+
+    class Dispatcher(PushDispatcher):
+        def _salvage(self, chunk, reason):
+            # Gives the other thread's batch every chance to start first
+            started.wait(0.5)
+            return super()._salvage(chunk, reason)
+
+    dispatcher = Dispatcher(Client(lost={2}), "topic")
+    payload = rendered_payload()
+    tokens = [f"{i:064x}" for i in range(4)]
+    other_tokens = [f"{i:064x}" for i in range(10, 13)]
+    other_results = {}
+
+    def send_other():
+        main_started.wait()
+        other_results.update(dispatcher.send_batch([(t, payload) for t in other_tokens]))
+
+    other = threading.Thread(target=send_other)
+    other.start()
+    results = dispatcher.send_batch([(t, payload) for t in tokens])
+    other.join()
+
+    assert results == {
+        tokens[0]: SUCCESS,
+        tokens[1]: INDETERMINATE,
+        tokens[2]: INDETERMINATE,
+        tokens[3]: "ConnectionResetError",
+    }
+    assert other_results == {t: SUCCESS for t in other_tokens}
+
+
+def test_untracked_client_failure_is_indeterminate():
+    class Broken:
+        def send_notification_batch(self, *args, **kwargs):
+            raise ConnectionResetError()
+
+    payload = push.PrecompiledPayload({"aps": {}}, b'{"aps":{}}')
+    results = PushDispatcher(Broken(), "topic").send_batch([("a" * 64, payload)])
+    assert results == {"a" * 64: INDETERMINATE}